@@ -0,0 +1,248 @@
+# api/bq_writer.py
+"""
+Write-behind, micro-batching BigQuery streaming inserts.
+
+Rows are buffered per table and sent with one insert_rows_json call per
+batch. A table is flushed when it holds BQ_BATCH_ROWS rows or BQ_BATCH_BYTES
+of JSON, when its oldest row is BQ_FLUSH_INTERVAL_S old, or BQ_LINGER_S after
+a caller started waiting on its rows (so concurrent writers share a round
+trip). When BQ_BUFFER_MAX_ROWS rows are buffered, submit() blocks until the
+flusher catches up (backpressure).
+
+submit() returns a concurrent Future resolving to that call's row errors (the
+insert_rows_json shape, indexes relative to the submitted rows); callers that
+need read-after-write wait on it, others fire and forget. close() flushes
+everything and stops the flusher thread.
+
+BQ_WRITE_BEHIND=0 turns batching off: every submit inserts inline.
+"""
+import os, json, time, asyncio, logging, threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+log = logging.getLogger("orbit-trace")
+
+BQ_WRITE_BEHIND = os.getenv("BQ_WRITE_BEHIND", "1").lower() not in ("0", "false", "no")
+BQ_BATCH_ROWS = int(os.getenv("BQ_BATCH_ROWS", "500"))
+BQ_BATCH_BYTES = int(os.getenv("BQ_BATCH_BYTES", str(5 * 1024 * 1024)))   # streaming insert limit is 10 MB
+BQ_FLUSH_INTERVAL_S = float(os.getenv("BQ_FLUSH_INTERVAL_S", "1.0"))
+BQ_LINGER_S = float(os.getenv("BQ_LINGER_S", "0.02"))
+BQ_BUFFER_MAX_ROWS = int(os.getenv("BQ_BUFFER_MAX_ROWS", "10000"))
+BQ_BACKPRESSURE_TIMEOUT_S = float(os.getenv("BQ_BACKPRESSURE_TIMEOUT_S", "30"))
+
+
+@dataclass
+class _Ticket:
+    rows: List[dict]
+    nbytes: int
+    urgent: bool
+    future: Future = field(default_factory=Future)
+    ts: float = field(default_factory=time.monotonic)
+
+
+class _Buffer:
+    def __init__(self):
+        self.tickets: List[_Ticket] = []
+        self.rows = 0
+        self.nbytes = 0
+        self.urgent_since: Optional[float] = None
+
+    def deadline(self) -> float:
+        due = self.tickets[0].ts + BQ_FLUSH_INTERVAL_S
+        if self.urgent_since is not None:
+            due = min(due, self.urgent_since + BQ_LINGER_S)
+        return due
+
+    def full(self) -> bool:
+        return self.rows >= BQ_BATCH_ROWS or self.nbytes >= BQ_BATCH_BYTES
+
+    def take(self) -> List[_Ticket]:
+        """Pop tickets for one batch (whole tickets only; an oversized one goes alone)."""
+        batch, rows, nbytes = [], 0, 0
+        while self.tickets:
+            t = self.tickets[0]
+            if batch and (rows + len(t.rows) > BQ_BATCH_ROWS or nbytes + t.nbytes > BQ_BATCH_BYTES):
+                break
+            batch.append(self.tickets.pop(0))
+            rows += len(t.rows)
+            nbytes += t.nbytes
+        self.rows -= rows
+        self.nbytes -= nbytes
+        urgent = [t.ts for t in self.tickets if t.urgent]
+        self.urgent_since = min(urgent) if urgent else None
+        return batch
+
+
+class BQWriter:
+    def __init__(self, client_factory: Callable[[], object], enabled: bool = BQ_WRITE_BEHIND,
+                 max_buffered_rows: int = BQ_BUFFER_MAX_ROWS):
+        self.client_factory = client_factory
+        self.enabled = enabled
+        self.max_buffered_rows = max_buffered_rows
+        self._buffers: Dict[str, _Buffer] = {}
+        self._buffered = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._force = False
+        self._closed = False
+        self.stats = {"submitted_rows": 0, "batches": 0, "rows_written": 0, "row_errors": 0,
+                      "failed_batches": 0, "backpressure_waits": 0, "last_batch_ms": 0.0}
+
+    # ---- producer side ----
+    def submit(self, table: str, rows: List[dict], wait_hint: bool = False) -> Future:
+        """
+        Queue rows for table. wait_hint=True means the caller will wait on the
+        future, so the batch is sent after BQ_LINGER_S instead of the full interval.
+        """
+        if not rows:
+            fut: Future = Future()
+            fut.set_result([])
+            return fut
+        if not self.enabled:
+            return self._insert_now(table, rows)
+
+        ticket = _Ticket(rows, sum(len(json.dumps(r, default=str)) for r in rows), wait_hint)
+        with self._cond:
+            if self._closed:
+                inline = True
+            else:
+                inline = False
+                self._enqueue(table, ticket)
+        return self._insert_now(table, rows) if inline else ticket.future
+
+    def _enqueue(self, table: str, ticket: _Ticket):
+        """Add a ticket to its table's buffer, waiting while the buffer is full. Called with the lock held."""
+        n = len(ticket.rows)
+        self._ensure_thread()
+        if self._buffered and self._buffered + n > self.max_buffered_rows:
+            self.stats["backpressure_waits"] += 1
+            deadline = time.monotonic() + BQ_BACKPRESSURE_TIMEOUT_S
+            while self._buffered and self._buffered + n > self.max_buffered_rows:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise TimeoutError(f"BigQuery write buffer full ({self._buffered} rows pending)")
+                self._cond.wait(left)
+        buf = self._buffers.setdefault(table, _Buffer())
+        buf.tickets.append(ticket)
+        buf.rows += n
+        buf.nbytes += ticket.nbytes
+        if ticket.urgent and buf.urgent_since is None:
+            buf.urgent_since = ticket.ts
+        self._buffered += n
+        self.stats["submitted_rows"] += n
+        self._cond.notify_all()
+
+    def write(self, table: str, rows: List[dict], timeout: Optional[float] = None) -> list:
+        """Queue rows and block until they are written. Returns the row errors."""
+        return self.submit(table, rows, wait_hint=True).result(timeout)
+
+    async def awrite(self, table: str, rows: List[dict]) -> list:
+        """write() for async handlers; backpressure waits happen off the event loop."""
+        fut = await asyncio.to_thread(self.submit, table, rows, True)
+        return await asyncio.wrap_future(fut)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Send everything buffered now and wait for it."""
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._buffered and not self._in_flight, timeout)
+
+    def close(self, timeout: Optional[float] = 30):
+        """Flush and stop the flusher thread; later submits insert inline."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # ---- flusher side ----
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="bq-writer", daemon=True)
+            self._thread.start()
+
+    def _due_batches(self) -> List[tuple]:
+        now, force = time.monotonic(), self._force or self._closed
+        out = []
+        for table, buf in self._buffers.items():
+            while buf.tickets and (force or buf.full() or now >= buf.deadline()):
+                out.append((table, buf.take()))
+        return out
+
+    def _next_wakeup(self) -> Optional[float]:
+        deadlines = [b.deadline() for b in self._buffers.values() if b.tickets]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batches = self._due_batches()
+                while not batches:
+                    if self._closed and not self._buffered:
+                        return
+                    self._force = False
+                    self._cond.notify_all()
+                    self._cond.wait(self._next_wakeup())
+                    batches = self._due_batches()
+                n = sum(len(t.rows) for _, tickets in batches for t in tickets)
+                self._buffered -= n
+                self._in_flight += n
+                self._cond.notify_all()   # room in the buffer again
+            try:
+                for table, tickets in batches:
+                    self._send(table, tickets)
+            finally:
+                with self._cond:
+                    self._in_flight -= n
+                    self._cond.notify_all()
+
+    def _send(self, table: str, tickets: List[_Ticket]):
+        rows = [r for t in tickets for r in t.rows]
+        t0 = time.perf_counter()
+        try:
+            errs = self.client_factory().insert_rows_json(table, rows) or []
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            log.warning(f"bq_writer: insert of {len(rows)} row(s) into {table} failed: {e}")
+            for t in tickets:
+                t.future.set_exception(e)
+            return
+        self.stats["last_batch_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        self.stats["batches"] += 1
+        self.stats["rows_written"] += len(rows)
+        self.stats["row_errors"] += len(errs)
+        if errs:
+            log.warning(f"bq_writer: {len(errs)} row error(s) inserting into {table}: {errs[:3]}")
+        offset = 0
+        for t in tickets:
+            mine = [
+                {**e, "index": e["index"] - offset} for e in errs
+                if isinstance(e, dict) and offset <= e.get("index", -1) < offset + len(t.rows)
+            ]
+            # Errors without a row index apply to the whole batch
+            mine += [e for e in errs if not isinstance(e, dict) or "index" not in e]
+            offset += len(t.rows)
+            t.future.set_result(mine)
+
+    def _insert_now(self, table: str, rows: List[dict]) -> Future:
+        fut: Future = Future()
+        try:
+            fut.set_result(self.client_factory().insert_rows_json(table, rows) or [])
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def metrics(self) -> dict:
+        with self._cond:
+            buffered = {t: b.rows for t, b in self._buffers.items() if b.rows}
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "buffered_rows": buffered,
+            "rows_per_batch": round(self.stats["rows_written"] / batches, 2) if batches else 0.0,
+        }
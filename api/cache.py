@@ -0,0 +1,386 @@
+# api/cache.py
+"""
+Small two-tier key/value cache: an in-process LRU with TTL in front of an
+optional on-disk SQLite tier. Values must be JSON-serialisable.
+"""
+import os, json, time, sqlite3, hashlib, logging, tempfile, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+log = logging.getLogger("orbit-trace")
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "orbit-cache"))
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_MAX_ITEMS = int(os.getenv("LLM_CACHE_MAX_ITEMS", "512"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.sqlite3"))
+
+EXTRACT_CACHE_ENABLED = os.getenv("EXTRACT_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+EXTRACT_CACHE_TTL = int(os.getenv("EXTRACT_CACHE_TTL", str(7 * 24 * 3600)))
+EXTRACT_CACHE_MAX_ITEMS = int(os.getenv("EXTRACT_CACHE_MAX_ITEMS", "64"))  # texts can be large; keep few in memory
+EXTRACT_CACHE_PATH = os.getenv("EXTRACT_CACHE_PATH", os.path.join(CACHE_DIR, "extract_cache.sqlite3"))
+
+# Results are dropped on local writes; the TTL bounds staleness from writes made by other instances
+PROJECT_CACHE_ENABLED = os.getenv("PROJECT_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+PROJECT_CACHE_TTL = int(os.getenv("PROJECT_CACHE_TTL", "300"))
+PROJECT_CACHE_MAX_ITEMS = int(os.getenv("PROJECT_CACHE_MAX_ITEMS", "256"))
+TRACE_CACHE_ENABLED = os.getenv("TRACE_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+TRACE_CACHE_TTL = int(os.getenv("TRACE_CACHE_TTL", "300"))
+TRACE_CACHE_MAX_ITEMS = int(os.getenv("TRACE_CACHE_MAX_ITEMS", "512"))
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL (seconds, 0 = never expires)."""
+
+    def __init__(self, max_items: int = 512, ttl: int = 3600):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, expires_at: Optional[float] = None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent tier. One table per cache name inside a shared SQLite file."""
+
+    def __init__(self, path: str, table: str = "cache", ttl: int = 3600):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "k TEXT PRIMARY KEY, v TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (expires_at, value) or None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT v, expires_at FROM {self.table} WHERE k=?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] and row[1] < time.time():
+                self._conn.execute(f"DELETE FROM {self.table} WHERE k=?", (key,))
+                self._conn.commit()
+                return None
+        return row[1], json.loads(row[0])
+
+    def set(self, key: str, value: Any, expires_at: Optional[float] = None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (k, v, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE k=?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at > 0 AND expires_at < ?", (time.time(),)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+
+class TwoTierCache:
+    """
+    Memory LRU backed by SQLite. Disk hits are promoted into memory.
+    If the disk tier cannot be opened (read-only FS etc.) we run memory-only.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None, max_items: int = 512, ttl: int = 3600):
+        self.name = name
+        self.ttl = ttl
+        self.mem = LRUCache(max_items=max_items, ttl=ttl)
+        self.disk = None
+        if path:
+            try:
+                self.disk = SQLiteCache(path, table=name, ttl=ttl)
+            except Exception as e:
+                log.warning(f"{name} cache: disk tier disabled ({path}): {e}")
+        self._lock = threading.Lock()
+        self._stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "sets": 0}
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.mem.get(key)
+        if value is not None:
+            self._count("hits_memory")
+            return value
+        if self.disk is not None:
+            try:
+                hit = self.disk.get(key)
+            except Exception as e:
+                log.warning(f"{self.name} cache: disk read failed: {e}")
+                hit = None
+            if hit is not None:
+                expires_at, value = hit
+                self.mem.set(key, value, expires_at=expires_at)
+                self._count("hits_disk")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl else 0
+        self.mem.set(key, value, expires_at=expires_at)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, expires_at=expires_at)
+            except Exception as e:
+                log.warning(f"{self.name} cache: disk write failed: {e}")
+        self._count("sets")
+
+    def delete(self, key: str):
+        self.mem.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        lookups = s["hits_memory"] + s["hits_disk"] + s["misses"]
+        s["hit_rate"] = round((s["hits_memory"] + s["hits_disk"]) / lookups, 4) if lookups else 0.0
+        s["memory_items"] = len(self.mem)
+        s["disk"] = self.disk.path if self.disk is not None else None
+        return s
+
+
+# -------------------- LLM response cache --------------------
+_llm_cache: Optional[TwoTierCache] = None
+
+def get_llm_cache() -> Optional[TwoTierCache]:
+    """Process-wide model response cache, or None when disabled via LLM_CACHE_ENABLED=0."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        _llm_cache = TwoTierCache("llm", LLM_CACHE_PATH, max_items=LLM_CACHE_MAX_ITEMS, ttl=LLM_CACHE_TTL)
+    return _llm_cache
+
+def llm_cache_key(model: str, prompt_version: str, config: dict, prompt: str) -> str:
+    """Content address for a model call: model + prompt version + generation config + prompt hash."""
+    ident = {
+        "model": model,
+        "prompt_version": prompt_version,
+        "config": config,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(ident, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# -------------------- Extracted document text cache --------------------
+_extract_cache: Optional[TwoTierCache] = None
+
+def get_extraction_cache() -> Optional[TwoTierCache]:
+    """Process-wide cache of extracted upload text, or None when disabled via EXTRACT_CACHE_ENABLED=0."""
+    global _extract_cache
+    if not EXTRACT_CACHE_ENABLED:
+        return None
+    if _extract_cache is None:
+        _extract_cache = TwoTierCache(
+            "extract", EXTRACT_CACHE_PATH, max_items=EXTRACT_CACHE_MAX_ITEMS, ttl=EXTRACT_CACHE_TTL
+        )
+    return _extract_cache
+
+def extraction_cache_key(content_sha256: str, kind: str, parser_version: str) -> str:
+    """Content address for extracted text: upload bytes hash + file kind + parser version."""
+    return hashlib.sha256(f"{content_sha256}|{kind}|{parser_version}".encode("utf-8")).hexdigest()
+
+
+# -------------------- Scoped read-through cache --------------------
+def etag_for(payload: Any) -> str:
+    """Strong ETag over a JSON-able payload."""
+    body = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+class ScopedCache:
+    """
+    Whole query results per scope (e.g. a project_id), each with an ETag.
+    Writers call invalidate(scope), or invalidate_members(id) when they only
+    know a member id (e.g. a test_id). A result computed while an
+    invalidation for its scope ran is returned but not stored.
+
+    Each entry keeps the member ids it was stored with, so the member index
+    only ever covers cached scopes: entries leaving the cache (invalidated,
+    evicted or expired) take their ids out of it.
+    """
+
+    def __init__(self, name: str, max_items: int = 256, ttl: int = 300):
+        self.name = name
+        self.max_items = max_items
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()   # scope -> (expires_at, etag, payload, ids)
+        self._loading: Dict[str, list] = {}  # scope -> [loads in progress, invalidations seen]
+        self._epoch = 0                      # bumped by member invalidations of uncached ids
+        self._members: Dict[str, set] = {}   # member id -> cached scopes holding it
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "stale_fills": 0, "evictions": 0}
+
+    def _drop(self, scope: str) -> bool:
+        """Remove a scope and its member index entries. Called with the lock held."""
+        entry = self._entries.pop(scope, None)
+        if entry is None:
+            return False
+        for mid in entry[3]:
+            scopes = self._members.get(mid)
+            if scopes is not None:
+                scopes.discard(scope)
+                if not scopes:
+                    del self._members[mid]
+        return True
+
+    def _done_loading(self, scope: str, loading: list):
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[scope]
+
+    def load(self, scope: str, compute: Callable[[], Any],
+             members: Optional[Callable[[Any], Iterable[str]]] = None) -> Tuple[str, Any, bool]:
+        """Returns (etag, payload, hit), computing and storing the payload on a miss."""
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is not None and entry[0] and entry[0] < time.time():
+                self._drop(scope)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(scope)
+                self._stats["hits"] += 1
+                return entry[1], entry[2], True
+            self._stats["misses"] += 1
+            loading = self._loading.setdefault(scope, [0, 0])
+            loading[0] += 1
+            seen = (loading[1], self._epoch)
+
+        try:
+            payload = compute()
+            etag = etag_for(payload)
+            ids = frozenset(members(payload)) if members else frozenset()
+        except BaseException:
+            with self._lock:
+                self._done_loading(scope, loading)
+            raise
+        with self._lock:
+            self._done_loading(scope, loading)
+            if (loading[1], self._epoch) != seen:
+                self._stats["stale_fills"] += 1
+            else:
+                self._drop(scope)
+                self._entries[scope] = (time.time() + self.ttl if self.ttl else 0, etag, payload, ids)
+                for mid in ids:
+                    self._members.setdefault(mid, set()).add(scope)
+                now = time.time()
+                while self._entries:
+                    oldest = next(iter(self._entries))
+                    expires_at = self._entries[oldest][0]
+                    if len(self._entries) <= self.max_items and not (expires_at and expires_at < now):
+                        break
+                    self._drop(oldest)
+                    self._stats["evictions"] += 1
+        return etag, payload, False
+
+    def invalidate(self, *scopes: Optional[str]):
+        with self._lock:
+            for scope in scopes:
+                if not scope:
+                    continue
+                if scope in self._loading:
+                    self._loading[scope][1] += 1
+                self._drop(scope)
+                self._stats["invalidations"] += 1
+
+    def invalidate_members(self, *member_ids: Optional[str]):
+        with self._lock:
+            scopes = set()
+            for mid in member_ids:
+                if not mid:
+                    continue
+                found = self._members.get(mid)
+                if found:
+                    scopes |= found
+                else:
+                    # Unknown id: it may belong to a result being computed right now
+                    self._epoch += 1
+        self.invalidate(*scopes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["tracked_members"] = len(self._members)
+            s["items"] = len(self._entries)
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / lookups, 4) if lookups else 0.0
+        return s
+
+
+_project_cache: Optional[ScopedCache] = None
+
+def get_project_cache() -> Optional[ScopedCache]:
+    """Per-project test case listings, or None when disabled via PROJECT_CACHE_ENABLED=0."""
+    global _project_cache
+    if not PROJECT_CACHE_ENABLED:
+        return None
+    if _project_cache is None:
+        _project_cache = ScopedCache("projects", max_items=PROJECT_CACHE_MAX_ITEMS, ttl=PROJECT_CACHE_TTL)
+    return _project_cache
+
+
+_trace_cache: Optional[ScopedCache] = None
+
+def get_traceability_cache() -> Optional[ScopedCache]:
+    """Per-requirement traceability views, or None when disabled via TRACE_CACHE_ENABLED=0."""
+    global _trace_cache
+    if not TRACE_CACHE_ENABLED:
+        return None
+    if _trace_cache is None:
+        _trace_cache = ScopedCache("traceability", max_items=TRACE_CACHE_MAX_ITEMS, ttl=TRACE_CACHE_TTL)
+    return _trace_cache
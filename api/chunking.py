@@ -0,0 +1,87 @@
+# api/chunking.py
+"""
+Split long requirement documents into section-sized chunks for map-reduce
+generation. Chunks keep their character offsets into the original text.
+"""
+import os, re
+from dataclasses import dataclass
+from typing import List
+
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "12000"))
+CHUNK_MIN_CHARS = int(os.getenv("CHUNK_MIN_CHARS", "2000"))
+CHUNK_AUTO_CHARS = int(os.getenv("CHUNK_AUTO_CHARS", "24000"))  # auto-enable chunked mode above this
+
+# "1.", "2.3 Title", "A) ...", "# Markdown", "SECTION 4", all-caps headings
+_HEADING = re.compile(
+    r"^\s*(?:#{1,6}\s+\S|\d+(?:\.\d+)*[.)]?\s+\S|[A-Z][.)]\s+\S|(?:section|chapter)\s+\w+|[A-Z][A-Z0-9 /&\-]{3,60}$)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_PARA_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.?!])\s+")
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: int
+    end: int
+    text: str
+
+
+def _paragraphs(text: str):
+    """Yield (start, end) spans of blank-line separated paragraphs."""
+    pos = 0
+    for m in _PARA_BREAK.finditer(text):
+        if text[pos:m.start()].strip():
+            yield pos, m.start()
+        pos = m.end()
+    if text[pos:].strip():
+        yield pos, len(text)
+
+
+def _hard_split(text: str, start: int, end: int, max_chars: int):
+    """Break an oversized paragraph at sentence boundaries (or hard at max_chars)."""
+    pos = start
+    while end - pos > max_chars:
+        cut = pos + max_chars
+        best = None
+        for m in _SENTENCE_END.finditer(text, pos, cut):
+            best = m.end()
+        if not best or best <= pos:
+            best = cut
+        yield pos, best
+        pos = best
+    if pos < end:
+        yield pos, end
+
+
+def is_heading(paragraph: str) -> bool:
+    first = paragraph.strip().split("\n", 1)[0]
+    return len(first) <= 120 and _HEADING.match(first) is not None
+
+
+def split_sections(text: str, max_chars: int = CHUNK_MAX_CHARS, min_chars: int = CHUNK_MIN_CHARS) -> List[Chunk]:
+    """
+    Pack paragraphs into chunks of at most max_chars. A heading starts a new
+    chunk once the current one has at least min_chars, so chunks follow the
+    document's own sections where it has them.
+    """
+    spans = []
+    for s, e in _paragraphs(text):
+        spans.extend(_hard_split(text, s, e, max_chars) if e - s > max_chars else [(s, e)])
+
+    chunks: List[Chunk] = []
+    cur_start = cur_end = None
+    for s, e in spans:
+        if cur_start is None:
+            cur_start, cur_end = s, e
+            continue
+        too_big = e - cur_start > max_chars
+        new_section = cur_end - cur_start >= min_chars and is_heading(text[s:e])
+        if too_big or new_section:
+            chunks.append(Chunk(len(chunks), cur_start, cur_end, text[cur_start:cur_end]))
+            cur_start = s
+        cur_end = e
+    if cur_start is not None:
+        chunks.append(Chunk(len(chunks), cur_start, cur_end, text[cur_start:cur_end]))
+    return chunks
@@ -0,0 +1,178 @@
+# api/dedupe.py
+"""
+Near-duplicate detection for generated test cases.
+
+Each case is reduced to a MinHash signature over word-bigram shingles of its
+title + steps + expected_result. Signatures live in LSH-banded indexes, one per
+req_id and one per project, so a lookup only compares against the handful of
+cases sharing a band bucket. Indexes are seeded from stored test cases the
+first time a scope is seen in this process and kept current as cases are saved.
+"""
+import os, re, zlib, random, logging, threading
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("orbit-trace")
+
+DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "1") not in ("0", "false", "False", "")
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.8"))
+DEDUPE_MAX_SCOPES = int(os.getenv("DEDUPE_MAX_SCOPES", "512"))
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4          # BANDS * ROWS == NUM_PERM
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_WORD = re.compile(r"\w+")
+
+_rng = random.Random(1729)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def case_text(tc: dict) -> str:
+    steps = tc.get("steps") or []
+    if isinstance(steps, str):
+        steps = [steps]
+    return " ".join([tc.get("title") or "", " ".join(str(s) for s in steps), tc.get("expected_result") or ""])
+
+def shingles(text: str, k: int = 2) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < k:
+        return set(words)
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def signature(tc: dict) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(case_text(tc))] or [0]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) & _MASK for a, b in _PERMS)
+
+def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """MinHash estimate of the Jaccard similarity of the two shingle sets."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+class LSHIndex:
+    def __init__(self):
+        self.sigs: Dict[str, Tuple[int, ...]] = {}
+        self.buckets = defaultdict(list)
+
+    @staticmethod
+    def _bands(sig):
+        for b in range(BANDS):
+            yield b, sig[b * ROWS:(b + 1) * ROWS]
+
+    def add(self, test_id: str, sig: Tuple[int, ...]):
+        if test_id in self.sigs:
+            return
+        self.sigs[test_id] = sig
+        for band in self._bands(sig):
+            self.buckets[band].append(test_id)
+
+    def remove(self, test_id: str):
+        sig = self.sigs.pop(test_id, None)
+        if sig is None:
+            return
+        for band in self._bands(sig):
+            ids = self.buckets.get(band)
+            if ids is not None and test_id in ids:
+                ids.remove(test_id)
+                if not ids:
+                    del self.buckets[band]
+
+    def best_match(self, sig: Tuple[int, ...]) -> Tuple[Optional[str], float]:
+        seen, best_id, best = set(), None, 0.0
+        for band in self._bands(sig):
+            for test_id in self.buckets.get(band, ()):
+                if test_id in seen:
+                    continue
+                seen.add(test_id)
+                score = similarity(sig, self.sigs[test_id])
+                if score > best:
+                    best_id, best = test_id, score
+        return best_id, best
+
+    def __len__(self):
+        return len(self.sigs)
+
+
+class Deduper:
+    """
+    loader(field, value) returns stored test cases (test_id, title, steps,
+    expected_result) where field ("req_id" / "project_id") equals value.
+    """
+
+    def __init__(self, loader: Callable[[str, str], Iterable[dict]], threshold: float = DEDUPE_THRESHOLD,
+                 max_scopes: int = DEDUPE_MAX_SCOPES):
+        self.loader = loader
+        self.threshold = threshold
+        self.max_scopes = max_scopes
+        self._indexes: "OrderedDict[tuple, LSHIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, field: str, value: str) -> LSHIndex:
+        key = (field, value)
+        with self._lock:
+            idx = self._indexes.get(key)
+            if idx is not None:
+                self._indexes.move_to_end(key)
+                return idx
+        idx = LSHIndex()
+        try:
+            for tc in self.loader(field, value):
+                idx.add(tc["test_id"], signature(tc))
+        except Exception as e:
+            log.warning(f"dedupe: could not seed {field}={value}: {e}")
+        with self._lock:
+            idx = self._indexes.setdefault(key, idx)
+            while len(self._indexes) > self.max_scopes:
+                self._indexes.popitem(last=False)
+        return idx
+
+    def warm(self, req_id: str, project_id: Optional[str] = None):
+        """Seed the indexes for a scope ahead of time (the only step that hits storage)."""
+        self._index("req_id", req_id)
+        if project_id:
+            self._index("project_id", project_id)
+
+    def filter(self, req_id: str, project_id: Optional[str], tcs: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        Split tcs into (kept, skipped). A case is skipped when it is a near
+        duplicate of a stored case for the same req_id / project, or of an
+        earlier case in the same batch. Kept cases are added to the indexes,
+        so callers must pass cases that already carry their final test_id.
+        """
+        scopes = [self._index("req_id", req_id)]
+        if project_id:
+            scopes.append(self._index("project_id", project_id))
+
+        kept, skipped = [], []
+        with self._lock:
+            for tc in tcs:
+                sig = signature(tc)
+                match_id, score = None, 0.0
+                for idx in scopes:
+                    mid, s = idx.best_match(sig)
+                    if s > score:
+                        match_id, score = mid, s
+                if match_id is not None and score >= self.threshold:
+                    skipped.append({
+                        "test_id": tc.get("test_id"),
+                        "title": tc.get("title"),
+                        "duplicate_of": match_id,
+                        "similarity": round(score, 3),
+                    })
+                    continue
+                for idx in scopes:
+                    idx.add(tc["test_id"], sig)
+                kept.append(tc)
+        if skipped:
+            log.debug(f"dedupe {req_id}: skipped {len(skipped)} near-duplicate(s)")
+        return kept, skipped
+
+    def forget(self, req_id: str, project_id: Optional[str], test_ids: Iterable[str]):
+        """Drop cases that filter() kept but that were never stored (their insert failed)."""
+        keys = [("req_id", req_id)] + ([("project_id", project_id)] if project_id else [])
+        with self._lock:
+            for key in keys:
+                idx = self._indexes.get(key)
+                if idx is not None:
+                    for test_id in test_ids:
+                        idx.remove(test_id)
@@ -0,0 +1,139 @@
+# api/excerpts.py
+"""
+source_excerpt lookup: which part of the requirement text a test case covers.
+
+The text is segmented into sentences and tokenized once per request into a
+small inverted index with BM25 weights. Each test case (title + expected
+result) is then ranked against that shared index, so the cost per test case
+is a few posting-list walks rather than a fuzzy match against every sentence.
+Excerpts come back with character offsets into the indexed text.
+"""
+import re, math
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+MAX_EXCERPT_CHARS = 600
+MIN_SENTENCE_CHARS = 30     # shorter segments (headings, bullets) are merged into the next one
+
+_SEGMENT_BREAK = re.compile(r"(?<=[.?!])\s+|\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)")
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have if in into is it its of on or shall should "
+    "that the their then there these this to was were when which will with verify ensure test "
+    "check user system".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+@dataclass
+class Excerpt:
+    text: str
+    start: int
+    end: int
+    score: float = 0.0
+
+
+def segment(text: str) -> List[Tuple[int, int]]:
+    """(start, end) spans of sentence-like segments, whitespace-trimmed, short ones merged forward."""
+    spans, pos = [], 0
+    for m in _SEGMENT_BREAK.finditer(text):
+        spans.append((pos, m.start()))
+        pos = m.end()
+    spans.append((pos, len(text)))
+
+    out: List[Tuple[int, int]] = []
+    pending: Optional[int] = None
+    for s, e in spans:
+        seg = text[s:e]
+        stripped = seg.strip()
+        if not stripped:
+            continue
+        s += len(seg) - len(seg.lstrip())
+        e = s + len(stripped)
+        if pending is not None:
+            s = pending
+            pending = None
+        if e - s < MIN_SENTENCE_CHARS:
+            pending = s
+            continue
+        out.append((s, e))
+    if pending is not None:
+        end = len(text.rstrip())
+        if out and pending >= out[-1][1]:
+            out[-1] = (out[-1][0], end)
+        elif end > pending:
+            out.append((pending, end))
+    return out
+
+
+class ExcerptIndex:
+    def __init__(self, text: str):
+        self.text = text or ""
+        self.spans = segment(self.text)
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, (s, e) in enumerate(self.spans):
+            counts = Counter(tokenize(self.text[s:e]))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+        n = len(self.spans)
+        self.avg_len = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()
+        }
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """BM25 score of every segment sharing a term with the query."""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.avg_len or 1))
+                scores[i] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def rank(self, query: str, top: int = 1) -> List[Tuple[int, float]]:
+        """Best-matching segment indexes with their BM25 scores."""
+        return sorted(self.scores(query).items(), key=lambda kv: (-kv[1], kv[0]))[:top]
+
+    def _fallback(self) -> Excerpt:
+        """First paragraph (capped), as the old excerpt logic did when nothing matched."""
+        body = self.text.strip()
+        if not body:
+            return Excerpt("", 0, 0)
+        start = self.text.find(body[:1])
+        para_end = self.text.find("\n\n", start)
+        end = min(para_end if para_end > 0 else len(self.text), start + 400)
+        return Excerpt(self.text[start:end].strip(), start, end)
+
+    def excerpt(self, query: str) -> Excerpt:
+        """
+        1-2 sentence excerpt for a query: the best segment, joined with whichever
+        neighbour also matches the query (the better one) when it is short.
+        Capped at MAX_EXCERPT_CHARS.
+        """
+        scores = self.scores(query)
+        if not scores:
+            return self._fallback()
+        i = min(scores, key=lambda k: (-scores[k], k))
+        s, e = self.spans[i]
+        if e - s < MAX_EXCERPT_CHARS // 3:
+            neighbours = [j for j in (i - 1, i + 1) if scores.get(j)]
+            if neighbours:
+                ns, ne = self.spans[max(neighbours, key=lambda j: scores[j])]
+                if max(e, ne) - min(s, ns) <= MAX_EXCERPT_CHARS:
+                    s, e = min(s, ns), max(e, ne)
+        e = min(e, s + MAX_EXCERPT_CHARS)
+        return Excerpt(self.text[s:e].strip(), s, e, round(scores[i], 3))
+
+    def for_test_case(self, tc: dict) -> Excerpt:
+        return self.excerpt(f"{tc.get('title') or ''} {tc.get('expected_result') or ''}")
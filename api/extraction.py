@@ -0,0 +1,322 @@
+# api/extraction.py
+"""
+Text extraction for uploaded PDF / DOCX / text files, off the API process.
+
+PDF and DOCX parsing is CPU-bound and holds the GIL, so it runs in a pool of
+worker processes. PDFs are split into page ranges that are extracted in
+parallel and joined back in page order. Each file is checked against
+EXTRACT_MAX_BYTES / EXTRACT_MAX_PAGES and the whole extraction against
+EXTRACT_TIMEOUT_S. A timeout (or a cancelled request) terminates only the
+worker processes busy with that file; other uploads keep theirs.
+
+EXTRACT_WORKERS=0 disables the pool and parses in a thread instead.
+
+Extracted text is cached by SHA-256 of the uploaded bytes + parser version,
+so a document uploaded again skips parsing entirely.
+"""
+import os, mmap, asyncio, hashlib, logging, tempfile, threading, multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from importlib import metadata
+from typing import List, Optional
+
+from cache import get_extraction_cache, extraction_cache_key
+
+log = logging.getLogger("orbit-trace")
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "8"))
+EXTRACT_MAX_BYTES = int(os.getenv("EXTRACT_MAX_BYTES", str(50 * 1024 * 1024)))
+EXTRACT_MAX_PAGES = int(os.getenv("EXTRACT_MAX_PAGES", "1000"))
+EXTRACT_TIMEOUT_S = float(os.getenv("EXTRACT_TIMEOUT_S", "60"))
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "0"
+
+# Bump the "extract-vN" part when the extraction logic itself changes
+PARSER_VERSION = f"extract-v1/pypdf-{_package_version('pypdf')}/python-docx-{_package_version('python-docx')}"
+
+
+@dataclass
+class Extracted:
+    text: str
+    sha256: str       # of the uploaded bytes; also stored as the requirement checksum
+    cached: bool = False
+
+
+class ExtractionError(Exception):
+    """Raised for files that can't or may not be extracted; status is the HTTP code to answer with."""
+
+    def __init__(self, message: str, status: int = 422):
+        super().__init__(message)
+        self.status = status
+
+
+def file_kind(filename: str) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".pdf"):
+        return "pdf"
+    if name.endswith(".docx"):
+        return "docx"
+    return "text"
+
+
+# ---- worker-side functions (run in the pool; must stay importable at module level) ----
+@contextmanager
+def _mapped(path: str):
+    """Read-only memory map of a file. PdfReader(path) would copy the whole file into a BytesIO."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
+def _pdf_page_count(path: str) -> int:
+    from pypdf import PdfReader
+    with _mapped(path) as mm:
+        return len(PdfReader(mm).pages)
+
+def _pdf_pages(path: str, start: int, end: int) -> List[str]:
+    from pypdf import PdfReader
+    with _mapped(path) as mm:
+        reader = PdfReader(mm)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _docx_text(path: str) -> str:
+    from docx import Document
+    # zipfile reads members lazily from the path, so no full in-memory copy here either
+    return "\n".join(p.text for p in Document(path).paragraphs)
+
+def _text(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="ignore")
+
+
+def extract_path_sync(filename: str, path: str) -> str:
+    """Single-threaded extraction in the calling process."""
+    kind = file_kind(filename)
+    if kind == "pdf":
+        return "\n\n".join(_pdf_pages(path, 0, _pdf_page_count(path)))
+    if kind == "docx":
+        return _docx_text(path)
+    return _text(path)
+
+
+def _serve(conn):
+    """Worker process loop: answer (fn, args) requests from the pipe until it closes."""
+    while True:
+        try:
+            fn, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:  # unpicklable result or exception
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+# ---- pool management ----
+class WorkerCrashed(Exception):
+    """A worker process died mid-call (crashed, or stopped after a timeout)."""
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_serve, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+        self.killed = False
+
+    def alive(self) -> bool:
+        return not self.killed and self.proc.is_alive()
+
+    def call(self, fn, args):
+        try:
+            self.conn.send((fn, args))
+            ok, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"worker {self.proc.pid} exited with {self.proc.exitcode}") from e
+        if not ok:
+            raise value
+        return value
+
+    def kill(self):
+        self.killed = True
+        self.proc.terminate()
+
+    def close(self):
+        self.conn.close()
+        self.proc.join(timeout=1)
+
+
+class _Job:
+    """The workers currently busy with one extraction, so a timeout stops exactly those."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.workers = set()
+        self.stopped = False
+
+    def stop(self) -> int:
+        with self.lock:
+            self.stopped = True
+            workers = list(self.workers)
+        for w in workers:
+            w.kill()
+        return len(workers)
+
+
+class WorkerPool:
+    """
+    EXTRACT_WORKERS dispatcher threads, each driving its own worker process
+    (spawned on first use, replaced once it dies). Calls queue for a free thread.
+    """
+
+    def __init__(self, size: int):
+        # spawn, not fork: the API process holds gRPC / BigQuery threads that don't survive fork
+        self._ctx = multiprocessing.get_context("spawn")
+        self._threads = ThreadPoolExecutor(max_workers=size, thread_name_prefix="extract")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._workers = set()
+
+    def _worker(self) -> _Worker:
+        w = getattr(self._local, "worker", None)
+        if w is None or not w.alive():
+            if w is not None:
+                with self._lock:
+                    self._workers.discard(w)
+                w.close()
+            w = self._local.worker = _Worker(self._ctx)
+            with self._lock:
+                self._workers.add(w)
+        return w
+
+    def _call(self, job: _Job, fn, args):
+        w = self._worker()
+        with job.lock:
+            if job.stopped:
+                raise WorkerCrashed("extraction was stopped")
+            job.workers.add(w)
+        try:
+            return w.call(fn, args)
+        finally:
+            with job.lock:
+                job.workers.discard(w)
+
+    async def run(self, job: _Job, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._threads, self._call, job, fn, args)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for w in workers:
+            w.kill()
+            w.close()
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> Optional[WorkerPool]:
+    global _pool
+    if EXTRACT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(EXTRACT_WORKERS)
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+async def _extract_pdf(pool: WorkerPool, job: _Job, path: str) -> str:
+    pages = await pool.run(job, _pdf_page_count, path)
+    if pages > EXTRACT_MAX_PAGES:
+        raise ExtractionError(f"PDF has {pages} pages; the limit is {EXTRACT_MAX_PAGES}", 413)
+    step = max(1, EXTRACT_PAGES_PER_TASK)
+    ranges = [(s, min(s + step, pages)) for s in range(0, pages, step)]
+    parts = await asyncio.gather(*(pool.run(job, _pdf_pages, path, s, e) for s, e in ranges))
+    return "\n\n".join(text for part in parts for text in part)
+
+async def extract_file(filename: str, path: str, timeout: float = EXTRACT_TIMEOUT_S) -> str:
+    """Extract text from a file on disk without blocking the event loop."""
+    size = os.path.getsize(path)
+    if size > EXTRACT_MAX_BYTES:
+        raise ExtractionError(f"{filename} is {size} bytes; the limit is {EXTRACT_MAX_BYTES}", 413)
+
+    kind = file_kind(filename)
+    pool = get_pool() if kind != "text" else None
+    job = _Job()
+    if pool is None:
+        work = asyncio.to_thread(extract_path_sync, filename, path)
+    elif kind == "pdf":
+        work = _extract_pdf(pool, job, path)
+    else:
+        work = pool.run(job, _docx_text, path)
+
+    try:
+        return await asyncio.wait_for(work, timeout)
+    except asyncio.TimeoutError:
+        log.warning(f"Extraction of {filename} timed out after {timeout}s; stopping its workers")
+        raise ExtractionError(f"Extraction of {filename} timed out after {timeout:.0f}s", 504)
+    except WorkerCrashed as e:
+        raise ExtractionError(f"Extraction of {filename} failed: worker crashed ({e})", 500)
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Could not extract text from {filename}: {e}", 422)
+    finally:
+        # Page ranges still running after a failure or timeout are of no use; other files are untouched
+        job.stop()
+
+def _write(fd: int, data: bytes):
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+async def extract_spooled(filename: str, path: str, sha256: str, timeout: float = EXTRACT_TIMEOUT_S) -> Extracted:
+    """Extract a file already on disk whose content hash is known, answering repeats from the cache."""
+    kind = file_kind(filename)
+    cache = get_extraction_cache() if kind != "text" else None
+    key = extraction_cache_key(sha256, kind, PARSER_VERSION)
+    if cache is not None:
+        text = await asyncio.to_thread(cache.get, key)
+        if text is not None:
+            log.debug(f"extraction cache hit for {filename} ({sha256[:12]})")
+            return Extracted(text, sha256, cached=True)
+
+    text = await extract_file(filename, path, timeout)
+    if cache is not None:
+        await asyncio.to_thread(cache.set, key, text)
+    return Extracted(text, sha256)
+
+async def extract_bytes(filename: str, data: bytes, timeout: float = EXTRACT_TIMEOUT_S) -> Extracted:
+    """extract_spooled for an in-memory body (e.g. a fetched link); PDFs/DOCX go to workers via a temp file."""
+    if len(data) > EXTRACT_MAX_BYTES:
+        raise ExtractionError(f"{filename} is {len(data)} bytes; the limit is {EXTRACT_MAX_BYTES}", 413)
+    digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+    if file_kind(filename) == "text":
+        return Extracted(data.decode("utf-8", errors="ignore"), digest)
+
+    fd, path = tempfile.mkstemp(suffix="-" + os.path.basename(filename or "upload"))
+    try:
+        await asyncio.to_thread(_write, fd, data)
+        return await extract_spooled(filename, path, digest, timeout)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,183 @@
+# api/idempotency.py
+"""
+Idempotency-Key support for the generation endpoints.
+
+The first request with a key claims it and runs; its JSON response is kept
+for IDEMPOTENCY_TTL seconds and replayed to any retry with the same key. A
+retry that arrives while the original is still running waits for it (up to
+IDEMPOTENCY_WAIT_S) instead of calling the model again. A failed request
+releases its key, so the next retry runs normally.
+
+Keys live in a local SQLite file, shared by the worker processes of one
+instance. Each key is bound to a fingerprint of the request it was first used
+with; reusing it for a different request is an error.
+"""
+import os, json, time, uuid, asyncio, hashlib, logging, sqlite3, threading
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from cache import CACHE_DIR
+
+log = logging.getLogger("orbit-trace")
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1") not in ("0", "false", "False", "")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_WAIT_S = float(os.getenv("IDEMPOTENCY_WAIT_S", "300"))
+IDEMPOTENCY_LOCK_S = float(os.getenv("IDEMPOTENCY_LOCK_S", "900"))   # an older in-progress claim is abandoned
+IDEMPOTENCY_POLL_S = float(os.getenv("IDEMPOTENCY_POLL_S", "0.2"))
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", os.path.join(CACHE_DIR, "idempotency.sqlite3"))
+
+_RUN, _WAIT, _REPLAY = "run", "wait", "replay"
+
+
+class IdempotencyConflict(Exception):
+    """The key was first used with a different request."""
+
+
+class IdempotencyTimeout(Exception):
+    """The original request was still running after IDEMPOTENCY_WAIT_S."""
+
+
+def request_fingerprint(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, path: str = IDEMPOTENCY_PATH, ttl: int = IDEMPOTENCY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit; claims take a write lock with BEGIN IMMEDIATE so other processes see them atomically
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            "k TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, state TEXT NOT NULL, owner TEXT, "
+            "response TEXT, started_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._last_purge = 0.0
+        self._stats = {"runs": 0, "replays": 0, "waits": 0, "conflicts": 0, "released": 0}
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def _claim(self, key: str, fingerprint: str, owner: str) -> Tuple[str, Any]:
+        """(_RUN, None) if this caller now owns the key, (_REPLAY, response) or (_WAIT, None)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if now - self._last_purge > 60:
+                    self._conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+                    self._last_purge = now
+                row = self._conn.execute(
+                    "SELECT fingerprint, state, response, started_at, expires_at FROM idempotency WHERE k=?", (key,)
+                ).fetchone()
+                if row is not None and row[4] >= now:
+                    if row[0] != fingerprint:
+                        raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+                    if row[1] == "done":
+                        return _REPLAY, json.loads(row[2])
+                    if now - row[3] < IDEMPOTENCY_LOCK_S:
+                        return _WAIT, None
+                    log.warning(f"idempotency: taking over abandoned key {key}")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (k, fingerprint, state, owner, response, started_at, expires_at) "
+                    "VALUES (?, ?, 'running', ?, NULL, ?, ?)",
+                    (key, fingerprint, owner, now, now + max(self.ttl, IDEMPOTENCY_LOCK_S)),
+                )
+                return _RUN, None
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _complete(self, key: str, owner: str, response: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency SET state='done', response=?, expires_at=? WHERE k=? AND owner=?",
+                (json.dumps(response, default=str), now + self.ttl, key, owner),
+            )
+
+    def _release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency WHERE k=? AND owner=?", (key, owner))
+        self._count("released")
+
+    def _step(self, key: str, fingerprint: str, owner: str, started: float) -> Tuple[str, Any]:
+        try:
+            state, response = self._claim(key, fingerprint, owner)
+        except IdempotencyConflict:
+            self._count("conflicts")
+            raise
+        if state == _WAIT and time.monotonic() - started > IDEMPOTENCY_WAIT_S:
+            raise IdempotencyTimeout("A request with this Idempotency-Key is still in progress")
+        return state, response
+
+    def run(self, key: str, fingerprint: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Blocking variant for sync handlers. Returns (response, replayed)."""
+        owner, started, waited = uuid.uuid4().hex, time.monotonic(), False
+        while True:
+            state, response = self._step(key, fingerprint, owner, started)
+            if state == _REPLAY:
+                self._count("replays")
+                return response, True
+            if state == _RUN:
+                break
+            if not waited:
+                self._count("waits")
+                waited = True
+            time.sleep(IDEMPOTENCY_POLL_S)
+        self._count("runs")
+        try:
+            result = fn()
+        except BaseException:
+            self._release(key, owner)
+            raise
+        self._complete(key, owner, result)
+        return result, False
+
+    async def run_async(self, key: str, fingerprint: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async variant; fn returns an awaitable. Returns (response, replayed)."""
+        owner, started, waited = uuid.uuid4().hex, time.monotonic(), False
+        while True:
+            state, response = await asyncio.to_thread(self._step, key, fingerprint, owner, started)
+            if state == _REPLAY:
+                self._count("replays")
+                return response, True
+            if state == _RUN:
+                break
+            if not waited:
+                self._count("waits")
+                waited = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_S)
+        self._count("runs")
+        try:
+            result = await fn()
+        except BaseException:
+            # Also on cancellation (client gone): a retry should run again rather than wait
+            await asyncio.shield(asyncio.to_thread(self._release, key, owner))
+            raise
+        await asyncio.to_thread(self._complete, key, owner, result)
+        return result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["keys"] = self._conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+        s["path"] = self.path
+        return s
+
+
+_store: Optional[IdempotencyStore] = None
+_store_lock = threading.Lock()
+
+def get_idempotency_store() -> Optional[IdempotencyStore]:
+    """Process-wide Idempotency-Key store, or None when disabled via IDEMPOTENCY_ENABLED=0."""
+    global _store
+    if not IDEMPOTENCY_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = IdempotencyStore()
+        return _store
@@ -0,0 +1,229 @@
+# api/json_stream.py
+"""
+Incremental, repairing extraction of test case objects from a model's JSON output.
+
+The model produces something shaped like {"req_id": ..., "test_cases": [{...}, {...}]},
+sometimes wrapped in code fences or prose, with trailing commas, or cut off
+mid-object when it hits max_output_tokens.
+
+- TestCaseStream is fed raw text chunks and hands back each object in the
+  test_cases array as soon as its closing brace arrives.
+- parse_test_cases() handles a complete output: clean JSON is parsed directly,
+  otherwise every complete test case is salvaged and a truncated final object
+  is closed off if it still carries a title.
+"""
+import re, json, logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+log = logging.getLogger("orbit-trace")
+
+ARRAY_KEY = '"test_cases"'
+_DECODER = json.JSONDecoder()
+
+_FENCE = re.compile(r"```(?:json|JSON)?")
+# Strings are matched whole so commas inside them are left alone
+_STRING_OR_TRAILING_COMMA = re.compile(r'("(?:[^"\\]|\\.)*")|,\s*(?=[}\]])')
+# Characters the scanner cares about, outside / inside a string
+_STRUCTURAL = re.compile(r'[{}\]"]')
+_IN_STRING = re.compile(r'["\\]')
+
+
+def strip_fences(text: str) -> str:
+    return _FENCE.sub("", text)
+
+def _scan(text: str):
+    """
+    String-aware scan. Returns (stack of open brackets, in_string, offset of
+    the last comma outside strings).
+    """
+    stack, in_string, escape, last_comma = [], False, False, -1
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+        elif c == ",":
+            last_comma = i
+    return stack, in_string, last_comma
+
+def remove_trailing_commas(text: str) -> str:
+    """Drop commas directly before a closing bracket, ignoring string contents."""
+    return _STRING_OR_TRAILING_COMMA.sub(lambda m: m.group(1) or "", text)
+
+def loads_lenient(raw: str):
+    """json.loads, retrying once with trailing commas removed."""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return json.loads(remove_trailing_commas(raw))
+
+def close_truncated(fragment: str, max_cuts: int = 8) -> Optional[dict]:
+    """
+    Best-effort completion of a JSON object cut off mid-stream: close an open
+    string, drop a dangling key/colon/comma, then close open brackets. If that
+    doesn't parse, cut back to the previous comma and try again.
+    """
+    frag = fragment
+    for _ in range(max_cuts):
+        stack, in_string, last_comma = _scan(frag)
+        candidate = frag + '"' if in_string else frag
+        candidate = candidate.rstrip().rstrip(",:").rstrip()
+        candidate += "".join("}" if b == "{" else "]" for b in reversed(stack))
+        try:
+            obj = loads_lenient(candidate)
+            return obj if isinstance(obj, dict) else None
+        except json.JSONDecodeError:
+            if last_comma <= 0:
+                return None
+            frag = frag[:last_comma]
+    return None
+
+
+class TestCaseStream:
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0              # next character to scan
+        self.in_array = False     # inside the test_cases array
+        self.obj_start = -1       # start of the object being scanned
+        self.depth = 0
+        self.in_string = False
+        self.done = False         # test_cases array closed
+        self.count = 0
+
+    def _find_array(self) -> bool:
+        key = self.buf.find(ARRAY_KEY, max(0, self.pos - len(ARRAY_KEY)))
+        if key < 0:
+            self.pos = len(self.buf)
+            return False
+        bracket = self.buf.find("[", key + len(ARRAY_KEY))
+        if bracket < 0:
+            self.pos = key
+            return False
+        self.pos = bracket + 1
+        self.in_array = True
+        return True
+
+    def pending(self) -> str:
+        """Text of an object that was opened but never closed (truncated output)."""
+        return self.buf[self.obj_start:] if self.obj_start >= 0 else ""
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Consume a text chunk; return the test case objects completed by it."""
+        out: List[dict] = []
+        if self.done or not chunk:
+            return out
+        self.buf += chunk
+        if not self.in_array and not self._find_array():
+            return out
+
+        # Jump between structural characters instead of stepping through every one
+        buf, i, n = self.buf, self.pos, len(self.buf)
+        while i < n:
+            m = (_IN_STRING if self.in_string else _STRUCTURAL).search(buf, i)
+            if m is None:
+                i = n
+                break
+            i = m.start()
+            c = buf[i]
+            if self.in_string:
+                if c == "\\":
+                    i += 2  # skip the escaped character (may run past a chunk boundary)
+                    continue
+                self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                if self.depth == 0:
+                    self.obj_start = i
+                self.depth += 1
+            elif c == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.obj_start >= 0:
+                    raw = buf[self.obj_start:i + 1]
+                    self.obj_start = -1
+                    try:
+                        obj = loads_lenient(raw)
+                    except json.JSONDecodeError as e:
+                        log.warning(f"TestCaseStream: skipping malformed test case: {e}")
+                    else:
+                        if isinstance(obj, dict):
+                            self.count += 1
+                            out.append(obj)
+            elif c == "]" and self.depth == 0:
+                self.done = True
+                i += 1
+                break
+            i += 1
+
+        # Drop consumed text so long streams don't grow the buffer unbounded
+        keep_from = self.obj_start if self.obj_start >= 0 else i
+        self.buf = buf[keep_from:]
+        if self.obj_start >= 0:
+            self.obj_start = 0
+        self.pos = i - keep_from
+        return out
+
+
+@dataclass
+class ParseResult:
+    test_cases: List[dict] = field(default_factory=list)
+    payload: dict = field(default_factory=dict)
+    complete: bool = False   # output parsed as-is (after fence/prose stripping)
+    repaired: bool = False   # trailing commas fixed or a truncated object closed
+
+
+def parse_test_cases(text: str) -> ParseResult:
+    """
+    Parse model output into test cases, salvaging what we can. Callers only
+    need a new model call when the result has no test_cases at all.
+    """
+    cleaned = strip_fences(text or "")
+    start = cleaned.find("{")
+
+    # Fast path: a well-formed object, ignoring any prose before or after it
+    if start >= 0:
+        payload, repaired = None, False
+        try:
+            payload, _ = _DECODER.raw_decode(cleaned, start)
+        except json.JSONDecodeError:
+            try:
+                payload, _ = _DECODER.raw_decode(remove_trailing_commas(cleaned[start:]))
+                repaired = True
+            except json.JSONDecodeError:
+                pass
+        tcs = payload.get("test_cases") if isinstance(payload, dict) else None
+        if isinstance(tcs, list):
+            tcs = [tc for tc in tcs if isinstance(tc, dict)]
+            return ParseResult(tcs, payload, complete=not repaired, repaired=repaired)
+
+    # Bare array of test cases
+    stripped = cleaned.strip()
+    if stripped.startswith("[") and ARRAY_KEY not in stripped:
+        cleaned = '{"test_cases": ' + stripped
+
+    # Salvage: every complete object, then try to close the truncated tail
+    stream = TestCaseStream()
+    tcs = stream.feed(cleaned)
+    repaired = False
+    if not stream.done and stream.pending():
+        tail = close_truncated(stream.pending())
+        if tail and tail.get("title"):
+            tcs.append(tail)
+            repaired = True
+    if tcs:
+        log.debug(f"parse_test_cases salvaged {len(tcs)} test case(s) (tail repaired={repaired})")
+    m = re.search(r'"req_id"\s*:\s*"([^"]*)"', cleaned)
+    payload = {"req_id": m.group(1)} if m else {}
+    payload["test_cases"] = tcs
+    return ParseResult(tcs, payload, complete=False, repaired=repaired or bool(tcs))
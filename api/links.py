@@ -0,0 +1,238 @@
+# api/links.py
+"""
+Link ingestion for /generate_unified.
+
+Pages are fetched through one pooled keep-alive httpx client with at most
+LINK_CONCURRENCY downloads in flight. Bodies are streamed and cut off at
+LINK_MAX_BYTES. Each URL's ETag / Last-Modified and extracted text are
+cached, so a page that answers 304 Not Modified reuses the cached text.
+HTML is reduced to readable text: scripts, styles and navigation / header /
+footer boilerplate are dropped, and <main> / <article> content wins when the
+page has it. Linked PDF / DOCX files go through the upload extractor.
+"""
+import os, re, asyncio, logging, threading
+from html.parser import HTMLParser
+from typing import List, Optional
+
+import httpx
+
+from cache import TwoTierCache, CACHE_DIR
+from extraction import extract_bytes, file_kind
+
+log = logging.getLogger("orbit-trace")
+
+LINK_CONCURRENCY = int(os.getenv("LINK_CONCURRENCY", "8"))
+LINK_MAX_CONNECTIONS = int(os.getenv("LINK_MAX_CONNECTIONS", "20"))
+LINK_TIMEOUT_S = float(os.getenv("LINK_TIMEOUT_S", "10"))
+LINK_MAX_BYTES = int(os.getenv("LINK_MAX_BYTES", str(5 * 1024 * 1024)))
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", str(7 * 24 * 3600)))
+LINK_CACHE_MAX_ITEMS = int(os.getenv("LINK_CACHE_MAX_ITEMS", "256"))
+LINK_CACHE_PATH = os.getenv("LINK_CACHE_PATH", os.path.join(CACHE_DIR, "link_cache.sqlite3"))
+LINK_USER_AGENT = os.getenv("LINK_USER_AGENT", "orbit-ai-link-fetcher/1.0")
+
+
+# -------------------- HTML -> text --------------------
+_SKIP = {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "head", "object"}
+_BOILERPLATE = {"nav", "header", "footer", "aside", "form", "button", "select"}
+_MAIN = {"main", "article"}
+_BLOCK = {
+    "p", "div", "section", "br", "hr", "li", "ul", "ol", "table", "tr", "td", "th",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "dd", "dt", "figcaption",
+} | _MAIN
+_VOID = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "track", "wbr"}
+_BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search"}
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_BLANKS = re.compile(r"\n\s*\n+")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[tuple] = []   # (tag, hidden)
+        self.hidden = 0                # depth of skipped / boilerplate elements
+        self.main_depth = 0
+        self.all: List[str] = []
+        self.main: List[str] = []
+
+    def _newline(self):
+        self.all.append("\n")
+        if self.main_depth:
+            self.main.append("\n")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID:
+            if tag in ("br", "hr") and not self.hidden:
+                self._newline()
+            return
+        attrs = dict(attrs)
+        hide = (
+            tag in _SKIP or tag in _BOILERPLATE
+            or (attrs.get("role") or "") in _BOILERPLATE_ROLES
+            or "hidden" in attrs or (attrs.get("aria-hidden") == "true")
+        )
+        self.stack.append((tag, hide))
+        if hide:
+            self.hidden += 1
+        if tag in _MAIN and not self.hidden:
+            self.main_depth += 1
+        if tag in _BLOCK and not self.hidden:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in _VOID:
+            return
+        # Tolerate unclosed tags: pop back to the matching opener
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                break
+        else:
+            return
+        while len(self.stack) > i:
+            t, hide = self.stack.pop()
+            if t in _MAIN and not self.hidden and self.main_depth:
+                self.main_depth -= 1
+            if hide:
+                self.hidden -= 1
+            if t in _BLOCK and not self.hidden:
+                self._newline()
+
+    def handle_data(self, data):
+        if self.hidden or not data:
+            return
+        self.all.append(data)
+        if self.main_depth:
+            self.main.append(data)
+
+
+def _tidy(parts: List[str]) -> str:
+    text = _SPACES.sub(" ", "".join(parts))
+    lines = [line.strip() for line in text.split("\n")]
+    return _BLANKS.sub("\n\n", "\n".join(lines)).strip()
+
+def html_to_text(html: str) -> str:
+    """Readable text of an HTML page without scripts, styles or site chrome."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:  # html.parser is lenient; this is a last resort
+        log.warning(f"html_to_text: parse error, falling back to tag stripping: {e}")
+        return _tidy([re.sub(r"<[^>]+>", " ", html)])
+    main = _tidy(parser.main)
+    return main if len(main) >= 200 else _tidy(parser.all)
+
+
+# -------------------- Fetcher --------------------
+class LinkFetcher:
+    def __init__(self, concurrency: int = LINK_CONCURRENCY, max_bytes: int = LINK_MAX_BYTES,
+                 timeout: float = LINK_TIMEOUT_S, cache: Optional[TwoTierCache] = None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.cache = cache if cache is not None else TwoTierCache(
+            "links", LINK_CACHE_PATH, max_items=LINK_CACHE_MAX_ITEMS, ttl=LINK_CACHE_TTL
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.stats = {"fetched": 0, "not_modified": 0, "truncated": 0, "failed": 0}
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # A client is bound to the loop it was first used on
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=LINK_MAX_CONNECTIONS, max_keepalive_connections=LINK_MAX_CONNECTIONS),
+                headers={"User-Agent": LINK_USER_AGENT},
+            )
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _download(self, client: httpx.AsyncClient, url: str, headers: dict):
+        """Returns (response, body bytes, truncated)."""
+        async with client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code == 304:
+                return resp, b"", False
+            resp.raise_for_status()
+            declared = resp.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                log.warning(f"{url}: Content-Length {declared} over LINK_MAX_BYTES, reading the first {self.max_bytes}")
+            chunks, size, truncated = [], 0, False
+            async for chunk in resp.aiter_bytes():
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.max_bytes:
+                    truncated = size > self.max_bytes
+                    break
+            return resp, b"".join(chunks)[:self.max_bytes], truncated
+
+    async def _to_text(self, url: str, resp: httpx.Response, body: bytes) -> str:
+        ctype = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+        path = resp.url.path if resp.url else url
+        if ctype == "application/pdf" or file_kind(path) == "pdf":
+            return (await extract_bytes("link.pdf", body)).text
+        if "wordprocessingml" in ctype or file_kind(path) == "docx":
+            return (await extract_bytes("link.docx", body)).text
+        raw = body.decode(resp.encoding or "utf-8", errors="ignore")
+        if ctype in ("text/html", "application/xhtml+xml") or (not ctype and "<html" in raw[:2000].lower()):
+            return await asyncio.to_thread(html_to_text, raw)
+        return raw.strip()
+
+    async def fetch(self, url: str) -> str:
+        """Text of one link; "" on any failure."""
+        client = self._ensure_client()
+        cached = await asyncio.to_thread(self.cache.get, url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            async with self._sem:
+                resp, body, truncated = await self._download(client, url, headers)
+            if resp.status_code == 304 and cached:
+                self.stats["not_modified"] += 1
+                return cached["text"]
+            if truncated:
+                self.stats["truncated"] += 1
+                log.warning(f"{url}: body cut off at LINK_MAX_BYTES={self.max_bytes}")
+            text = await self._to_text(url, resp, body)
+            self.stats["fetched"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            log.warning(f"⚠️ Failed to read link {url}: {e}")
+            return ""
+
+        etag, last_modified = resp.headers.get("etag"), resp.headers.get("last-modified")
+        if (etag or last_modified) and text and not truncated:
+            await asyncio.to_thread(
+                self.cache.set, url, {"etag": etag, "last_modified": last_modified, "text": text}
+            )
+        return text
+
+    async def fetch_all(self, urls: List[str]) -> List[str]:
+        """Texts in the same order as urls."""
+        return list(await asyncio.gather(*(self.fetch(u) for u in urls)))
+
+    def metrics(self) -> dict:
+        return {**self.stats, "cache": self.cache.stats()}
+
+
+_fetcher: Optional[LinkFetcher] = None
+_fetcher_lock = threading.Lock()
+
+def get_link_fetcher() -> LinkFetcher:
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = LinkFetcher()
+        return _fetcher
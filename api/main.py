@@ -1,32 +1,50 @@
-import os, json, uuid, re, logging
+import os, json, uuid, re, time, base64, logging, asyncio, hashlib
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Body
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Body, Request, Response, Header
+from fastapi.encoders import jsonable_encoder
 from firebase_admin import auth as fb_auth
 from firebase_utils import get_firestore_client
 from firebase_admin import firestore 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 import os
 from pydantic import BaseModel
 from typing import Dict, Any
 import traceability
 import requests
-import difflib
+from cache import (
+    get_llm_cache, llm_cache_key, get_extraction_cache, get_project_cache, get_traceability_cache, etag_for,
+)
+from chunking import split_sections, CHUNK_AUTO_CHARS
+from json_stream import TestCaseStream, parse_test_cases, close_truncated
+from model_scheduler import get_scheduler, estimate_tokens, PRIORITY_INTERACTIVE
+from model_router import get_router, gen_config
+from singleflight import SingleFlight
+from prompt_registry import get_prompt_registry, PromptTemplate
+from dedupe import Deduper, DEDUPE_ENABLED
+from sections import stable_sections, section_at, plan_revision, document_checksum, DOC_KEY
+from excerpts import ExcerptIndex
+from summaries import get_project_summaries, ProjectSummaries, load_summary_rows
+from idempotency import (
+    get_idempotency_store, request_fingerprint, IdempotencyConflict, IdempotencyTimeout,
+)
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Vertex AI / BigQuery
+# Vertex AI
 import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig
-from google.cloud import bigquery
 
-# Optional parsers for uploads
-from pypdf import PdfReader
-from docx import Document
-from io import BytesIO
+# Upload parsing runs in a worker process pool
+from extraction import extract_spooled, ExtractionError, Extracted, shutdown_pool
+from uploads import spooled_uploads, SpooledUpload, UploadLimitMiddleware
+from links import get_link_fetcher
+from storage import get_storage, REQUIREMENTS, TESTCASES, TRACE_LINKS, SECTIONS
 
 # -------------------- Config --------------------
 PROJECT_ID = os.getenv("PROJECT_ID", "orbit-ai-472708")
@@ -36,10 +54,14 @@ DATASET = os.getenv("DATASET", "orbit_ai_poc")
 PROMPT_PATH = os.getenv("PROMPT_PATH", "prompts/prompt_poc_v1.txt")
 PROMPT_VER = os.getenv("PROMPT_VERSION", "poc-v1")
 CREATED_BY = os.getenv("CREATED_BY", "demo@orbit-ai")
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "3"))
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
 
-TABLE_REQ = f"{PROJECT_ID}.{DATASET}.requirements"
 TABLE_TC = f"{PROJECT_ID}.{DATASET}.generated_testcases"
-TABLE_TRL = f"{PROJECT_ID}.{DATASET}.trace_links"
+# Fields returned with generated test cases but not stored as columns
+RESPONSE_ONLY_FIELDS = ("source_span",)
 
 # Jira
 JIRA_BASE = os.getenv("JIRA_BASE")
@@ -49,7 +71,6 @@ JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY")
 JIRA_ISSUE_TYPE = os.getenv("JIRA_ISSUE_TYPE", "Task")
 
 # -------------------- Lazy Clients --------------------
-_bq = None
 _vertex_ready = False
 
 log = logging.getLogger("orbit-trace")
@@ -58,20 +79,72 @@ logging.basicConfig(level=logging.DEBUG)
 def now_ts() -> str:
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
-def get_bq():
-    global _bq
-    if _bq is None:
-        _bq = bigquery.Client(project=PROJECT_ID)
-    return _bq
-
 def ensure_vertex():
     global _vertex_ready
     if not _vertex_ready:
         vertexai.init(project=PROJECT_ID, location=LOCATION)
         _vertex_ready = True
 
+# Coalesces identical generation requests that are in flight at the same time
+_inflight = SingleFlight()
+
+def _idempotency_error(e: Exception) -> HTTPException:
+    return HTTPException(422 if isinstance(e, IdempotencyConflict) else 409, str(e))
+
+def idempotent(key: Optional[str], scope: str, fingerprint: str, fn, response: Response):
+    """
+    Run fn once per Idempotency-Key (scoped to an endpoint); retries get the
+    stored response, marked with an Idempotent-Replayed header.
+    """
+    store = get_idempotency_store()
+    if not key or store is None:
+        return fn()
+    try:
+        result, replayed = store.run(f"{scope}:{key}", fingerprint, lambda: jsonable_encoder(fn()))
+    except (IdempotencyConflict, IdempotencyTimeout) as e:
+        raise _idempotency_error(e)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def idempotent_async(key: Optional[str], scope: str, fingerprint: str, fn, response: Response):
+    """idempotent() for async handlers; fn returns an awaitable."""
+    store = get_idempotency_store()
+    if not key or store is None:
+        return await fn()
+
+    async def run():
+        return jsonable_encoder(await fn())
+
+    try:
+        result, replayed = await store.run_async(f"{scope}:{key}", fingerprint, run)
+    except (IdempotencyConflict, IdempotencyTimeout) as e:
+        raise _idempotency_error(e)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+def upload_fingerprint(uploads: List[SpooledUpload]) -> list:
+    # Content hash from spooling, so a retry is recognised before the upload is parsed
+    return [(up.filename, up.sha256) for up in uploads]
+
+def flight_key(*parts) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 # -------------------- FastAPI --------------------
-app = FastAPI(title="Orbit AI Test Case Generator API", version="0.4")
+# Edit journal compaction runs out of band (scripts/compact_edits.py), never from API instances
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Buffered rows must reach BigQuery before the instance goes away
+    await asyncio.to_thread(get_storage().close)
+    shutdown_pool()
+    await get_link_fetcher().aclose()
+
+app = FastAPI(title="Orbit AI Test Case Generator API", version="0.4", lifespan=lifespan)
 
 # CORS allowlist via env (comma-separated exact origins) or a regex fallback that matches Cloud Run preview domains
 allowed_origins_env = os.getenv("WEB_ALLOWED_ORIGINS", "").strip()
@@ -136,84 +209,112 @@ class EnsureCORSOnError(BaseHTTPMiddleware):
         return response
 
 
+# Reject oversized multipart bodies before they are parsed or spooled
+app.add_middleware(UploadLimitMiddleware)
+
 # Add as the outermost middleware so it wraps all responses
 app.add_middleware(EnsureCORSOnError)
 
 # -------------------- Helpers --------------------
-def load_prompt() -> str:
+def load_prompt(version: Optional[str] = None) -> PromptTemplate:
+    """Compiled template for a registered prompt version (PROMPT_VER by default)."""
     try:
-        with open(PROMPT_PATH, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception as e:
-        log.warning(f"Prompt file not found at {PROMPT_PATH}: {e}")
-        return (
-            "You are an expert QA engineer.\n"
-            "Requirement ID: {{req_id}}\n"
-            "Requirement Text:\n{{requirement_text}}\n"
-            "Return STRICT JSON with 'test_cases' array."
-        )
+        return get_prompt_registry(PROMPT_PATH, PROMPT_VER).get(version)
+    except KeyError:
+        raise HTTPException(400, f"Unknown prompt_version: {version}")
 
-def extract_excerpt(requirement_text: str, tc_title: str) -> str:
-    """
-    Extract the most relevant 1–2 sentence excerpt from the requirement text for a given test case title.
-    Uses keyword and fuzzy matching to avoid returning the full document.
-    """
-    if not requirement_text.strip():
-        return ""
-
-    # Normalize input
-    req = requirement_text.strip()
-    title = (tc_title or "").strip()
-
-    # Break into paragraphs or sentences
-    chunks = re.split(r"(?<=[.?!])\s+|\n{2,}", req)
-    chunks = [c.strip() for c in chunks if len(c.strip()) > 30]
-
-    # Try fuzzy match to find the best-matching chunk
-    best_chunk = ""
-    best_score = 0.0
-    for chunk in chunks:
-        score = difflib.SequenceMatcher(None, title.lower(), chunk.lower()).ratio()
-        if score > best_score:
-            best_score = score
-            best_chunk = chunk
-
-    # If a strong match found, return that paragraph
-    if best_chunk and best_score > 0.2:  # relaxed threshold
-        log.debug(f"extract_excerpt fuzzy match (score={best_score:.2f}) len={len(best_chunk)}")
-        return best_chunk[:600].strip()
-
-    # Otherwise try word-based regex search
-    title_words = [w for w in re.findall(r"\w+", title) if len(w) > 3]
-    if title_words:
-        pattern = "|".join(re.escape(w) for w in title_words)
-        m = re.search(pattern, req, flags=re.IGNORECASE)
-        if m:
-            start = max(0, m.start() - 120)
-            end = min(len(req), m.end() + 250)
-            excerpt = req[start:end].strip()
-            log.debug(f"extract_excerpt regex match len={len(excerpt)}")
-            return excerpt
-
-    # Fallback: first paragraph (limited to 400 chars)
-    paras = [p.strip() for p in req.split("\n\n") if p.strip()]
-    if paras:
-        return paras[0][:400].strip()
-
-    # Final fallback: first 300 chars
-    return req[:300].strip()
-
-def call_model(prompt: str) -> str:
-    ensure_vertex()
-    model = GenerativeModel(MODEL_NAME)
-    cfg = GenerationConfig(temperature=0.2, max_output_tokens=2048)
-    resp = model.generate_content(prompt, generation_config=cfg)
+def index_and_attach_excerpts(tcs: List[dict], text: str, offset: int = 0):
+    """attach_excerpts() against a fresh index of text; CPU-bound, so async callers run it in a thread."""
+    attach_excerpts(tcs, ExcerptIndex(text), offset=offset)
+
+def attach_excerpts(tcs: List[dict], index: ExcerptIndex, offset: int = 0, overwrite: bool = True):
+    """
+    Set source_excerpt / source_span on each test case from one shared index.
+    offset shifts spans when the index covers a slice (e.g. a chunk) of the document.
+    """
+    for tc in tcs:
+        if not overwrite and tc.get("source_excerpt"):
+            continue
+        ex = index.for_test_case(tc)
+        tc["source_excerpt"] = ex.text
+        tc["source_span"] = {"start": ex.start + offset, "end": ex.end + offset}
+
+def _response_text(resp) -> str:
     if getattr(resp, "text", None):
         return resp.text
     parts = resp.candidates[0].content.parts if resp.candidates else []
     return "".join(getattr(p, "text", "") for p in parts)
 
-def save_testcases(req_id: str, tcs: List[dict], text: str, project_id: Optional[str] = None) -> List[dict]:
+def choose_model(text: str, template: PromptTemplate, compliance: Optional[List[str]] = None) -> str:
+    """Model for one generation, picked by the router from input size, case count and compliance load."""
+    route = get_router().route(text, template.requested_cases, compliance)
+    log.debug(f"router: {route.model} ({route.tier}: {route.reason})")
+    return route.model
+
+def call_model(prompt: str, force_regenerate: bool = False, priority: int = PRIORITY_INTERACTIVE,
+               prompt_version: str = PROMPT_VER, model_name: Optional[str] = None) -> str:
+    """
+    Generate with Vertex, answering byte-identical prompts from the LLM cache.
+    force_regenerate skips the lookup but still refreshes the cached entry.
+    Calls go through the shared scheduler (rate limits, retry on 429/5xx).
+    """
+    model_name = model_name or MODEL_NAME
+    config = gen_config(model_name)
+    cache = get_llm_cache()
+    key = llm_cache_key(model_name, prompt_version, config, prompt)
+    if cache is not None and not force_regenerate:
+        cached = cache.get(key)
+        if cached is not None:
+            log.debug(f"call_model cache hit {key[:12]}")
+            return cached
+
+    ensure_vertex()
+    model = GenerativeModel(model_name)
+    resp = get_scheduler().run(
+        model_name,
+        get_router().timed(
+            model_name, lambda: model.generate_content(prompt, generation_config=GenerationConfig(**config))
+        ),
+        tokens=estimate_tokens(prompt, config["max_output_tokens"]),
+        priority=priority,
+    )
+    out = _response_text(resp)
+
+    if cache is not None and out.strip():
+        cache.set(key, out)
+    return out
+
+async def call_model_async(prompt: str, force_regenerate: bool = False, priority: int = PRIORITY_INTERACTIVE,
+                           prompt_version: str = PROMPT_VER, model_name: Optional[str] = None) -> str:
+    """Same as call_model but awaits Vertex's async client instead of blocking the event loop."""
+    model_name = model_name or MODEL_NAME
+    config = gen_config(model_name)
+    cache = get_llm_cache()
+    key = llm_cache_key(model_name, prompt_version, config, prompt)
+    if cache is not None and not force_regenerate:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            log.debug(f"call_model_async cache hit {key[:12]}")
+            return cached
+
+    ensure_vertex()
+    model = GenerativeModel(model_name)
+    resp = await get_scheduler().run_async(
+        model_name,
+        get_router().timed_async(
+            model_name, lambda: model.generate_content_async(prompt, generation_config=GenerationConfig(**config))
+        ),
+        tokens=estimate_tokens(prompt, config["max_output_tokens"]),
+        priority=priority,
+    )
+    out = _response_text(resp)
+
+    if cache is not None and out.strip():
+        await asyncio.to_thread(cache.set, key, out)
+    return out
+
+def build_testcase_rows(req_id: str, tcs: List[dict], text: str, project_id: Optional[str] = None,
+                        prompt_version: str = PROMPT_VER, model_version: Optional[str] = None) -> List[dict]:
     rows = []
     BASE_URL = "http://localhost:3000"
     for tc in tcs:
@@ -232,99 +333,356 @@ def save_testcases(req_id: str, tcs: List[dict], text: str, project_id: Optional
             ],
             "trace_link": tc.get("trace_link") or f"{BASE_URL}/traceability/{req_id}",
             "source_excerpt": excerpt,
-            "model_version": MODEL_NAME,
-            "prompt_version": PROMPT_VER,
+            "source_span": tc.get("source_span"),
+            "model_version": tc.get("model_version") or model_version or MODEL_NAME,
+            "prompt_version": prompt_version,
             "created_at": now_ts(),
             "created_by": CREATED_BY,
             "project_id": project_id or tc.get("project_id", ""),
         })
+    return rows
+
+def testcase_table_rows(rows: List[dict]) -> List[dict]:
+    # Response-only fields aren't columns of the test case table
+    return [{k: v for k, v in r.items() if k not in RESPONSE_ONLY_FIELDS} for r in rows]
+
+def invalidate_reads(project_ids: Iterable[Optional[str]] = (), req_ids: Iterable[Optional[str]] = (),
+                     test_ids: Iterable[Optional[str]] = ()):
+    """
+    Drop cached project listings / traceability views touched by a write
+    (call once the write has landed). test_ids reach views that hold those tests.
+    """
+    test_ids = list(test_ids)
+    projects, traces = get_project_cache(), get_traceability_cache()
+    if projects is not None:
+        projects.invalidate(*set(project_ids))
+        projects.invalidate_members(*test_ids)
+    if traces is not None:
+        traces.invalidate(*set(req_ids))
+        traces.invalidate_members(*test_ids)
+
+def record_summary(testcases: Iterable[dict] = (), pushed: Optional[tuple] = None,
+                   edit: Optional[tuple] = None):
+    """
+    Apply a landed write to the project summaries: inserted test case rows,
+    a (project_id, test_id) push, or a (test_id, fields, project_id) edit.
+    """
+    summaries = get_project_summaries()
+    if summaries is None:
+        return
+    summaries.record_testcases(testcases)
+    if pushed is not None:
+        summaries.record_push(*pushed)
+    if edit is not None:
+        summaries.record_edit(*edit)
+
+def forget_unsaved_rows(rows: List[dict]):
+    """Take rows whose insert failed back out of the dedupe indexes, so a retry can store them."""
+    if _deduper is None:
+        return
+    scopes: Dict[tuple, List[str]] = {}
+    for r in rows:
+        scopes.setdefault((r.get("req_id"), r.get("project_id") or None), []).append(r["test_id"])
+    for (req_id, project_id), test_ids in scopes.items():
+        _deduper.forget(req_id, project_id, test_ids)
+
+def failed_rows(rows: List[dict], errs: list) -> List[dict]:
+    """Rows named by insert errors; all of them when an error has no row index."""
+    if any(not isinstance(e, dict) or "index" not in e for e in errs):
+        return rows
+    return [rows[i] for i in sorted({e["index"] for e in errs}) if i < len(rows)]
+
+def insert_testcase_rows(rows: List[dict]):
+    if not rows:
+        return
+    try:
+        errs = get_storage().write(TESTCASES, testcase_table_rows(rows))
+    except BaseException:
+        forget_unsaved_rows(rows)
+        raise
+    invalidate_reads([r.get("project_id") for r in rows], [r.get("req_id") for r in rows])
+    if errs:
+        forget_unsaved_rows(failed_rows(rows, errs))
+        raise HTTPException(500, f"BigQuery insert errors: {errs}")
+    record_summary(testcases=rows)
 
-    errs = get_bq().insert_rows_json(TABLE_TC, rows)
+async def insert_testcase_rows_async(rows: List[dict]):
+    if not rows:
+        return
+    try:
+        errs = await get_storage().awrite(TESTCASES, testcase_table_rows(rows))
+    except BaseException:
+        forget_unsaved_rows(rows)
+        raise
+    invalidate_reads([r.get("project_id") for r in rows], [r.get("req_id") for r in rows])
     if errs:
+        forget_unsaved_rows(failed_rows(rows, errs))
         raise HTTPException(500, f"BigQuery insert errors: {errs}")
-    return rows
+    record_summary(testcases=rows)
+
+async def stream_model_async(prompt: str, force_regenerate: bool = False, prompt_version: str = PROMPT_VER,
+                             model_name: Optional[str] = None):
+    """
+    Async generator over the model's text as Vertex streams it. A cache hit is
+    replayed as a single chunk; a completed stream is written to the cache.
+    """
+    model_name = model_name or MODEL_NAME
+    config = gen_config(model_name)
+    cache = get_llm_cache()
+    key = llm_cache_key(model_name, prompt_version, config, prompt)
+    if cache is not None and not force_regenerate:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            log.debug(f"stream_model_async cache hit {key[:12]}")
+            yield cached
+            return
 
-def sniff_extract_text(filename: str, content: bytes) -> str:
-    name = (filename or "").lower()
-    if name.endswith(".pdf"):
-        reader = PdfReader(BytesIO(content))
-        return "\n\n".join(p.extract_text() or "" for p in reader.pages)
-    if name.endswith(".docx"):
-        doc = Document(BytesIO(content))
-        return "\n".join(p.text for p in doc.paragraphs)
-    return content.decode("utf-8", errors="ignore")
-
-def upsert_requirement(req_id: str, title: str, text: str):
+    ensure_vertex()
+    model = GenerativeModel(model_name)
+    t0 = time.monotonic()
+    # Only opening the stream is retried; a failure mid-stream surfaces to the caller
+    stream = await get_scheduler().run_async(
+        model_name,
+        lambda: model.generate_content_async(prompt, generation_config=GenerationConfig(**config), stream=True),
+        tokens=estimate_tokens(prompt, config["max_output_tokens"]),
+    )
+    parts = []
+    try:
+        async for resp in stream:
+            try:
+                text = _response_text(resp)
+            except (IndexError, AttributeError, ValueError):
+                continue  # e.g. a trailing chunk that only carries finish_reason / usage
+            if text:
+                parts.append(text)
+                yield text
+    except Exception:
+        get_router().record(model_name, time.monotonic() - t0, ok=False)
+        raise
+    get_router().record(model_name, time.monotonic() - t0)
+
+    out = "".join(parts)
+    if cache is not None and out.strip():
+        await asyncio.to_thread(cache.set, key, out)
+
+def load_stored_testcases(field: str, value: str) -> List[dict]:
+    """Stored test cases for one req_id / project_id; seeds the dedupe index."""
+    if field not in ("req_id", "project_id"):
+        raise ValueError(f"Unsupported field: {field}")
+    return get_storage().testcases_by(field, value, ("test_id", "title", "steps", "expected_result"))
+
+_deduper = Deduper(load_stored_testcases) if DEDUPE_ENABLED else None
+
+def dedupe_rows(req_id: str, project_id: Optional[str], rows: List[dict]) -> tuple:
+    """Drop near-duplicates of stored / earlier rows. Returns (kept, skipped)."""
+    if _deduper is None or not rows:
+        return rows, []
+    return _deduper.filter(req_id, project_id or None, rows)
+
+def save_testcases(req_id: str, tcs: List[dict], text: str, project_id: Optional[str] = None,
+                   prompt_version: str = PROMPT_VER, model_version: Optional[str] = None) -> tuple:
+    """Build, dedupe and insert rows. Returns (saved rows, skipped duplicates)."""
+    if any(not tc.get("source_excerpt") for tc in tcs):
+        attach_excerpts(tcs, ExcerptIndex(text), overwrite=False)
+    rows = build_testcase_rows(req_id, tcs, text, project_id, prompt_version, model_version)
+    rows, skipped = dedupe_rows(req_id, project_id, rows)
+    insert_testcase_rows(rows)
+    return rows, skipped
+
+async def extract_upload(upload: SpooledUpload) -> Extracted:
+    """Extract a spooled upload's text (cached by content hash); limits/timeouts surface as HTTP errors."""
+    try:
+        return await extract_spooled(upload.filename, upload.path, upload.sha256)
+    except ExtractionError as e:
+        raise HTTPException(e.status, str(e))
+
+def upsert_requirement(req_id: str, title: str, text: str, checksum: Optional[str] = None):
+    """checksum: SHA-256 of the uploaded bytes when the text came from one file, else of the text."""
     row = [{
         "req_id": req_id,
         "source_type": "upload",
         "source_uri": f"upload://{req_id}",
         "title": title or "(Uploaded)",
         "text": text,
-        "checksum": "",
+        "checksum": checksum or document_checksum(text),
         "created_at": now_ts(),
         "created_by": CREATED_BY
     }]
-    errors = get_bq().insert_rows_json(TABLE_REQ, row)
+    errors = get_storage().write(REQUIREMENTS, row)
+    invalidate_reads(req_ids=[req_id])
     if errors:
         msg = " ".join(str(e) for e in errors)
         if "duplicate" not in msg.lower():
             raise HTTPException(500, f"Requirement upsert failed: {errors}")
 
+def load_section_state(req_id: str) -> tuple:
+    """Latest revision for a requirement as (revision, {section_key: test_ids}); (0, {}) if none."""
+    rows = get_storage().latest_sections(req_id)
+    revision, state = 0, {}
+    for row in rows:
+        revision = row["revision"]
+        state[row["section_key"]] = list(row["test_ids"] or [])
+    return revision, state
+
+def save_section_state(req_id: str, revision: int, sections: list, section_tests: Dict[str, List[str]],
+                       obsolete: Optional[Dict[str, List[str]]] = None):
+    ts = now_ts()
+    rows = [{
+        "req_id": req_id, "revision": revision, "section_key": sec.key, "section_index": sec.index,
+        "heading": sec.heading, "start_offset": sec.start, "end_offset": sec.end,
+        "test_ids": section_tests.get(sec.key, []), "status": "active", "created_at": ts,
+    } for sec in sections]
+    if section_tests.get(DOC_KEY):
+        rows.append({"req_id": req_id, "revision": revision, "section_key": DOC_KEY,
+                     "test_ids": section_tests[DOC_KEY], "status": "active", "created_at": ts})
+    for key, test_ids in (obsolete or {}).items():
+        rows.append({"req_id": req_id, "revision": revision, "section_key": key,
+                     "test_ids": test_ids, "status": "obsolete", "created_at": ts})
+    errs = get_storage().write(SECTIONS, rows)
+    if errs:
+        raise HTTPException(500, f"BigQuery insert errors: {errs}")
+    if obsolete:
+        # Listings and traceability views flag obsolete cases
+        invalidate_reads(req_ids=[req_id], test_ids=[t for ids in obsolete.values() for t in ids])
+
+def attribute_rows(rows: List[dict], sections: list, text: str) -> Dict[str, List[str]]:
+    """Map each saved row to the section its source_span / source_excerpt came from (DOC_KEY if none)."""
+    out: Dict[str, List[str]] = {}
+    for row in rows:
+        span = row.get("source_span")
+        excerpt = (row.get("source_excerpt") or "").strip()
+        if span:
+            pos = span["start"]
+        else:
+            pos = text.find(excerpt) if excerpt else -1
+        sec = section_at(sections, pos) if pos >= 0 else None
+        out.setdefault(sec.key if sec else DOC_KEY, []).append(row["test_id"])
+    return out
+
 # -------------------- Routes --------------------
 app.include_router(traceability.router)
 
 @app.get("/health")
 def health():
-    return {"ok": True, "model": MODEL_NAME, "bq": TABLE_TC}
+    return {"ok": True, "model": MODEL_NAME, "bq": TABLE_TC, "storage": get_storage().name}
+
+@app.get("/metrics/models")
+def model_metrics():
+    return {
+        "ok": True,
+        "scheduler": get_scheduler().metrics(),
+        "router": get_router().metrics(),
+        "singleflight": _inflight.stats(),
+    }
+
+@app.get("/metrics/writes")
+def write_metrics():
+    return {"ok": True, "storage": get_storage().metrics()}
+
+@app.get("/prompts")
+def list_prompts():
+    registry = get_prompt_registry(PROMPT_PATH, PROMPT_VER)
+    return {"ok": True, "default": PROMPT_VER, "versions": registry.versions()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    llm, extract = get_llm_cache(), get_extraction_cache()
+    projects, traces = get_project_cache(), get_traceability_cache()
+    summaries = get_project_summaries()
+    return {
+        "ok": True,
+        "llm": llm.stats() if llm is not None else None,
+        "extraction": extract.stats() if extract is not None else None,
+        "links": get_link_fetcher().metrics(),
+        "projects": projects.stats() if projects is not None else None,
+        "traceability": traces.stats() if traces is not None else None,
+        "summaries": summaries.stats() if summaries is not None else None,
+    }
+
+@app.get("/idempotency/stats")
+def idempotency_stats():
+    store = get_idempotency_store()
+    return store.stats() if store is not None else {"enabled": False}
 
 @app.post("/generate")
-def generate(body: dict):
+def generate(body: dict, response: Response, idempotency_key: Optional[str] = Header(None)):
+    fingerprint = request_fingerprint(body)
+    return idempotent(idempotency_key, "generate", fingerprint, lambda: _generate(body), response)
+
+def _generate(body: dict) -> dict:
     rid = (body.get("req_id") or f"REQ-{uuid.uuid4().hex[:6].upper()}").strip()
     text = body.get("text", "").strip()
+    force_regenerate = bool(body.get("force_regenerate", False))
+    template = load_prompt(body.get("prompt_version"))
 
     if not text:
-        job = get_bq().query(
-            f"SELECT text FROM `{TABLE_REQ}` WHERE req_id=@rid",
-            job_config=bigquery.QueryJobConfig(
-                query_parameters=[bigquery.ScalarQueryParameter("rid", "STRING", rid)]
-            ),
-        )
-        row = next(iter(job.result()), None)
+        row = get_storage().get_requirement(rid)
         if not row:
             raise HTTPException(404, f"Requirement {rid} not found")
         text = row["text"]
 
-    prompt = load_prompt().replace("{{req_id}}", rid).replace("{{requirement_text}}", text)
-    out = call_model(prompt)
+    model_name = choose_model(text, template)
 
-    try:
-        payload = json.loads(re.search(r"\{.*\}", out, re.DOTALL).group(0))
-    except Exception:
-        raise HTTPException(500, "Model did not return valid JSON")
+    def run() -> dict:
+        prompt = fill_prompt(template, rid, text)
+        out = call_model(prompt, force_regenerate=force_regenerate, prompt_version=template.version,
+                         model_name=model_name)
 
-    tcs = payload.get("test_cases", [])
-    if not tcs:
-        raise HTTPException(500, "No test_cases returned by model")
+        tcs = parse_test_cases(out).test_cases
+        if not tcs:
+            raise HTTPException(500, "Model did not return any parseable test_cases")
 
-    saved = save_testcases(rid, tcs, text)
-    return {"req_id": rid, "generated": len(saved), "test_cases": saved}
+        saved, skipped = save_testcases(rid, tcs, text, prompt_version=template.version, model_version=model_name)
+        return {"req_id": rid, "generated": len(saved), "test_cases": saved, "duplicates_skipped": skipped}
+
+    # Double-clicks / teammates generating the same requirement share one model call and one insert
+    key = flight_key("generate", rid, text_hash(text), model_name, template.version)
+    result, _ = _inflight.do(key, run)
+    return result
 
 @app.post("/ingest")
-async def ingest_requirement(file: UploadFile = File(...), title: Optional[str] = Form(None)):
-    content = await file.read()
-    text = sniff_extract_text(file.filename, content)
+async def ingest_requirement(
+    response: Response,
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    chunked: Optional[bool] = Form(None),
+    prompt_version: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    async with spooled_uploads([file]) as uploads:
+        fingerprint = request_fingerprint(upload_fingerprint(uploads), title, chunked, prompt_version)
+        return await idempotent_async(
+            idempotency_key, "ingest", fingerprint,
+            lambda: _ingest_requirement(uploads[0], title, chunked, prompt_version), response,
+        )
+
+async def _ingest_requirement(upload: SpooledUpload, title: Optional[str], chunked: Optional[bool],
+                              prompt_version: Optional[str]) -> dict:
+    template = load_prompt(prompt_version)
+    extracted = await extract_upload(upload)
+    text = extracted.text
     rid = f"REQ-{uuid.uuid4().hex[:6].upper()}"
-    upsert_requirement(rid, title or file.filename, text)
 
-    prompt = load_prompt().replace("{{req_id}}", rid).replace("{{requirement_text}}", text)
-    out = call_model(prompt)
-    payload = json.loads(re.search(r"\{.*\}", out, re.DOTALL).group(0))
-    tcs = payload.get("test_cases", [])
+    use_chunks = chunked if chunked is not None else len(text) > CHUNK_AUTO_CHARS
 
-    saved = save_testcases(rid, tcs, text)
-    return {"req_id": rid, "generated": len(saved), "test_cases": saved}
-def fill_prompt(template: str, req_id: str, text: str, compliance: Optional[List[str]] = None) -> str:
+    upsert = asyncio.to_thread(upsert_requirement, rid, title or upload.filename, text, extracted.sha256)
+    if use_chunks:
+        _, tcs = await asyncio.gather(upsert, generate_chunked(rid, text, template))
+    else:
+        prompt = fill_prompt(template, rid, text)
+        model_name = choose_model(text, template)
+        _, out = await asyncio.gather(
+            upsert, call_model_async(prompt, prompt_version=template.version, model_name=model_name)
+        )
+        tcs = parse_test_cases(out).test_cases
+        if not tcs:
+            raise HTTPException(500, "Model did not return any parseable test_cases")
+        for tc in tcs:
+            tc["model_version"] = model_name
+
+    saved, skipped = await asyncio.to_thread(save_testcases, rid, tcs, text, None, template.version)
+    return {"req_id": rid, "generated": len(saved), "test_cases": saved, "duplicates_skipped": skipped}
+def fill_prompt(template: PromptTemplate, req_id: str, text: str, compliance: Optional[List[str]] = None) -> str:
     """
     Fill the template prompt with requirement details and optional compliance tags.
     """
@@ -333,35 +691,109 @@ def fill_prompt(template: str, req_id: str, text: str, compliance: Optional[List
         tip = "\nEmphasize compliance with: " + ", ".join(compliance) + \
               ". Reflect this in severity, steps, expected results, and tags."
 
-    return (
-        template
-        .replace("{{req_id}}", req_id)
-        .replace("{{requirement_text}}", text + tip)
-    )
+    return template.render(req_id=req_id, requirement_text=text + tip if tip else text)
+
+async def generate_per_chunk(rid: str, chunks: list, template: PromptTemplate,
+                             force_regenerate: bool = False) -> List[List[dict]]:
+    """
+    Generate for each chunk (anything with .index / .text) with at most
+    CHUNK_CONCURRENCY calls in flight. Returns one list of test cases per chunk;
+    each source_excerpt comes from its own chunk. A failed chunk yields [].
+    """
+    sem = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+    async def run(chunk) -> List[dict]:
+        model_name = choose_model(chunk.text, template)
+        try:
+            async with sem:
+                out = await call_model_async(
+                    fill_prompt(template, rid, chunk.text),
+                    force_regenerate=force_regenerate,
+                    prompt_version=template.version,
+                    model_name=model_name,
+                )
+        except Exception as e:
+            log.warning(f"generate_chunked {rid}: chunk {chunk.index} failed: {e}")
+            return []
+        tcs = parse_test_cases(out).test_cases
+        if not tcs:
+            log.warning(f"generate_chunked {rid}: chunk {chunk.index} returned no parseable test_cases")
+        await asyncio.to_thread(index_and_attach_excerpts, tcs, chunk.text, getattr(chunk, "start", 0))
+        for tc in tcs:
+            tc["model_version"] = model_name
+        return tcs
+
+    return await asyncio.gather(*(run(c) for c in chunks))
+
+async def generate_chunked(rid: str, text: str, template: PromptTemplate, force_regenerate: bool = False) -> List[dict]:
+    """
+    Map-reduce generation for long documents: split into sections, generate per
+    section, then merge and renumber under one req_id.
+    """
+    chunks = await asyncio.to_thread(split_sections, text)
+    log.debug(f"generate_chunked {rid}: {len(chunks)} chunk(s) from {len(text)} chars")
+    results = await generate_per_chunk(rid, chunks, template, force_regenerate)
+
+    batch = uuid.uuid4().hex[:6].upper()
+    merged = [tc for tcs in results for tc in tcs]
+    for n, tc in enumerate(merged, start=1):
+        tc["test_id"] = f"TEST-{batch}-{n:03d}"
+    return merged
+
 
-def extract_json(text: str) -> str:
+async def collect_sources(
+    uploads: List[SpooledUpload], links: Optional[str], description: Optional[str]
+) -> tuple:
     """
-    Extract JSON object from model output.
-    Removes Markdown fences (```json ... ```) and returns the first valid JSON block.
+    Extract text from every uploaded file and link concurrently (parsing runs
+    off the event loop), then append the free-text description.
+    Returns (texts, source_type, checksum); checksum is the upload's SHA-256
+    when a single file is the only source, else None.
     """
-    import re
+    source_type = "manual"
 
-    # Remove Markdown code fences if present
-    cleaned = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE)
+    try:
+        link_list = json.loads(links) if links else []
+    except Exception as e:
+        raise HTTPException(400, f"Invalid links JSON: {e}")
 
-    # Extract the first JSON object using regex
-    match = re.search(r"\{.*\}", cleaned, flags=re.DOTALL)
-    return match.group(0) if match else cleaned
+    # ---- Extract every file and link concurrently (parsing runs off the event loop) ----
+    *files, link_texts = await asyncio.gather(
+        *(extract_upload(up) for up in uploads), get_link_fetcher().fetch_all(link_list)
+    )
+    extracted = [e.text for e in files] + link_texts
+    extracted_texts = [t.strip() for t in extracted if t and t.strip()]
+
+    if files:
+        source_type = "upload"
+    if links:
+        source_type = "link"
+
+    # ---- Handle free text ----
+    if description and description.strip():
+        extracted_texts.append(description.strip())
+        source_type = "text"
+
+    if not extracted_texts:
+        raise HTTPException(400, "No valid text provided from file, link, or description.")
+    checksum = files[0].sha256 if len(files) == 1 and len(extracted_texts) == 1 else None
+    return extracted_texts, source_type, checksum
 
 
 @app.post("/generate_unified")
 async def generate_unified(
+    response: Response,
     files: Optional[List[UploadFile]] = None,
     links: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     req_id: Optional[str] = Form(None),
     title: Optional[str] = Form(None),
     project_id: Optional[str] = Form(None),
+    force_regenerate: bool = Form(False),
+    chunked: Optional[bool] = Form(None),
+    prompt_version: Optional[str] = Form(None),
+    incremental: bool = Form(True),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """
     Unified endpoint for:
@@ -370,87 +802,139 @@ async def generate_unified(
     - Free-text description
     - Optional project_id (links to user project history)
     - Existing req_id (re-generation)
+    - force_regenerate (bypass the LLM response cache)
+    - chunked (map-reduce over sections; defaults to on for long documents)
+    - prompt_version (any registered prompt template; defaults to PROMPT_VERSION)
+    - incremental (with an existing req_id, only new or changed sections go to the model)
+    - Idempotency-Key header (a retry returns the first response instead of generating again)
     """
-    extracted_texts = []
-    source_type = "manual"
-
-    # ---- Handle uploaded files ----
-    if files:
-        for file in files:
-            content = await file.read()
-            extracted_text = sniff_extract_text(file.filename, content)
-            if extracted_text.strip():
-                extracted_texts.append(extracted_text)
-        source_type = "upload"
-
-    # ---- Handle links ----
-    if links:
-        try:
-            link_list = json.loads(links)
-            for link in link_list:
-                try:
-                    resp = requests.get(link, timeout=10)
-                    resp.raise_for_status()
-                    raw = resp.text
-                    cleaned = re.sub(r"<[^>]+>", "", raw)
-                    if cleaned.strip():
-                        extracted_texts.append(cleaned.strip())
-                except Exception as e:
-                    print(f"⚠️ Failed to read link {link}: {e}")
-            source_type = "link"
-        except Exception as e:
-            raise HTTPException(400, f"Invalid links JSON: {e}")
-
-    # ---- Handle free text ----
-    if description and description.strip():
-        extracted_texts.append(description.strip())
-        source_type = "text"
+    async with spooled_uploads(files) as uploads:
+        fingerprint = request_fingerprint(
+            upload_fingerprint(uploads), links, description, req_id, title, project_id, force_regenerate,
+            chunked, prompt_version, incremental,
+        )
+        return await idempotent_async(
+            idempotency_key, "generate_unified", fingerprint,
+            lambda: _generate_unified(
+                uploads, links, description, req_id, title, project_id, force_regenerate, chunked,
+                prompt_version, incremental,
+            ),
+            response,
+        )
 
-    # ---- Validation ----
-    if not extracted_texts:
-        raise HTTPException(400, "No valid text provided from file, link, or description.")
+async def _generate_unified(
+    uploads: List[SpooledUpload],
+    links: Optional[str],
+    description: Optional[str],
+    req_id: Optional[str],
+    title: Optional[str],
+    project_id: Optional[str],
+    force_regenerate: bool,
+    chunked: Optional[bool],
+    prompt_version: Optional[str],
+    incremental: bool,
+) -> dict:
+    template = load_prompt(prompt_version)
+    extracted_texts, source_type, checksum = await collect_sources(uploads, links, description)
 
     combined_text = "\n\n".join(extracted_texts)
     rid = (req_id or f"REQ-{uuid.uuid4().hex[:6].upper()}").strip()
 
-    # ---- Upsert requirement ----
-    upsert_requirement(rid, title or "(Unified Upload)", combined_text)
+    use_chunks = chunked if chunked is not None else len(combined_text) > CHUNK_AUTO_CHARS
 
-    # ---- Prepare LLM prompt ----
-    prompt = fill_prompt(load_prompt(), rid, combined_text)
-    out = call_model(prompt)
+    # Concurrent identical requests share one model call and one persisted result
+    model_name = choose_model(combined_text, template)
+    key = flight_key(
+        "generate_unified", rid, text_hash(combined_text), model_name, template.version,
+        project_id or "", use_chunks, incremental,
+    )
+    result, _ = await _inflight.do_async(
+        key,
+        lambda: _generate_unified_core(
+            rid, combined_text, title, project_id, source_type, use_chunks, force_regenerate, template,
+            incremental=incremental, known_req=bool(req_id), checksum=checksum, model_name=model_name,
+        ),
+    )
+    return result
+
+async def _generate_unified_core(
+    rid: str,
+    combined_text: str,
+    title: Optional[str],
+    project_id: Optional[str],
+    source_type: str,
+    use_chunks: bool,
+    force_regenerate: bool,
+    template: PromptTemplate,
+    incremental: bool = True,
+    known_req: bool = False,
+    checksum: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> dict:
+    # ---- Re-ingest of a known requirement: diff sections against the last revision ----
+    sections = await asyncio.to_thread(stable_sections, combined_text)
+    revision, previous, state_loaded = 0, {}, True
+    if known_req:
+        try:
+            revision, previous = await asyncio.to_thread(load_section_state, rid)
+        except Exception as e:
+            # Without the current revision number a new one could land below it; don't record one
+            state_loaded = False
+            log.warning(f"Section state unavailable for {rid}, regenerating in full: {e}")
+    if previous and incremental:
+        return await _regenerate_sections(
+            rid, combined_text, title, project_id, source_type, force_regenerate, template,
+            sections, revision, previous, checksum,
+        )
 
-    try:
-        payload = json.loads(extract_json(out))
-    except json.JSONDecodeError as e:
-        raise HTTPException(500, f"Model output invalid JSON: {e}")
-
-    tcs = payload.get("test_cases", [])
-    if not isinstance(tcs, list) or not tcs:
-        raise HTTPException(500, "Model returned no test_cases")
-
-    # ---- Extract focused excerpt ----
-    def extract_excerpt(requirement_text: str, tc_title: str) -> str:
-        if not requirement_text.strip():
-            return ""
-        words = [w for w in re.findall(r"\w+", tc_title) if len(w) > 3]
-        if words:
-            pattern = "|".join(re.escape(w) for w in words)
-            m = re.search(pattern, requirement_text, flags=re.IGNORECASE)
-            if m:
-                start = max(0, m.start() - 150)
-                end = min(len(requirement_text), m.end() + 200)
-                return requirement_text[start:end].strip()
-        # fallback to first paragraph
-        paras = [p.strip() for p in requirement_text.split("\n\n") if p.strip()]
-        return paras[0][:400] if paras else requirement_text[:300]
+    # ---- Upsert requirement while the model is generating ----
+    upsert = asyncio.to_thread(upsert_requirement, rid, title or "(Unified Upload)", combined_text, checksum)
+    if use_chunks:
+        _, tcs = await asyncio.gather(
+            upsert, generate_chunked(rid, combined_text, template, force_regenerate=force_regenerate)
+        )
+        if not tcs:
+            raise HTTPException(500, "Model returned no test_cases")
+    else:
+        prompt = fill_prompt(template, rid, combined_text)
+        model_name = model_name or choose_model(combined_text, template)
+        _, out = await asyncio.gather(
+            upsert,
+            call_model_async(prompt, force_regenerate=force_regenerate, prompt_version=template.version,
+                             model_name=model_name),
+        )
+
+        tcs = parse_test_cases(out).test_cases
+        if not tcs:
+            raise HTTPException(500, "Model returned no test_cases")
+        for tc in tcs:
+            tc["model_version"] = model_name
 
+    if not use_chunks:
+        await asyncio.to_thread(index_and_attach_excerpts, tcs, combined_text)
     for tc in tcs:
-        tc["source_excerpt"] = extract_excerpt(combined_text, tc.get("title", ""))
         if project_id:
             tc["project_id"] = project_id  # link test case to project
 
-    saved = save_testcases(rid, tcs, combined_text, project_id)
+    saved, skipped = await asyncio.to_thread(save_testcases, rid, tcs, combined_text, project_id, template.version)
+
+    # Record which section each case came from so re-ingests can be incremental. On a full
+    # regeneration the previous revision's cases are superseded, except those the new output duplicated.
+    if state_loaded:
+        section_tests = await asyncio.to_thread(attribute_rows, saved, sections, combined_text)
+        obsolete = {k: list(v) for k, v in previous.items()}
+        old_owner = {tid: key for key, tids in obsolete.items() for tid in tids}
+        live_keys = {sec.key for sec in sections}
+        for dup in skipped:
+            old_key = old_owner.pop(dup["duplicate_of"], None)
+            if old_key is not None:
+                obsolete[old_key].remove(dup["duplicate_of"])
+                section_tests.setdefault(old_key if old_key in live_keys else DOC_KEY, []).append(dup["duplicate_of"])
+        obsolete = {k: v for k, v in obsolete.items() if v}
+        try:
+            await asyncio.to_thread(save_section_state, rid, revision + 1, sections, section_tests, obsolete)
+        except Exception as e:
+            log.warning(f"Could not record sections for {rid}: {e}")
 
     return {
         "ok": True,
@@ -460,76 +944,352 @@ async def generate_unified(
         "source_type": source_type,
         "generated": len(saved),
         "test_cases": saved,
+        "duplicates_skipped": skipped,
         "project_id": project_id,
     }
 
-@app.get("/testcases/project/{project_id}")
-def get_testcases_by_project(project_id: str):
+async def _regenerate_sections(
+    rid: str,
+    combined_text: str,
+    title: Optional[str],
+    project_id: Optional[str],
+    source_type: str,
+    force_regenerate: bool,
+    template: PromptTemplate,
+    sections: list,
+    revision: int,
+    previous: Dict[str, List[str]],
+    checksum: Optional[str] = None,
+) -> dict:
     """
-    Fetch all generated test cases for a given project_id from BigQuery.
+    Incremental regeneration: only new or edited sections go to the model.
+    Cases of unchanged sections are kept; cases of sections that no longer
+    exist are recorded as obsolete in the new revision.
     """
-    try:
-        query = f"""
-        SELECT 
-            tc.test_id, 
-            tc.req_id, 
-            tc.title, 
-            tc.severity, 
-            tc.expected_result, 
-            tc.steps, 
-            tc.created_at, 
-            tc.project_id,
-            tc.source_excerpt,
-
-            -- trace link table fields
-            tr.external_system,
-            tr.external_key,
-            tr.external_url AS trace_link,
-            tr.created_at AS trace_created_at,
-
-            -- computed field for UI: is_pushed
-            CASE
-                WHEN tr.external_url IS NOT NULL AND tr.external_url != '' THEN TRUE
-                ELSE FALSE
-            END AS is_pushed
-
-        FROM `{TABLE_TC}` AS tc
-        LEFT JOIN `{TABLE_TRL}` AS tr
-        ON tc.project_id = tr.project_id AND tc.test_id = tr.test_id
-
-        WHERE tc.project_id = @pid
-        ORDER BY tc.created_at DESC
-        """
-        job = get_bq().query(
-            query,
-            job_config=bigquery.QueryJobConfig(
-                query_parameters=[bigquery.ScalarQueryParameter("pid", "STRING", project_id)]
-            ),
+    plan = plan_revision(sections, previous)
+    log.debug(
+        f"regenerate_sections {rid}: {len(plan.changed)} changed, "
+        f"{len(plan.unchanged)} unchanged, {len(plan.deleted)} deleted"
+    )
+    saved, skipped = [], []
+    section_tests: Dict[str, List[str]] = {k: list(v) for k, v in plan.kept.items()}
+    obsolete: Dict[str, List[str]] = {k: list(v) for k, v in plan.deleted.items()}
+
+    if plan.changed or plan.deleted:
+        upsert = asyncio.to_thread(upsert_requirement, rid, title or "(Unified Upload)", combined_text, checksum)
+        _, results = await asyncio.gather(
+            upsert, generate_per_chunk(rid, plan.changed, template, force_regenerate=force_regenerate)
         )
 
-        results = []
-        for row in job.result():
-            results.append({
-                "test_id": row["test_id"],
-                "req_id": row["req_id"],
-                "title": row["title"],
-                "severity": row["severity"],
-                "expected_result": row["expected_result"],
-                "steps": row["steps"],
-                "createdAt": row["created_at"],
-                "project_id": row["project_id"],
-                "source_excerpt": row["source_excerpt"],
-                "trace_link": row.get("trace_link"),
-                "external_system": row.get("external_system"),
-                "external_key": row.get("external_key"),
-                "trace_created_at": row.get("trace_created_at"),
-                "is_pushed": row.get("is_pushed", False),
+        batch = uuid.uuid4().hex[:6].upper()
+        owner: Dict[str, str] = {}
+        tcs = []
+        for sec, sec_tcs in zip(plan.changed, results):
+            for tc in sec_tcs:
+                tc["test_id"] = f"TEST-{batch}-{len(tcs) + 1:03d}"
+                if project_id:
+                    tc["project_id"] = project_id
+                owner[tc["test_id"]] = sec.key
+                tcs.append(tc)
+        if plan.changed and not tcs:
+            raise HTTPException(500, "Model returned no test_cases")
+
+        if tcs:
+            saved, skipped = await asyncio.to_thread(
+                save_testcases, rid, tcs, combined_text, project_id, template.version
+            )
+        for row in saved:
+            section_tests.setdefault(owner[row["test_id"]], []).append(row["test_id"])
+
+        # A regenerated case that duplicates one from an edited section keeps the old case alive
+        old_owner = {tid: key for key, tids in obsolete.items() for tid in tids}
+        for dup in skipped:
+            old_key = old_owner.pop(dup["duplicate_of"], None)
+            if old_key is not None:
+                obsolete[old_key].remove(dup["duplicate_of"])
+                section_tests.setdefault(owner[dup["test_id"]], []).append(dup["duplicate_of"])
+        obsolete = {k: v for k, v in obsolete.items() if v}
+
+        await asyncio.to_thread(save_section_state, rid, revision + 1, sections, section_tests, obsolete)
+        revision += 1
+
+    return {
+        "ok": True,
+        "req_id": rid,
+        "title": title or "(Unified Upload)",
+        "project_id": project_id,
+        "source_type": source_type,
+        "generated": len(saved),
+        "test_cases": saved,
+        "duplicates_skipped": skipped,
+        "incremental": {
+            "revision": revision,
+            "sections_total": len(sections),
+            "sections_changed": len(plan.changed),
+            "sections_unchanged": len(plan.unchanged),
+            "sections_deleted": len(plan.deleted),
+            "kept_test_ids": sorted({t for k, v in section_tests.items() for t in v} - {r["test_id"] for r in saved}),
+            "obsolete_test_ids": sorted(t for v in obsolete.values() for t in v),
+        },
+    }
+
+def _stream_event(fmt: str, event: str, data: dict) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    return json.dumps({"event": event, "data": data}, default=str) + "\n"
+
+@app.post("/generate_unified/stream")
+async def generate_unified_stream(
+    files: Optional[List[UploadFile]] = None,
+    links: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    req_id: Optional[str] = Form(None),
+    title: Optional[str] = Form(None),
+    project_id: Optional[str] = Form(None),
+    force_regenerate: bool = Form(False),
+    prompt_version: Optional[str] = Form(None),
+    format: str = Form("ndjson"),
+):
+    """
+    Streaming variant of /generate_unified. Emits one event per test case as
+    soon as its JSON object closes in the model's token stream, persisting rows
+    in batches of STREAM_BATCH_SIZE along the way.
+
+    format = "ndjson" (one {"event", "data"} object per line) or "sse".
+    Events: start, test_case, duplicate, done, error.
+    """
+    fmt = "sse" if (format or "").lower() == "sse" else "ndjson"
+    template = load_prompt(prompt_version)
+    async with spooled_uploads(files) as uploads:
+        extracted_texts, source_type, checksum = await collect_sources(uploads, links, description)
+    combined_text = "\n\n".join(extracted_texts)
+    rid = (req_id or f"REQ-{uuid.uuid4().hex[:6].upper()}").strip()
+    req_title = title or "(Unified Upload)"
+    prompt = fill_prompt(template, rid, combined_text)
+    model_name = choose_model(combined_text, template)
+
+    async def events():
+        upsert = asyncio.create_task(asyncio.to_thread(upsert_requirement, rid, req_title, combined_text, checksum))
+        inserts = []
+        pending: List[dict] = []
+        rows: List[dict] = []
+        parser = TestCaseStream()
+        skipped: List[dict] = []
+        settled = False
+
+        def flush():
+            if pending:
+                inserts.append(asyncio.create_task(insert_testcase_rows_async(list(pending))))
+                pending.clear()
+
+        async def settle():
+            """Write rows still buffered and wait for every queued write, logging failures."""
+            nonlocal settled
+            if settled:
+                return
+            settled = True
+            flush()
+            for result in await asyncio.gather(upsert, *inserts, return_exceptions=True):
+                if isinstance(result, BaseException):
+                    log.error(f"generate_unified_stream {rid}: write failed: {result!r}")
+
+        def emit(tc: dict) -> str:
+            attach_excerpts([tc], excerpts)
+            row = build_testcase_rows(rid, [tc], combined_text, project_id, template.version, model_name)[0]
+            _, dupes = dedupe_rows(rid, project_id, [row])
+            if dupes:
+                skipped.extend(dupes)
+                return _stream_event(fmt, "duplicate", dupes[0])
+            rows.append(row)
+            pending.append(row)
+            if len(pending) >= STREAM_BATCH_SIZE:
+                flush()
+            return _stream_event(fmt, "test_case", row)
+
+        try:
+            if _deduper is not None:
+                # Seed the dedupe indexes up front so per-case checks stay in memory
+                await asyncio.to_thread(_deduper.warm, rid, project_id)
+            # One excerpt index for the whole stream
+            excerpts = await asyncio.to_thread(ExcerptIndex, combined_text)
+
+            yield _stream_event(fmt, "start", {
+                "req_id": rid, "title": req_title, "project_id": project_id, "source_type": source_type,
             })
+            async for chunk in stream_model_async(
+                prompt, force_regenerate=force_regenerate, prompt_version=template.version, model_name=model_name
+            ):
+                for tc in parser.feed(chunk):
+                    yield emit(tc)
+            # Output cut off at max_output_tokens: keep the last case if it can be closed off
+            tail = close_truncated(parser.pending()) if not parser.done and parser.pending() else None
+            if tail and tail.get("title"):
+                yield emit(tail)
+            flush()
+            await upsert
+            await asyncio.gather(*inserts)
+            settled = True
+            if not rows and not skipped:
+                yield _stream_event(fmt, "error", {"detail": "Model returned no test_cases"})
+                return
+            yield _stream_event(fmt, "done", {"req_id": rid, "generated": len(rows), "duplicates_skipped": skipped})
+        except Exception as e:
+            log.exception(f"generate_unified_stream {rid} failed: {e}")
+            # Cases already sent to the client are still persisted
+            await settle()
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield _stream_event(fmt, "error", {"detail": detail, "generated": len(rows)})
+        finally:
+            # Client disconnect (GeneratorExit / CancelledError): shielded so a second cancel can't drop writes
+            await asyncio.shield(settle())
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+def load_project_testcases(project_id: str) -> dict:
+    results = []
+    for row in get_storage().project_testcases(project_id):
+        results.append({
+            "test_id": row["test_id"],
+            "req_id": row["req_id"],
+            "title": row["title"],
+            "severity": row["severity"],
+            "expected_result": row["expected_result"],
+            "steps": row["steps"],
+            "createdAt": row["created_at"],
+            "project_id": row["project_id"],
+            "source_excerpt": row["source_excerpt"],
+            "trace_link": row.get("trace_link"),
+            "external_system": row.get("external_system"),
+            "external_key": row.get("external_key"),
+            "trace_created_at": row.get("trace_created_at"),
+            "is_pushed": row.get("is_pushed", False),
+            "obsolete": bool(row.get("obsolete")),
+        })
+    # Encoded once here so cache hits and the ETag don't redo it
+    return jsonable_encoder({"ok": True, "count": len(results), "test_cases": results})
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+# Listing field name -> storage column
+LISTING_FIELDS = {
+    "test_id": "test_id", "req_id": "req_id", "title": "title", "severity": "severity",
+    "expected_result": "expected_result", "steps": "steps", "createdAt": "created_at",
+    "project_id": "project_id", "source_excerpt": "source_excerpt", "trace_link": "trace_link",
+    "external_system": "external_system", "external_key": "external_key",
+    "trace_created_at": "trace_created_at", "is_pushed": "is_pushed", "obsolete": "obsolete",
+}
+
+def encode_cursor(created_at, test_id: str) -> str:
+    ts = created_at.isoformat() if hasattr(created_at, "isoformat") else str(created_at)
+    return base64.urlsafe_b64encode(json.dumps([ts, test_id]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        ts, test_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(ts), str(test_id)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+def _json_default(o):
+    return o.isoformat() if hasattr(o, "isoformat") else str(o)
+
+def stream_project_page(project_id: str, limit: int, cursor: Optional[str], fields: Optional[str]) -> StreamingResponse:
+    """
+    One keyset page of a project's test cases, newest first, with only the
+    requested fields. Rows are pulled lazily from storage and written to the
+    response as they arrive; next_cursor is null on the last page.
+    """
+    names = [f.strip() for f in (fields or "").split(",") if f.strip()] or list(LISTING_FIELDS)
+    unknown = [f for f in names if f not in LISTING_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {unknown}; allowed: {sorted(LISTING_FIELDS)}")
+    limit = max(1, min(limit, PAGE_MAX_LIMIT))
+    after = decode_cursor(cursor) if cursor else None
+
+    # One extra row tells whether another page exists
+    rows = get_storage().iter_project_testcases(project_id, [LISTING_FIELDS[f] for f in names], after, limit + 1)
+    try:
+        first = next(rows, None)  # runs the query now, so failures still get a proper 500
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching testcases: {e}")
 
-        return {"ok": True, "count": len(results), "test_cases": results}
+    def body():
+        count, last, row = 0, None, first
+        yield '{"ok":true,"test_cases":['
+        while row is not None:
+            if count == limit:
+                break
+            item = {f: row.get(LISTING_FIELDS[f]) for f in names}
+            for flag in ("is_pushed", "obsolete"):
+                if flag in item:
+                    item[flag] = bool(item[flag])
+            yield ("," if count else "") + json.dumps(item, default=_json_default)
+            count, last = count + 1, row
+            row = next(rows, None)
+        more = row is not None and last is not None
+        next_cursor = encode_cursor(last["created_at"], last["test_id"]) if more else None
+        yield f'],"count":{count},"next_cursor":{json.dumps(next_cursor)}}}'
+
+    return StreamingResponse(body(), media_type="application/json")
+
+@app.get("/projects/{project_id}/summary")
+def get_project_summary(project_id: str):
+    """
+    Test case counts for a project: total, by severity, pushed / unpushed and
+    per requirement. Served from incrementally maintained aggregates.
+    """
+    summaries = get_project_summaries()
+    if summaries is None:
+        # Disabled: aggregate one pass over the narrow listing instead
+        summaries = ProjectSummaries(load_summary_rows)
+    return summaries.get(project_id)
+
+@app.post("/projects/summary/rebuild")
+def rebuild_project_summaries(project_id: Optional[str] = None):
+    """Recompute one project's summary from storage, or drop all of them (each is re-seeded on its next read)."""
+    summaries = get_project_summaries()
+    if summaries is None:
+        raise HTTPException(404, "Project summaries are disabled (PROJECT_SUMMARY_ENABLED=0)")
+    summary = summaries.rebuild(project_id)
+    return {"ok": True, "summary": summary} if project_id else {"ok": True}
 
+@app.get("/testcases/project/{project_id}")
+def get_testcases_by_project(project_id: str, request: Request, limit: Optional[int] = None,
+                             cursor: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Fetch all generated test cases for a given project_id, with their trace links.
+    Listings are cached per project until a write touches it; If-None-Match answers 304.
+
+    With limit / cursor / fields the listing is paged instead: keyset pages on
+    (createdAt, test_id), newest first, projected to the comma-separated fields,
+    streamed as they are read. Pass the returned next_cursor to get the next page.
+    """
+    if limit is not None or cursor or fields:
+        return stream_project_page(project_id, limit or PAGE_DEFAULT_LIMIT, cursor, fields)
+
+    cache = get_project_cache()
+    try:
+        if cache is None:
+            payload = load_project_testcases(project_id)
+            etag = etag_for(payload)
+        else:
+            etag, payload, _ = cache.load(
+                project_id,
+                lambda: load_project_testcases(project_id),
+                members=lambda p: (tc["test_id"] for tc in p["test_cases"]),
+            )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching testcases: {e}")
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
     
 
 class PushBody(BaseModel):
@@ -586,7 +1346,12 @@ def build_adf_description(summary: str, steps: list[str] | None = None, expected
     return adf
 
 
-def save_trace_link(req_id: str, test_id: str, system: str, key: str, url: str, project_id: str):
+def save_trace_link(req_id: str, test_id: str, system: str, key: str, url: str, project_id: str,
+                    wait: bool = True):
+    """
+    Record a push to an external system. wait=False queues the row and returns
+    the writer's future (resolving to the row errors) instead of blocking.
+    """
     rows = [{
         "req_id": req_id,
         "test_id": test_id,
@@ -597,12 +1362,24 @@ def save_trace_link(req_id: str, test_id: str, system: str, key: str, url: str,
         "created_by": CREATED_BY,
         "project_id": project_id,
     }]
-    errs = get_bq().insert_rows_json(TABLE_TRL, rows)
+    if not wait:
+        fut = get_storage().submit(TRACE_LINKS, rows)
+        def landed(f):
+            invalidate_reads([project_id], [req_id], [test_id])
+            if url and not f.exception() and not f.result():
+                record_summary(pushed=(project_id, test_id))
+
+        fut.add_done_callback(landed)
+        return fut
+    errs = get_storage().write(TRACE_LINKS, rows)
+    invalidate_reads([project_id], [req_id], [test_id])
     if errs:
         raise HTTPException(500, f"Trace insert failed: {errs}")
+    if url:
+        record_summary(pushed=(project_id, test_id))
 
-@app.post("/push/jira")
-def push_jira(body: PushBody):
+def create_jira_issue(body: PushBody, wait: bool = True) -> dict:
+    """Create the Jira issue and its trace link; wait=False leaves the link write queued in "trace_write"."""
     #log.debug(f"Push to Jira called with: {body}")
     if not (body.jira_domain and body.jira_email and body.jira_api_token and body.jira_project_key):
         raise HTTPException(400, "Missing Jira credentials from request body")
@@ -641,16 +1418,24 @@ def push_jira(body: PushBody):
     issue_url = f"https://{jira_domain}/browse/{issue_key}"
 
     
-    save_trace_link(
+    pending = save_trace_link(
         req_id=body.req_id or "",
         test_id=body.test_id or "",
         system="Jira",
         key=issue_key,
         url=issue_url,
         project_id=body.project_id or "",
+        wait=wait,
     )   
 
-    return {"ok": True, "external_key": issue_key, "external_url": issue_url}
+    out = {"ok": True, "external_key": issue_key, "external_url": issue_url}
+    if not wait:
+        out["trace_write"] = pending
+    return out
+
+@app.post("/push/jira")
+def push_jira(body: PushBody):
+    return create_jira_issue(body)
 
 @app.post("/manual/testcase")
 async def create_manual_testcase(body: dict):
@@ -677,10 +1462,12 @@ async def create_manual_testcase(body: dict):
             "project_id": body.get("project_id") or "",
         }
 
-        errs = get_bq().insert_rows_json(TABLE_TC, [tc])
+        errs = await get_storage().awrite(TESTCASES, [tc])
+        invalidate_reads([tc["project_id"]], [tc["req_id"]])
         if errs:
             log.error(f"Manual test case insert error: {errs}")
             return {"ok": False, "error": str(errs)}
+        record_summary(testcases=[tc])
 
         return {"ok": True, "test_id": tc["test_id"], "req_id" : tc["req_id"], "createdAt": tc["created_at"]}
 
@@ -691,62 +1478,56 @@ async def create_manual_testcase(body: dict):
 @app.post("/manual/testcase/update")
 async def update_manual_testcase(body: Dict[str, Any]):
     """
-    Update a manual test case entry in BigQuery by test_id.
+    Update a manual test case entry by test_id. The edit is appended to the
+    edit journal (no DML); reads see it immediately.
     """
     try:
         test_id = body.get("test_id")
         if not test_id:
             raise HTTPException(status_code=400, detail="Missing test_id")
 
-        client = get_bq()
-        table = TABLE_TC
-
         allowed_fields = ["title", "expected_result", "steps", "severity"]
         update_fields = {k: body.get(k) for k in allowed_fields if k in body}
 
         if not update_fields:
             raise HTTPException(status_code=400, detail="No fields to update")
 
-        set_clauses = []
-        query_params = [bigquery.ScalarQueryParameter("test_id", "STRING", test_id)]
-
-        for k, v in update_fields.items():
-            if k == "steps" and isinstance(v, list):
-                set_clauses.append(f"{k} = @{k}")
-                query_params.append(bigquery.ArrayQueryParameter(k, "STRING", v))
-            else:
-                set_clauses.append(f"{k} = @{k}")
-                query_params.append(bigquery.ScalarQueryParameter(k, "STRING", v))
-
-        set_clause_str = ", ".join(set_clauses)
+        await asyncio.to_thread(get_storage().update_testcase, test_id, update_fields, body.get("user_id"))
+        invalidate_reads([body.get("project_id")], test_ids=[test_id])
+        record_summary(edit=(test_id, update_fields, body.get("project_id")))
 
-        query = f"""
-            UPDATE `{table}`
-            SET {set_clause_str}
-            WHERE test_id = @test_id
-        """
-
-        job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-        job = client.query(query, job_config=job_config)
-        job.result()
-
-        print("Testcase {test_id} updated successfully.")
+        log.info(f"Testcase {test_id} updated successfully.")
         return {"ok": True, "test_id": test_id}
 
     except Exception as e:
-        print("Update error:", e)
+        log.exception(f"Update error: {e}")
         return {"ok": False, "error": str(e)}
     
+@app.get("/manual/testcase/{test_id}/history")
+def get_testcase_history(test_id: str):
+    """Edits made to a test case, oldest first."""
+    return {"test_id": test_id, "edits": jsonable_encoder(get_storage().testcase_history(test_id))}
+
 @app.post("/push/jira/bulk")
 def push_jira_bulk(body: list[PushBody]):
     results = []
+    writes = []
     for item in body:
         try:
-            print(item)
-            result = push_jira(item)  # reuse your existing function
+            log.debug(f"push_jira_bulk: {item.test_id}")
+            # Trace links are queued, then confirmed together below (one BigQuery round trip per batch)
+            result = create_jira_issue(item, wait=False)
             results.append({"test_id": item.test_id, "ok": True, "key": result["external_key"]})
+            writes.append((results[-1], result["trace_write"]))
         except HTTPException as e:
             results.append({"test_id": item.test_id, "ok": False, "error": str(e.detail)})
+    for res, fut in writes:
+        try:
+            errs = fut.result()
+        except Exception as e:
+            errs = [str(e)]
+        if errs:
+            res.update(ok=False, error=f"Trace insert failed: {errs}")
     return {"results": results}
 
 
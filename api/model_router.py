@@ -0,0 +1,231 @@
+# api/model_router.py
+"""
+Per-request model choice between a fast tier and a larger tier.
+
+Requests go to MODEL_LARGE when the input is long, the prompt asks for many
+cases, or the text is compliance-heavy; everything else goes to MODEL_FAST.
+Observed outcomes feed a rolling window per model: a tier whose recent error
+rate is too high, or whose median latency blows ROUTE_LATENCY_BUDGET_S, is
+bypassed in favour of the other. Latency histograms are kept per model so the
+thresholds can be tuned from real traffic (see /metrics/models).
+
+Routing is opt-in: it needs MODEL_ROUTING=1 and a MODEL_LARGE. Otherwise every
+request goes to MODEL_FAST.
+"""
+import os, re, time, logging, threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger("orbit-trace")
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "0") not in ("0", "false", "False", "")
+MODEL_FAST = os.getenv("MODEL_FAST", os.getenv("MODEL_NAME", "gemini-2.0-flash-001"))
+MODEL_LARGE = os.getenv("MODEL_LARGE", "")
+
+ROUTE_LARGE_CHARS = int(os.getenv("ROUTE_LARGE_CHARS", "16000"))
+ROUTE_LARGE_CASES = int(os.getenv("ROUTE_LARGE_CASES", "15"))
+ROUTE_COMPLIANCE_HITS = int(os.getenv("ROUTE_COMPLIANCE_HITS", "6"))
+ROUTE_WINDOW_S = float(os.getenv("ROUTE_WINDOW_S", "300"))
+ROUTE_MIN_SAMPLES = int(os.getenv("ROUTE_MIN_SAMPLES", "5"))
+ROUTE_MAX_ERROR_RATE = float(os.getenv("ROUTE_MAX_ERROR_RATE", "0.3"))
+ROUTE_LATENCY_BUDGET_S = float(os.getenv("ROUTE_LATENCY_BUDGET_S", "90"))
+
+GEN_CONFIG = {"temperature": 0.2, "max_output_tokens": 2048}
+# The large tier is typically a thinking model: its thinking tokens come out of the same output budget
+GEN_CONFIG_LARGE = {
+    "temperature": 0.2,
+    "max_output_tokens": int(os.getenv("MODEL_LARGE_MAX_OUTPUT_TOKENS", "8192")),
+}
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = [0.5, 1, 2, 4, 8, 16, 32, 64, 128]
+
+# Named standards and controls only; generic words (regulatory, traceability, FDA, PHI) appear in
+# ordinary medical requirements and would send most of them to the large tier
+_COMPLIANCE = re.compile(
+    r"\b(?:IEC\s*62304|IEC\s*60601|ISO\s*13485|ISO\s*14971|ISO\s*27001|HIPAA|GDPR|21\s*CFR|"
+    r"SOC\s*2|audit\s+trail|electronic\s+signature)\b",
+    re.IGNORECASE,
+)
+
+
+def compliance_hits(text: str, compliance: Optional[List[str]] = None) -> int:
+    return len(_COMPLIANCE.findall(text or "")) + len(compliance or [])
+
+
+@dataclass
+class Route:
+    model: str
+    tier: str      # fast | large
+    reason: str
+
+
+class _ModelStats:
+    def __init__(self):
+        self.samples: deque = deque()   # (monotonic ts, seconds, ok)
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.calls = 0
+        self.errors = 0
+
+    def add(self, seconds: float, ok: bool, now: float):
+        self.samples.append((now, seconds, ok))
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def trim(self, now: float, window: float):
+        while self.samples and now - self.samples[0][0] > window:
+            self.samples.popleft()
+
+    def window(self) -> dict:
+        n = len(self.samples)
+        lat = sorted(s for _, s, ok in self.samples if ok)
+        pct = lambda p: round(lat[min(len(lat) - 1, int(round(p / 100.0 * (len(lat) - 1))))], 3) if lat else 0.0
+        errors = sum(1 for _, _, ok in self.samples if not ok)
+        return {
+            "samples": n,
+            "error_rate": round(errors / n, 3) if n else 0.0,
+            "p50_s": pct(50),
+            "p95_s": pct(95),
+        }
+
+
+class ModelRouter:
+    def __init__(self, fast: str = MODEL_FAST, large: str = MODEL_LARGE, enabled: bool = MODEL_ROUTING,
+                 large_chars: int = ROUTE_LARGE_CHARS, large_cases: int = ROUTE_LARGE_CASES,
+                 compliance_hits: int = ROUTE_COMPLIANCE_HITS, window_s: float = ROUTE_WINDOW_S):
+        self.fast = fast
+        self.large = large
+        self.enabled = enabled and bool(large) and large != fast
+        self.large_chars = large_chars
+        self.large_cases = large_cases
+        self.compliance_hits = compliance_hits
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _ModelStats] = {}
+        self._routed: Dict[str, int] = {}
+
+    def _window(self, model: str) -> dict:
+        st = self._stats.get(model)
+        if st is None:
+            return {"samples": 0, "error_rate": 0.0, "p50_s": 0.0, "p95_s": 0.0}
+        st.trim(time.monotonic(), self.window_s)
+        return st.window()
+
+    def _unhealthy(self, model: str) -> Optional[str]:
+        w = self._window(model)
+        if w["samples"] < ROUTE_MIN_SAMPLES:
+            return None
+        if w["error_rate"] > ROUTE_MAX_ERROR_RATE:
+            return "errors"
+        if w["p50_s"] > ROUTE_LATENCY_BUDGET_S:
+            return "latency"
+        return None
+
+    def tier_of(self, model: str) -> str:
+        return "large" if self.enabled and model == self.large else "fast"
+
+    def route(self, text: str, cases: int = 0, compliance: Optional[List[str]] = None) -> Route:
+        """Pick the model for one request from its size, case count and compliance load."""
+        if not self.enabled:
+            return Route(self.fast, "fast", "routing disabled")
+        reasons = []
+        if len(text or "") >= self.large_chars:
+            reasons.append(f"{len(text)} chars")
+        if cases >= self.large_cases:
+            reasons.append(f"{cases} cases")
+        if compliance_hits(text, compliance) >= self.compliance_hits:
+            reasons.append("compliance-heavy")
+        tier = "large" if reasons else "fast"
+        reason = ", ".join(reasons) or "short input"
+
+        with self._lock:
+            chosen, other = (self.large, self.fast) if tier == "large" else (self.fast, self.large)
+            problem = self._unhealthy(chosen)
+            if problem and not self._unhealthy(other):
+                log.info(f"router: {chosen} degraded ({problem}), sending to {other}")
+                chosen, tier = other, ("fast" if tier == "large" else "large")
+                reason = f"{reason}; {problem} fallback"
+            self._routed[chosen] = self._routed.get(chosen, 0) + 1
+        return Route(chosen, tier, reason)
+
+    def record(self, model: str, seconds: float, ok: bool = True):
+        with self._lock:
+            st = self._stats.setdefault(model, _ModelStats())
+            now = time.monotonic()
+            st.add(seconds, ok, now)
+            st.trim(now, self.window_s)
+
+    def timed(self, model: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+        """Wrap a model call so each attempt's latency and outcome is recorded."""
+        def call():
+            t0 = time.monotonic()
+            try:
+                result = fn()
+            except Exception:
+                self.record(model, time.monotonic() - t0, ok=False)
+                raise
+            self.record(model, time.monotonic() - t0)
+            return result
+        return call
+
+    def timed_async(self, model: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+        async def call():
+            t0 = time.monotonic()
+            try:
+                result = await fn()
+            except Exception:
+                self.record(model, time.monotonic() - t0, ok=False)
+                raise
+            self.record(model, time.monotonic() - t0)
+            return result
+        return call
+
+    def metrics(self) -> dict:
+        with self._lock:
+            models = {}
+            for model, st in self._stats.items():
+                st.trim(time.monotonic(), self.window_s)
+                bounds = [str(b) for b in LATENCY_BUCKETS] + ["+Inf"]
+                models[model] = {
+                    "calls": st.calls,
+                    "errors": st.errors,
+                    "routed": self._routed.get(model, 0),
+                    "window": st.window(),
+                    "histogram_s": dict(zip(bounds, st.buckets)),
+                }
+            return {
+                "enabled": self.enabled,
+                "fast": self.fast,
+                "large": self.large,
+                "thresholds": {
+                    "large_chars": self.large_chars,
+                    "large_cases": self.large_cases,
+                    "compliance_hits": self.compliance_hits,
+                    "window_s": self.window_s,
+                    "max_error_rate": ROUTE_MAX_ERROR_RATE,
+                    "latency_budget_s": ROUTE_LATENCY_BUDGET_S,
+                },
+                "models": models,
+            }
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+def get_router() -> ModelRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+def gen_config(model_name: str) -> dict:
+    """Generation config for the tier the model belongs to (API and batch runs alike)."""
+    return GEN_CONFIG_LARGE if get_router().tier_of(model_name) == "large" else GEN_CONFIG
@@ -0,0 +1,309 @@
+# api/model_scheduler.py
+"""
+Admission control for Vertex model calls.
+
+Every call first reserves one request and an estimated token count from the
+per-model requests-per-minute / tokens-per-minute buckets. Interactive callers
+(PRIORITY_INTERACTIVE) are admitted ahead of batch callers (PRIORITY_BATCH)
+waiting on the same model. 429/5xx responses are retried with full-jitter
+exponential backoff.
+
+The buckets and the lane queues live in a SQLite file (MODEL_SCHEDULER_PATH),
+so every process on the host that points at it -- API workers and phase1 batch
+runs alike -- draws from one budget and a batch run yields to queued
+interactive calls. They are not shared across hosts. MODEL_SCHEDULER_PATH=""
+keeps them in memory, which limits and orders calls within one process only.
+
+Per-model limits: MODEL_RPM / MODEL_TPM apply to every model, MODEL_LIMITS
+(JSON, e.g. {"gemini-2.0-pro-001": {"rpm": 30, "tpm": 500000}}) overrides them.
+"""
+import os, json, time, uuid, random, asyncio, logging, sqlite3, threading
+from typing import Any, Callable, Dict, Optional
+
+from google.api_core import exceptions as gexc
+
+from cache import CACHE_DIR
+
+log = logging.getLogger("orbit-trace")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+_LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+MODEL_RPM = float(os.getenv("MODEL_RPM", "60"))
+MODEL_TPM = float(os.getenv("MODEL_TPM", "1000000"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "5"))
+MODEL_BACKOFF_BASE = float(os.getenv("MODEL_BACKOFF_BASE", "1.0"))
+MODEL_BACKOFF_MAX = float(os.getenv("MODEL_BACKOFF_MAX", "30"))
+MODEL_SCHEDULER_PATH = os.getenv("MODEL_SCHEDULER_PATH", os.path.join(CACHE_DIR, "model_scheduler.sqlite3"))
+MODEL_SCHEDULER_STALE_S = float(os.getenv("MODEL_SCHEDULER_STALE_S", "5"))  # a queued caller not seen since is gone
+
+_RETRYABLE = (
+    gexc.TooManyRequests, gexc.ResourceExhausted, gexc.InternalServerError,
+    gexc.BadGateway, gexc.ServiceUnavailable, gexc.GatewayTimeout, gexc.DeadlineExceeded,
+)
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+def _load_limits() -> Dict[str, dict]:
+    try:
+        return json.loads(os.getenv("MODEL_LIMITS", "") or "{}")
+    except json.JSONDecodeError as e:
+        log.warning(f"Ignoring invalid MODEL_LIMITS: {e}")
+        return {}
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, _RETRYABLE):
+        return True
+    code = getattr(e, "code", None)
+    return isinstance(code, int) and code in _RETRYABLE_CODES
+
+def estimate_tokens(prompt: str, max_output_tokens: int = 0) -> int:
+    """Rough budget: ~4 chars per prompt token plus the output allowance."""
+    return len(prompt) // 4 + int(max_output_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (0 if it is now). Does not take."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class SharedBuckets:
+    """
+    The same buckets and lane queues kept in SQLite. Waiters re-register on
+    every poll; entries not refreshed within MODEL_SCHEDULER_STALE_S (a
+    crashed process) stop holding back lower-priority lanes.
+    """
+
+    def __init__(self, path: str = MODEL_SCHEDULER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (model TEXT NOT NULL, kind TEXT NOT NULL, level REAL NOT NULL, "
+            "updated REAL NOT NULL, PRIMARY KEY (model, kind))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS waiters (owner TEXT PRIMARY KEY, model TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, seen REAL NOT NULL)"
+        )
+
+    def _bucket(self, model: str, kind: str, capacity: float, now: float) -> float:
+        row = self._conn.execute("SELECT level, updated FROM buckets WHERE model=? AND kind=?", (model, kind)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + max(0.0, now - row[1]) * capacity / 60.0)
+
+    def try_admit(self, owner: str, model: str, tokens: int, priority: int, rpm: float, tpm: float) -> float:
+        """Take capacity and return 0, or queue `owner` and return how long to wait."""
+        now = time.time()
+        rpm, tpm = max(1.0, rpm), max(1.0, tpm)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ahead = self._conn.execute(
+                    "SELECT 1 FROM waiters WHERE model=? AND priority<? AND seen>? LIMIT 1",
+                    (model, priority, now - MODEL_SCHEDULER_STALE_S),
+                ).fetchone()
+                wait = 0.05 if ahead else 0.0
+                if not wait:
+                    requests = self._bucket(model, "rpm", rpm, now)
+                    budget = self._bucket(model, "tpm", tpm, now)
+                    need = min(tokens, tpm)
+                    wait = max(
+                        0.0 if requests >= 1 else (1 - requests) * 60.0 / rpm,
+                        0.0 if budget >= need else (need - budget) * 60.0 / tpm,
+                    )
+                if wait:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO waiters (owner, model, priority, seen) VALUES (?, ?, ?, ?)",
+                        (owner, model, priority, now),
+                    )
+                    return wait
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (model, kind, level, updated) VALUES (?, ?, ?, ?)",
+                    [(model, "rpm", requests - 1, now), (model, "tpm", budget - need, now)],
+                )
+                self._conn.execute("DELETE FROM waiters WHERE owner=?", (owner,))
+                return 0.0
+            finally:
+                self._conn.execute("COMMIT")
+
+    def leave(self, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM waiters WHERE owner=?", (owner,))
+
+
+class ModelScheduler:
+    def __init__(self, rpm: float = MODEL_RPM, tpm: float = MODEL_TPM, limits: Optional[Dict[str, dict]] = None,
+                 max_retries: int = MODEL_MAX_RETRIES, backoff_base: float = MODEL_BACKOFF_BASE,
+                 backoff_max: float = MODEL_BACKOFF_MAX, shared: Optional[SharedBuckets] = None):
+        self.rpm, self.tpm = rpm, tpm
+        self.shared = shared
+        self.limits = limits if limits is not None else _load_limits()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, tuple] = {}
+        self._waiting: Dict[str, Dict[int, int]] = {}
+        self._metrics: Dict[str, dict] = {}
+
+    # ---- admission ----
+    def _model_state(self, model: str):
+        if model not in self._buckets:
+            lim = self.limits.get(model, {})
+            self._buckets[model] = (TokenBucket(lim.get("rpm", self.rpm)), TokenBucket(lim.get("tpm", self.tpm)))
+            self._waiting[model] = {p: 0 for p in _LANES}
+            self._metrics[model] = {
+                lane: {"admitted": 0, "wait_total_s": 0.0, "wait_max_s": 0.0} for lane in _LANES.values()
+            }
+            self._metrics[model].update({"retries": 0, "failures": 0})
+        return self._buckets[model]
+
+    def _try_admit(self, model: str, tokens: int, priority: int, owner: str) -> float:
+        """Take capacity and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            req_bucket, tok_bucket = self._model_state(model)
+        if self.shared is not None:
+            return self.shared.try_admit(owner, model, tokens, priority, req_bucket.capacity, tok_bucket.capacity)
+        with self._lock:
+            if any(n for p, n in self._waiting[model].items() if p < priority):
+                return 0.05  # a higher-priority lane is queued for this model
+            now = time.monotonic()
+            wait = max(req_bucket.wait_for(1, now), tok_bucket.wait_for(tokens, now))
+            if wait > 0:
+                return wait
+            req_bucket.take(1)
+            tok_bucket.take(tokens)
+            return 0.0
+
+    def _enter(self, model: str, priority: int):
+        with self._lock:
+            self._model_state(model)
+            self._waiting[model][priority] += 1
+
+    def _leave(self, model: str, priority: int, waited: float):
+        with self._lock:
+            self._waiting[model][priority] -= 1
+            m = self._metrics[model][_LANES[priority]]
+            m["admitted"] += 1
+            m["wait_total_s"] += waited
+            m["wait_max_s"] = max(m["wait_max_s"], waited)
+
+    def acquire(self, model: str, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        t0, owner, wait = time.monotonic(), uuid.uuid4().hex, 0.0
+        self._enter(model, priority)
+        try:
+            while True:
+                wait = self._try_admit(model, tokens, priority, owner)
+                if not wait:
+                    break
+                time.sleep(min(wait, 0.5))
+        finally:
+            if wait and self.shared is not None:
+                self.shared.leave(owner)
+            self._leave(model, priority, time.monotonic() - t0)
+
+    async def acquire_async(self, model: str, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        t0, owner, wait = time.monotonic(), uuid.uuid4().hex, 0.0
+        self._enter(model, priority)
+        try:
+            while True:
+                if self.shared is not None:
+                    wait = await asyncio.to_thread(self._try_admit, model, tokens, priority, owner)
+                else:
+                    wait = self._try_admit(model, tokens, priority, owner)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, 0.5))
+        finally:
+            if wait and self.shared is not None:
+                self.shared.leave(owner)
+            self._leave(model, priority, time.monotonic() - t0)
+
+    # ---- execution with retry ----
+    def _backoff(self, model: str, attempt: int, e: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        with self._lock:
+            self._metrics[model]["retries"] += 1
+        log.warning(f"{model}: retryable error ({e}); attempt {attempt + 1}/{self.max_retries}, sleeping {delay:.2f}s")
+        return delay
+
+    def _fail(self, model: str):
+        with self._lock:
+            self._metrics[model]["failures"] += 1
+
+    def run(self, model: str, fn: Callable[[], Any], tokens: int = 0, priority: int = PRIORITY_INTERACTIVE):
+        """Call fn() once admitted, retrying 429/5xx with jittered exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(model, tokens, priority)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._fail(model)
+                    raise
+                time.sleep(self._backoff(model, attempt, e))
+
+    async def run_async(self, model: str, fn: Callable[[], Any], tokens: int = 0,
+                        priority: int = PRIORITY_INTERACTIVE):
+        """Async version of run(); fn returns an awaitable."""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(model, tokens, priority)
+            try:
+                return await fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._fail(model)
+                    raise
+                await asyncio.sleep(self._backoff(model, attempt, e))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            out = {}
+            for model, m in self._metrics.items():
+                req_bucket, tok_bucket = self._buckets[model]
+                entry = {
+                    "rpm": req_bucket.capacity, "tpm": tok_bucket.capacity,
+                    "retries": m["retries"], "failures": m["failures"],
+                }
+                for p, lane in _LANES.items():
+                    lm = m[lane]
+                    entry[lane] = {
+                        "queue_depth": self._waiting[model][p],
+                        "admitted": lm["admitted"],
+                        "wait_avg_s": round(lm["wait_total_s"] / lm["admitted"], 4) if lm["admitted"] else 0.0,
+                        "wait_max_s": round(lm["wait_max_s"], 4),
+                    }
+                out[model] = entry
+            return out
+
+
+_scheduler: Optional[ModelScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> ModelScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ModelScheduler(shared=SharedBuckets() if MODEL_SCHEDULER_PATH else None)
+        return _scheduler
@@ -0,0 +1,132 @@
+# api/prompt_registry.py
+"""
+Versioned prompt templates, loaded once and precompiled.
+
+Every prompts/prompt_<name>.txt is registered as version "<name>" with
+underscores turned into dashes (prompt_poc_v1.txt -> "poc-v1"). Templates are
+split into literal / {{placeholder}} segments so rendering is a single join.
+A template is reloaded when its file's mtime changes; mtimes are checked at
+most every PROMPT_RELOAD_INTERVAL seconds so requests don't hit the disk.
+"""
+import os, re, time, logging, threading
+from typing import Dict, List, Optional
+
+log = logging.getLogger("orbit-trace")
+
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "5"))
+
+FALLBACK_PROMPT = (
+    "You are an expert QA engineer.\n"
+    "Requirement ID: {{req_id}}\n"
+    "Requirement Text:\n{{requirement_text}}\n"
+    "Return STRICT JSON with 'test_cases' array."
+)
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+_FILENAME = re.compile(r"^prompt_(.+)\.txt$")
+_CASE_COUNT = re.compile(r"\bgenerate\s+(\d+)\b", re.IGNORECASE)
+
+
+def version_from_filename(filename: str) -> Optional[str]:
+    m = _FILENAME.match(os.path.basename(filename))
+    return m.group(1).replace("_", "-") if m else None
+
+
+class PromptTemplate:
+    def __init__(self, version: str, source: str, path: Optional[str] = None, mtime: float = 0.0):
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.checked = time.monotonic()
+        # Even indexes are literals, odd indexes are placeholder names
+        self.segments: List[str] = _PLACEHOLDER.split(source)
+        self.placeholders = set(self.segments[1::2])
+        # "generate 8 ... test cases" in the template text; 0 when it doesn't say
+        m = _CASE_COUNT.search("".join(self.segments[0::2]))
+        self.requested_cases = int(m.group(1)) if m else 0
+
+    def render(self, **values: str) -> str:
+        segs = self.segments
+        parts = [
+            seg if i % 2 == 0 else values.get(seg, "{{" + seg + "}}")
+            for i, seg in enumerate(segs)
+        ]
+        return "".join(parts)
+
+
+class PromptRegistry:
+    def __init__(self, directory: str, default_version: str, default_path: Optional[str] = None,
+                 reload_interval: float = PROMPT_RELOAD_INTERVAL):
+        self.directory = directory
+        self.default_version = default_version
+        self.reload_interval = reload_interval
+        self._paths: Dict[str, Optional[str]] = {}
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._lock = threading.Lock()
+        self._discover()
+        if default_path:
+            self._paths[default_version] = default_path
+        self._paths.setdefault(default_version, None)
+
+    def _discover(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            log.warning(f"Prompt directory {self.directory} not readable: {e}")
+            return
+        for name in sorted(names):
+            version = version_from_filename(name)
+            if version and version not in self._paths:
+                self._paths[version] = os.path.join(self.directory, name)
+
+    def _load(self, version: str) -> PromptTemplate:
+        path = self._paths.get(version)
+        if path:
+            try:
+                mtime = os.stat(path).st_mtime
+                with open(path, "r", encoding="utf-8") as f:
+                    return PromptTemplate(version, f.read(), path, mtime)
+            except OSError as e:
+                log.warning(f"Prompt file not found at {path}: {e}")
+        return PromptTemplate(version, FALLBACK_PROMPT)
+
+    def get(self, version: Optional[str] = None) -> PromptTemplate:
+        """Compiled template for `version`. Raises KeyError for an unknown version."""
+        version = version or self.default_version
+        with self._lock:
+            if version not in self._paths:
+                self._discover()  # picks up prompt files added since startup
+                if version not in self._paths:
+                    raise KeyError(version)
+            tmpl = self._templates.get(version)
+            if tmpl is None:
+                tmpl = self._templates[version] = self._load(version)
+                return tmpl
+            now = time.monotonic()
+            if tmpl.path and now - tmpl.checked >= self.reload_interval:
+                tmpl.checked = now
+                try:
+                    changed = os.stat(tmpl.path).st_mtime != tmpl.mtime
+                except OSError:
+                    changed = False  # keep serving the last good copy
+                if changed:
+                    log.info(f"Reloading prompt {version} from {tmpl.path}")
+                    tmpl = self._templates[version] = self._load(version)
+            return tmpl
+
+    def versions(self) -> List[str]:
+        with self._lock:
+            return sorted(self._paths)
+
+
+_registries: Dict[tuple, PromptRegistry] = {}
+_registries_lock = threading.Lock()
+
+def get_prompt_registry(default_path: str, default_version: str) -> PromptRegistry:
+    """Shared registry for the directory holding default_path."""
+    key = (os.path.abspath(default_path), default_version)
+    with _registries_lock:
+        if key not in _registries:
+            directory = os.path.dirname(default_path) or "."
+            _registries[key] = PromptRegistry(directory, default_version, default_path)
+        return _registries[key]
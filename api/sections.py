@@ -0,0 +1,111 @@
+# api/sections.py
+"""
+Stable, content-addressed requirement sections for incremental regeneration.
+
+Unlike chunking.split_sections (which packs paragraphs by size), boundaries
+here depend only on nearby content: every heading starts a section, and long
+heading-less runs are cut after paragraphs whose hash falls on a fixed residue.
+Editing one paragraph therefore changes one section's hash and leaves the
+others intact. A revision is diffed against the previous one by hash.
+"""
+import os, zlib, hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from chunking import CHUNK_MAX_CHARS, _paragraphs, _hard_split, is_heading
+
+SECTION_MIN_CHARS = int(os.getenv("SECTION_MIN_CHARS", "1500"))
+SECTION_SPREAD = int(os.getenv("SECTION_SPREAD", "4"))  # ~1 in N paragraphs may end a section
+
+# Test cases that can't be tied to one section; carried across revisions as-is
+DOC_KEY = "_doc"
+
+
+@dataclass
+class Section:
+    index: int
+    start: int
+    end: int
+    text: str
+    key: str = ""
+    heading: str = ""
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+def section_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+def document_checksum(text: str) -> str:
+    return section_hash(text)
+
+
+def stable_sections(text: str, min_chars: int = SECTION_MIN_CHARS, max_chars: int = CHUNK_MAX_CHARS) -> List[Section]:
+    spans = []
+    for s, e in _paragraphs(text):
+        spans.extend(_hard_split(text, s, e, max_chars) if e - s > max_chars else [(s, e)])
+
+    bounds = []
+    cur_start, prev = None, None
+    for s, e in spans:
+        if cur_start is None:
+            cur_start, prev = s, (s, e)
+            continue
+        size = prev[1] - cur_start
+        cut = (
+            is_heading(text[s:e])
+            or e - cur_start > max_chars
+            or (size >= min_chars and zlib.crc32(normalize(text[prev[0]:prev[1]]).encode("utf-8")) % SECTION_SPREAD == 0)
+        )
+        if cut:
+            bounds.append((cur_start, prev[1]))
+            cur_start = s
+        prev = (s, e)
+    if cur_start is not None:
+        bounds.append((cur_start, prev[1]))
+
+    sections, seen = [], {}
+    for i, (s, e) in enumerate(bounds):
+        body = text[s:e]
+        key = section_hash(body)
+        # Identical sections in one document get distinct keys by occurrence
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > 1:
+            key = f"{key}:{seen[key]}"
+        first = body.strip().split("\n", 1)[0]
+        sections.append(Section(i, s, e, body, key, first[:120] if is_heading(first) else ""))
+    return sections
+
+
+def section_at(sections: List[Section], offset: int) -> Optional[Section]:
+    for sec in sections:
+        if sec.start <= offset < sec.end:
+            return sec
+    return None
+
+
+@dataclass
+class RevisionPlan:
+    changed: List[Section] = field(default_factory=list)     # new or edited: send to the model
+    unchanged: List[Section] = field(default_factory=list)   # keep their test cases
+    deleted: Dict[str, List[str]] = field(default_factory=dict)  # old key -> now-obsolete test_ids
+    kept: Dict[str, List[str]] = field(default_factory=dict)     # key -> test_ids carried forward
+
+
+def plan_revision(sections: List[Section], previous: Dict[str, List[str]]) -> RevisionPlan:
+    """Diff the new sections against the previous revision's {key: test_ids}."""
+    plan = RevisionPlan()
+    keys = {sec.key for sec in sections}
+    for sec in sections:
+        if sec.key in previous:
+            plan.unchanged.append(sec)
+            plan.kept[sec.key] = list(previous[sec.key])
+        else:
+            plan.changed.append(sec)
+    for key, test_ids in previous.items():
+        if key == DOC_KEY:
+            plan.kept[key] = list(test_ids)
+        elif key not in keys:
+            plan.deleted[key] = list(test_ids)
+    return plan
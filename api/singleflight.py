@@ -0,0 +1,95 @@
+# api/singleflight.py
+"""
+Coalesce identical in-flight work. The first caller for a key (the leader)
+runs the function; callers that arrive with the same key while it is still
+running (followers) wait for and share the leader's result or exception.
+
+In the async variant the work runs in its own task, owned by no single
+caller: a caller that is cancelled (client disconnect) just stops waiting,
+and the task is cancelled only once every caller waiting on it has gone.
+"""
+import asyncio, threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, list] = {}   # key -> [task, callers waiting]
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Blocking variant for sync handlers. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result, False
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async variant; fn returns an awaitable. Returns (result, shared)."""
+        entry = self._tasks.get(key)
+        shared = entry is not None
+        if shared:
+            self.followers += 1
+        else:
+            entry = self._tasks[key] = [asyncio.ensure_future(fn()), 0]
+            self.leaders += 1
+            entry[0].add_done_callback(lambda t: self._finished(key, entry))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                # Last caller gone: nobody wants the result any more
+                self._discard(key, entry)
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _discard(self, key: str, entry: list):
+        if self._tasks.get(key) is entry:
+            del self._tasks[key]
+
+    def _finished(self, key: str, entry: list):
+        self._discard(key, entry)
+        if not entry[0].cancelled():
+            entry[0].exception()  # mark retrieved in case every caller had already gone
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._calls) + len(self._tasks),
+        }
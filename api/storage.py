@@ -0,0 +1,816 @@
+# api/storage.py
+"""
+Storage for requirements, generated test cases, trace links and requirement
+section state, behind one repository interface.
+
+STORAGE_BACKEND picks the implementation (read on first use):
+  bigquery  the dataset tables (default); writes go through the
+            write-behind BQWriter
+  sqlite    one embedded SQLite file (STORAGE_SQLITE_PATH) with indexes on
+            req_id / project_id / test_id, for single-tenant deployments,
+            offline use and local benchmarks
+
+Rows are plain dicts with the BigQuery column names; list columns (steps,
+compliance_tags, test_ids) are JSON-encoded in SQLite. Writes return row
+errors in the insert_rows_json shape.
+"""
+import os, json, uuid, asyncio, logging, sqlite3, threading
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from bq_writer import BQWriter
+
+log = logging.getLogger("orbit-trace")
+
+DEFAULT_SQLITE_PATH = os.path.join("data", "orbit.sqlite3")
+
+# Record kinds
+REQUIREMENTS = "requirements"
+TESTCASES = "testcases"
+TRACE_LINKS = "trace_links"
+SECTIONS = "sections"
+EDITS = "testcase_edits"
+
+COLUMNS: Dict[str, Sequence[str]] = {
+    REQUIREMENTS: ("req_id", "source_type", "source_uri", "title", "text", "checksum", "created_at", "created_by"),
+    TESTCASES: (
+        "test_id", "req_id", "title", "steps", "expected_result", "preconditions", "severity",
+        "compliance_tags", "trace_link", "source_excerpt", "model_version", "prompt_version",
+        "created_at", "created_by", "project_id",
+    ),
+    TRACE_LINKS: (
+        "req_id", "test_id", "external_system", "external_key", "external_url", "external_id", "link",
+        "created_at", "created_by", "project_id",
+    ),
+    SECTIONS: (
+        "req_id", "revision", "section_key", "section_index", "heading", "start_offset", "end_offset",
+        "test_ids", "status", "created_at",
+    ),
+    EDITS: (
+        "edit_id", "test_id", "edited_fields", "title", "expected_result", "steps", "severity",
+        "edited_at", "edited_by",
+    ),
+}
+JSON_COLUMNS = {"steps", "compliance_tags", "test_ids", "edited_fields"}
+LOOKUP_FIELDS = ("req_id", "project_id", "test_id")
+EDITABLE_FIELDS = ("title", "expected_result", "steps", "severity")
+
+# Project listing: test cases joined with their trace links
+PROJECT_COLUMNS = (
+    "test_id", "req_id", "title", "severity", "expected_result", "steps", "created_at", "project_id",
+    "source_excerpt", "external_system", "external_key", "trace_link", "trace_created_at", "is_pushed",
+    "obsolete",
+)
+# Paged listing: output column -> SQL expression over tc (test cases) / tr (latest trace link) /
+# ob (obsolete test ids)
+PAGE_COLUMN_SQL = {
+    "test_id": "tc.test_id", "req_id": "tc.req_id", "title": "tc.title", "severity": "tc.severity",
+    "expected_result": "tc.expected_result", "steps": "tc.steps", "created_at": "tc.created_at",
+    "project_id": "tc.project_id", "source_excerpt": "tc.source_excerpt",
+    "external_system": "tr.external_system", "external_key": "tr.external_key", "trace_link": "tr.external_url",
+    "trace_created_at": "tr.created_at",
+    "is_pushed": "(tr.external_url IS NOT NULL AND tr.external_url != '')",
+    "obsolete": "(ob.test_id IS NOT NULL)",
+}
+PAGE_KEY_COLUMNS = ("created_at", "test_id")
+PAGE_FETCH_SIZE = int(os.getenv("STORAGE_PAGE_FETCH_SIZE", "500"))
+# Journal entries younger than this stay out of compaction (the MERGE can't touch streaming-buffer rows)
+EDIT_COMPACT_MIN_AGE_S = float(os.getenv("EDIT_COMPACT_MIN_AGE_S", "3600"))
+
+
+def _page_sql(tc_table: str, trl_table: str, obsolete_sql: str, columns: Sequence[str], after: bool,
+              qualify: bool, p: str = "@") -> str:
+    """
+    Keyset page over a project's test cases, newest first, one row per test case
+    joined to its latest trace link and to obsolete_sql (test ids of cases a
+    later revision of their requirement dropped). Joins are skipped when none
+    of their columns is asked for.
+    Parameters (prefixed with p): pid, lim and, when after, after_ts / after_id.
+    """
+    unknown = set(columns) - set(PAGE_COLUMN_SQL)
+    if unknown:
+        raise ValueError(f"Unknown listing columns: {sorted(unknown)}")
+    wanted = list(dict.fromkeys([*PAGE_KEY_COLUMNS, *columns]))
+    select = ", ".join(f"{PAGE_COLUMN_SQL[c]} AS {c}" for c in wanted)
+    join = ""
+    if any(PAGE_COLUMN_SQL[c].startswith(("tr.", "(tr.")) for c in wanted):
+        latest = (
+            "SELECT test_id, external_system, external_key, external_url, created_at, "
+            "ROW_NUMBER() OVER (PARTITION BY test_id ORDER BY created_at DESC) AS rn "
+            f"FROM {trl_table} WHERE project_id = {p}pid"
+        )
+        if qualify:
+            trace = f"SELECT * EXCEPT (rn) FROM ({latest}) WHERE rn = 1"
+        else:
+            trace = f"SELECT * FROM ({latest}) WHERE rn = 1"
+        join = f"LEFT JOIN ({trace}) AS tr ON tc.test_id = tr.test_id"
+    if any(PAGE_COLUMN_SQL[c].startswith("(ob.") for c in wanted):
+        join += f" LEFT JOIN ({obsolete_sql}) AS ob ON tc.test_id = ob.test_id"
+    where = f"tc.project_id = {p}pid"
+    if after:
+        where += f" AND (tc.created_at < {p}after_ts OR (tc.created_at = {p}after_ts AND tc.test_id < {p}after_id))"
+    return (
+        f"SELECT {select} FROM {tc_table} AS tc {join} WHERE {where} "
+        f"ORDER BY tc.created_at DESC, tc.test_id DESC LIMIT {p}lim"
+    )
+
+
+def _sections_scope(by: str, testcases: str, p: str) -> str:
+    """Filter on sections s for one requirement (p + rid) or one project's requirements (p + pid)."""
+    if by == "req_id":
+        return f"s.req_id = {p}rid"
+    if by == "project_id":
+        return f"s.req_id IN (SELECT DISTINCT req_id FROM {testcases} WHERE project_id = {p}pid)"
+    raise ValueError(f"Unknown obsolete scope: {by}")
+
+
+def edit_row(test_id: str, fields: dict, edited_by: Optional[str] = None) -> dict:
+    """One edit journal entry; edited_fields names the fields this edit sets (others are left alone)."""
+    unknown = set(fields) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Field not editable: {sorted(unknown)}")
+    row = {
+        "edit_id": uuid.uuid4().hex,
+        "test_id": test_id,
+        "edited_fields": sorted(fields),
+        "edited_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "edited_by": edited_by,
+    }
+    for k, v in fields.items():
+        if k == "steps":
+            v = [v] if isinstance(v, str) else list(v or [])
+        row[k] = v
+    return row
+
+
+def _completed(value=None, error: Optional[BaseException] = None) -> Future:
+    fut: Future = Future()
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(value)
+    return fut
+
+
+class Storage:
+    """Repository interface; see BigQueryStorage and SQLiteStorage."""
+
+    name = "base"
+
+    # ---- writes ----
+    def submit(self, kind: str, rows: List[dict]) -> Future:
+        """Queue rows of one kind; the future resolves to the row errors."""
+        raise NotImplementedError
+
+    def write(self, kind: str, rows: List[dict]) -> list:
+        """Write rows and wait until they are readable. Returns the row errors."""
+        return self.submit(kind, rows).result()
+
+    async def awrite(self, kind: str, rows: List[dict]) -> list:
+        return await asyncio.to_thread(self.write, kind, rows)
+
+    def update_testcase(self, test_id: str, fields: dict, edited_by: Optional[str] = None):
+        """
+        Edit EDITABLE_FIELDS of one test case. The edit is appended to the
+        EDITS journal; reads see it as soon as this returns.
+        """
+        raise NotImplementedError
+
+    def testcase_history(self, test_id: str) -> List[dict]:
+        """A test case's edit journal (EDITS columns), oldest first."""
+        raise NotImplementedError
+
+    def compact_edits(self) -> int:
+        """Fold journaled edits into the test case rows; returns the number of test cases updated."""
+        return 0
+
+    # ---- reads ----
+    def get_requirement(self, req_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def requirements_without_testcases(self, limit: int) -> List[dict]:
+        raise NotImplementedError
+
+    def testcases_by(self, field: str, value: str, columns: Sequence[str]) -> List[dict]:
+        """Test cases where field (one of LOOKUP_FIELDS) = value, newest first."""
+        raise NotImplementedError
+
+    def recent_testcases(self, limit: int, columns: Sequence[str]) -> List[dict]:
+        raise NotImplementedError
+
+    def project_testcases(self, project_id: str) -> List[dict]:
+        """
+        A project's test cases with their trace link columns and obsolete flag
+        (PROJECT_COLUMNS), newest first.
+        """
+        raise NotImplementedError
+
+    def traceability(self, req_id: str) -> Optional[dict]:
+        """
+        A requirement with its test cases (newest first) and each test case's
+        trace links, as {req_id, title, text, tests: [{test_id, title, severity,
+        created_at, obsolete, trace_links: [{external_system, external_key, external_url}]}]};
+        None if the requirement doesn't exist.
+        """
+        raise NotImplementedError
+
+    def iter_project_testcases(self, project_id: str, columns: Sequence[str],
+                               after: Optional[Tuple[str, str]] = None, limit: int = 100) -> Iterator[dict]:
+        """
+        Up to limit of a project's test cases (PAGE_COLUMN_SQL names, plus
+        created_at / test_id) after the (created_at, test_id) cursor, newest
+        first. Rows are fetched lazily in pages of PAGE_FETCH_SIZE.
+        """
+        raise NotImplementedError
+
+    def latest_sections(self, req_id: str) -> List[dict]:
+        """Active section rows (revision, section_key, test_ids) of a requirement's latest revision."""
+        raise NotImplementedError
+
+    # ---- lifecycle ----
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def metrics(self) -> dict:
+        return {"backend": self.name}
+
+    @staticmethod
+    def _check_fields(field: str, columns: Iterable[str]):
+        if field not in LOOKUP_FIELDS:
+            raise ValueError(f"Unsupported lookup field: {field}")
+        unknown = set(columns) - set(COLUMNS[TESTCASES])
+        if unknown:
+            raise ValueError(f"Unknown test case columns: {sorted(unknown)}")
+
+
+# -------------------- BigQuery --------------------
+class BigQueryStorage(Storage):
+    name = "bigquery"
+
+    def __init__(self, project: str, dataset: str, writer: Optional[BQWriter] = None):
+        self.project = project
+        self.tables = {
+            REQUIREMENTS: f"{project}.{dataset}.requirements",
+            TESTCASES: f"{project}.{dataset}.generated_testcases",
+            TRACE_LINKS: f"{project}.{dataset}.trace_links",
+            SECTIONS: f"{project}.{dataset}.requirement_sections",
+            EDITS: f"{project}.{dataset}.testcase_edits",
+        }
+        # One row per compaction run; edits up to compacted_through are in generated_testcases
+        self.compactions_table = f"{project}.{dataset}.testcase_edit_compactions"
+        self._client = None
+        self._lock = threading.Lock()
+        self._sections_ready = False
+        self._edits_ready = False
+        self.writer = writer or BQWriter(lambda: self.client)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import bigquery
+                self._client = bigquery.Client(project=self.project)
+            return self._client
+
+    def _query(self, sql: str, params: Sequence[tuple] = ()) -> List[dict]:
+        """params: (name, type, value); list values become array parameters."""
+        from google.cloud import bigquery
+        query_params = [
+            bigquery.ArrayQueryParameter(n, t, v) if isinstance(v, list) else bigquery.ScalarQueryParameter(n, t, v)
+            for n, t, v in params
+        ]
+        job = self.client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=query_params))
+        return [dict(row.items()) for row in job.result()]
+
+    def _ensure_sections_table(self):
+        """Create requirement_sections on first use (one row per section per revision)."""
+        if self._sections_ready:
+            return
+        from google.cloud import bigquery
+        schema = [
+            bigquery.SchemaField("req_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("revision", "INT64", mode="REQUIRED"),
+            bigquery.SchemaField("section_key", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("section_index", "INT64"),
+            bigquery.SchemaField("heading", "STRING"),
+            bigquery.SchemaField("start_offset", "INT64"),
+            bigquery.SchemaField("end_offset", "INT64"),
+            bigquery.SchemaField("test_ids", "STRING", mode="REPEATED"),
+            bigquery.SchemaField("status", "STRING"),  # active | obsolete
+            bigquery.SchemaField("created_at", "TIMESTAMP"),
+        ]
+        table = bigquery.Table(self.tables[SECTIONS], schema=schema)
+        table.clustering_fields = ["req_id"]   # every read filters on req_id
+        self.client.create_table(table, exists_ok=True)
+        self._sections_ready = True
+
+    def _obsolete_sql(self, by: str) -> str:
+        """
+        Test ids recorded as obsolete by a section revision (cases whose section
+        was edited away), limited to what is being read: by="req_id" (@rid) or
+        by="project_id" (@pid, via the project's requirements).
+        """
+        self._ensure_sections_table()
+        return (
+            f"SELECT DISTINCT tid AS test_id FROM `{self.tables[SECTIONS]}` AS s, UNNEST(s.test_ids) AS tid "
+            f"WHERE s.status = 'obsolete' AND {_sections_scope(by, f'`{self.tables[TESTCASES]}`', '@')}"
+        )
+
+    def _ensure_edit_tables(self):
+        """Create the edit journal and its compaction log on first use."""
+        if self._edits_ready:
+            return
+        from google.cloud import bigquery
+        edits = [
+            bigquery.SchemaField("edit_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("test_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("edited_fields", "STRING", mode="REPEATED"),
+            bigquery.SchemaField("title", "STRING"),
+            bigquery.SchemaField("expected_result", "STRING"),
+            bigquery.SchemaField("steps", "STRING", mode="REPEATED"),
+            bigquery.SchemaField("severity", "STRING"),
+            bigquery.SchemaField("edited_at", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("edited_by", "STRING"),
+        ]
+        compactions = [
+            bigquery.SchemaField("compacted_through", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("updated_rows", "INT64"),
+            bigquery.SchemaField("created_at", "TIMESTAMP"),
+        ]
+        self.client.create_table(bigquery.Table(self.tables[EDITS], schema=edits), exists_ok=True)
+        self.client.create_table(bigquery.Table(self.compactions_table, schema=compactions), exists_ok=True)
+        self._edits_ready = True
+
+    def _latest_edits_sql(self, until: bool = False) -> str:
+        """
+        Per test case, the newest journaled value of each editable field (a
+        STRUCT<v>, NULL when no pending edit sets it), over the edits not yet
+        compacted (and, when until, made at or before @until).
+        """
+        fields = ",\n".join(
+            f"ARRAY_AGG(IF('{f}' IN UNNEST(edited_fields), STRUCT({f} AS v), NULL) IGNORE NULLS "
+            f"ORDER BY edited_at DESC, edit_id DESC LIMIT 1)[SAFE_OFFSET(0)] AS {f}"
+            for f in EDITABLE_FIELDS
+        )
+        where = (
+            f"edited_at > (SELECT IFNULL(MAX(compacted_through), TIMESTAMP '1970-01-01') "
+            f"FROM `{self.compactions_table}`)"
+        )
+        if until:
+            where += " AND edited_at <= @until"
+        return f"SELECT test_id, {fields} FROM `{self.tables[EDITS]}` WHERE {where} GROUP BY test_id"
+
+    def _testcases(self) -> str:
+        """FROM source for test case reads: generated_testcases with pending edits laid over it."""
+        self._ensure_edit_tables()
+        overrides = ", ".join(f"IF(e.{f} IS NULL, t.{f}, e.{f}.v) AS {f}" for f in EDITABLE_FIELDS)
+        return (
+            f"(SELECT t.* REPLACE ({overrides}) FROM `{self.tables[TESTCASES]}` AS t "
+            f"LEFT JOIN ({self._latest_edits_sql()}) AS e ON t.test_id = e.test_id)"
+        )
+
+    def submit(self, kind: str, rows: List[dict]) -> Future:
+        if kind == SECTIONS:
+            self._ensure_sections_table()
+        return self.writer.submit(self.tables[kind], rows)
+
+    def write(self, kind: str, rows: List[dict]) -> list:
+        if kind == SECTIONS:
+            self._ensure_sections_table()
+        return self.writer.write(self.tables[kind], rows)
+
+    async def awrite(self, kind: str, rows: List[dict]) -> list:
+        if kind == SECTIONS:
+            await asyncio.to_thread(self._ensure_sections_table)
+        return await self.writer.awrite(self.tables[kind], rows)
+
+    def update_testcase(self, test_id: str, fields: dict, edited_by: Optional[str] = None):
+        # A streaming insert into the journal instead of DML on generated_testcases
+        row = edit_row(test_id, fields, edited_by)
+        self._ensure_edit_tables()
+        errors = self.writer.write(self.tables[EDITS], [row])
+        if errors:
+            raise RuntimeError(f"Edit journal insert errors: {errors}")
+
+    def testcase_history(self, test_id: str) -> List[dict]:
+        self._ensure_edit_tables()
+        return self._query(
+            f"SELECT {', '.join(COLUMNS[EDITS])} FROM `{self.tables[EDITS]}` "
+            f"WHERE test_id=@tid ORDER BY edited_at, edit_id",
+            [("tid", "STRING", test_id)],
+        )
+
+    def compact_edits(self) -> int:
+        """
+        MERGE the journal up to EDIT_COMPACT_MIN_AGE_S ago into generated_testcases
+        and record the watermark, so later reads only overlay newer edits.
+        """
+        from google.cloud import bigquery
+        self._ensure_edit_tables()
+        until = datetime.now(timezone.utc) - timedelta(seconds=EDIT_COMPACT_MIN_AGE_S)
+        updates = ", ".join(f"{f} = IF(e.{f} IS NULL, t.{f}, e.{f}.v)" for f in EDITABLE_FIELDS)
+        sql = (
+            f"MERGE `{self.tables[TESTCASES]}` AS t USING ({self._latest_edits_sql(until=True)}) AS e "
+            f"ON t.test_id = e.test_id WHEN MATCHED THEN UPDATE SET {updates}"
+        )
+        job = self.client.query(sql, job_config=bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("until", "TIMESTAMP", until)]
+        ))
+        job.result()
+        updated = job.num_dml_affected_rows or 0
+        errors = self.writer.write(self.compactions_table, [{
+            "compacted_through": until.isoformat(),
+            "updated_rows": updated,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }])
+        if errors:
+            raise RuntimeError(f"Compaction watermark insert errors: {errors}")
+        return updated
+
+    def get_requirement(self, req_id: str) -> Optional[dict]:
+        rows = self._query(
+            f"SELECT req_id, title, text FROM `{self.tables[REQUIREMENTS]}` WHERE req_id=@rid LIMIT 1",
+            [("rid", "STRING", req_id)],
+        )
+        return rows[0] if rows else None
+
+    def requirements_without_testcases(self, limit: int) -> List[dict]:
+        return self._query(
+            f"""
+            SELECT r.req_id, r.title, r.text
+            FROM `{self.tables[REQUIREMENTS]}` r
+            LEFT JOIN `{self.tables[TESTCASES]}` g ON r.req_id = g.req_id
+            WHERE g.req_id IS NULL
+            ORDER BY r.req_id
+            LIMIT @lim
+            """,
+            [("lim", "INT64", limit)],
+        )
+
+    def testcases_by(self, field: str, value: str, columns: Sequence[str]) -> List[dict]:
+        self._check_fields(field, columns)
+        return self._query(
+            f"SELECT {', '.join(columns)} FROM {self._testcases()} WHERE {field}=@v ORDER BY created_at DESC",
+            [("v", "STRING", value)],
+        )
+
+    def recent_testcases(self, limit: int, columns: Sequence[str]) -> List[dict]:
+        self._check_fields("test_id", columns)
+        return self._query(
+            f"SELECT {', '.join(columns)} FROM {self._testcases()} ORDER BY created_at DESC LIMIT @lim",
+            [("lim", "INT64", limit)],
+        )
+
+    def project_testcases(self, project_id: str) -> List[dict]:
+        return self._query(
+            f"""
+            SELECT
+                tc.test_id, tc.req_id, tc.title, tc.severity, tc.expected_result, tc.steps,
+                tc.created_at, tc.project_id, tc.source_excerpt,
+                tr.external_system, tr.external_key, tr.external_url AS trace_link,
+                tr.created_at AS trace_created_at,
+                CASE
+                    WHEN tr.external_url IS NOT NULL AND tr.external_url != '' THEN TRUE
+                    ELSE FALSE
+                END AS is_pushed,
+                ob.test_id IS NOT NULL AS obsolete
+            FROM {self._testcases()} AS tc
+            LEFT JOIN `{self.tables[TRACE_LINKS]}` AS tr
+            ON tc.project_id = tr.project_id AND tc.test_id = tr.test_id
+            LEFT JOIN ({self._obsolete_sql("project_id")}) AS ob ON tc.test_id = ob.test_id
+            WHERE tc.project_id = @pid
+            ORDER BY tc.created_at DESC
+            """,
+            [("pid", "STRING", project_id)],
+        )
+
+    def traceability(self, req_id: str) -> Optional[dict]:
+        # One job: requirement, its test cases and their trace links as nested arrays
+        rows = self._query(
+            f"""
+            SELECT
+                r.req_id, r.title, r.text,
+                ARRAY(
+                    SELECT AS STRUCT
+                        tc.test_id, tc.title, tc.severity, tc.created_at,
+                        tc.test_id IN ({self._obsolete_sql("req_id")}) AS obsolete,
+                        ARRAY(
+                            SELECT AS STRUCT tr.external_system, tr.external_key, tr.external_url
+                            FROM `{self.tables[TRACE_LINKS]}` AS tr
+                            WHERE tr.test_id = tc.test_id
+                            ORDER BY tr.created_at DESC
+                        ) AS trace_links
+                    FROM {self._testcases()} AS tc
+                    WHERE tc.req_id = r.req_id
+                    ORDER BY tc.created_at DESC
+                ) AS tests
+            FROM `{self.tables[REQUIREMENTS]}` AS r
+            WHERE r.req_id = @rid
+            LIMIT 1
+            """,
+            [("rid", "STRING", req_id)],
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        row["tests"] = [dict(t) for t in row.get("tests") or []]
+        for t in row["tests"]:
+            t["trace_links"] = [dict(link) for link in t.get("trace_links") or []]
+        return row
+
+    def iter_project_testcases(self, project_id: str, columns: Sequence[str],
+                               after: Optional[Tuple[str, str]] = None, limit: int = 100) -> Iterator[dict]:
+        from google.cloud import bigquery
+        sql = _page_sql(
+            self._testcases(), f"`{self.tables[TRACE_LINKS]}`", self._obsolete_sql("project_id"), columns,
+            bool(after), True,
+        )
+        params = [
+            bigquery.ScalarQueryParameter("pid", "STRING", project_id),
+            bigquery.ScalarQueryParameter("lim", "INT64", limit),
+        ]
+        if after:
+            ts = datetime.fromisoformat(after[0].replace("Z", "+00:00"))
+            params += [
+                bigquery.ScalarQueryParameter("after_ts", "TIMESTAMP", ts),
+                bigquery.ScalarQueryParameter("after_id", "STRING", after[1]),
+            ]
+        job = self.client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
+        # The row iterator pulls one page at a time from the job's result
+        for row in job.result(page_size=min(limit, PAGE_FETCH_SIZE)):
+            yield dict(row.items())
+
+    def latest_sections(self, req_id: str) -> List[dict]:
+        self._ensure_sections_table()
+        table = self.tables[SECTIONS]
+        return self._query(
+            f"""
+            SELECT revision, section_key, test_ids
+            FROM `{table}`
+            WHERE req_id=@rid AND status='active'
+              AND revision = (SELECT MAX(revision) FROM `{table}` WHERE req_id=@rid)
+            """,
+            [("rid", "STRING", req_id)],
+        )
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def metrics(self) -> dict:
+        return {"backend": self.name, "bq_writer": self.writer.metrics()}
+
+
+# -------------------- SQLite --------------------
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requirements (
+    req_id TEXT PRIMARY KEY, source_type TEXT, source_uri TEXT, title TEXT, text TEXT,
+    checksum TEXT, created_at TEXT, created_by TEXT
+);
+CREATE TABLE IF NOT EXISTS testcases (
+    test_id TEXT NOT NULL, req_id TEXT, title TEXT, steps TEXT, expected_result TEXT, preconditions TEXT,
+    severity TEXT, compliance_tags TEXT, trace_link TEXT, source_excerpt TEXT, model_version TEXT,
+    prompt_version TEXT, created_at TEXT, created_by TEXT, project_id TEXT
+);
+CREATE INDEX IF NOT EXISTS testcases_test_id ON testcases (test_id);
+CREATE INDEX IF NOT EXISTS testcases_req_id ON testcases (req_id, created_at);
+CREATE INDEX IF NOT EXISTS testcases_project_id ON testcases (project_id, created_at);
+CREATE TABLE IF NOT EXISTS trace_links (
+    req_id TEXT, test_id TEXT, external_system TEXT, external_key TEXT, external_url TEXT,
+    external_id TEXT, link TEXT, created_at TEXT, created_by TEXT, project_id TEXT
+);
+CREATE INDEX IF NOT EXISTS trace_links_test_id ON trace_links (test_id, project_id);
+CREATE INDEX IF NOT EXISTS trace_links_req_id ON trace_links (req_id);
+CREATE TABLE IF NOT EXISTS sections (
+    req_id TEXT NOT NULL, revision INTEGER NOT NULL, section_key TEXT NOT NULL, section_index INTEGER,
+    heading TEXT, start_offset INTEGER, end_offset INTEGER, test_ids TEXT, status TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sections_req_id ON sections (req_id, revision);
+CREATE TABLE IF NOT EXISTS testcase_edits (
+    edit_id TEXT PRIMARY KEY, test_id TEXT NOT NULL, edited_fields TEXT, title TEXT, expected_result TEXT,
+    steps TEXT, severity TEXT, edited_at TEXT, edited_by TEXT
+);
+CREATE INDEX IF NOT EXISTS testcase_edits_test_id ON testcase_edits (test_id, edited_at);
+"""
+
+
+def _sqlite_obsolete(by: str) -> str:
+    """SQLite form of BigQueryStorage._obsolete_sql (named parameters :rid / :pid)."""
+    return (
+        "SELECT DISTINCT j.value AS test_id FROM sections AS s, json_each(s.test_ids) AS j "
+        f"WHERE s.status = 'obsolete' AND {_sections_scope(by, 'testcases', ':')}"
+    )
+
+
+def _encode(column: str, value):
+    if column in JSON_COLUMNS:
+        return json.dumps(value if value is not None else [])
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _decode(row: sqlite3.Row) -> dict:
+    out = dict(row)
+    for k in JSON_COLUMNS & out.keys():
+        out[k] = json.loads(out[k]) if out[k] else []
+    for flag in ("is_pushed", "obsolete"):
+        if flag in out:
+            out[flag] = bool(out[flag])
+    return out
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._conn.commit()
+        self.stats = {"rows_written": 0, "row_errors": 0}
+
+    def _select(self, sql: str, params: Sequence = ()) -> List[dict]:
+        with self._lock:
+            return [_decode(r) for r in self._conn.execute(sql, params).fetchall()]
+
+    def _insert(self, kind: str, rows: List[dict]) -> list:
+        columns = COLUMNS[kind]
+        errors, values = [], []
+        for i, row in enumerate(rows):
+            unknown = set(row) - set(columns)
+            if unknown:
+                # Same contract as a BigQuery streaming insert: unknown fields reject the row
+                errors.append({"index": i, "errors": [{"reason": "invalid", "message": f"no such field: {sorted(unknown)}"}]})
+                continue
+            values.append(tuple(_encode(c, row.get(c)) for c in columns))
+        verb = "INSERT OR REPLACE" if kind == REQUIREMENTS else "INSERT"
+        sql = f"{verb} INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        with self._lock:
+            self._conn.executemany(sql, values)
+            self._conn.commit()
+        self.stats["rows_written"] += len(values)
+        self.stats["row_errors"] += len(errors)
+        return errors
+
+    def submit(self, kind: str, rows: List[dict]) -> Future:
+        try:
+            return _completed(self._insert(kind, rows) if rows else [])
+        except Exception as e:
+            return _completed(error=e)
+
+    def update_testcase(self, test_id: str, fields: dict, edited_by: Optional[str] = None):
+        # Local writes don't contend, so the journal entry and the row update share one transaction
+        row = edit_row(test_id, fields, edited_by)
+        columns = COLUMNS[EDITS]
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO {EDITS} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                [_encode(c, row.get(c)) for c in columns],
+            )
+            self._conn.execute(
+                f"UPDATE testcases SET {assignments} WHERE test_id = ?",
+                [*(_encode(k, row[k]) for k in fields), test_id],
+            )
+            self._conn.commit()
+
+    def testcase_history(self, test_id: str) -> List[dict]:
+        return self._select(
+            f"SELECT {', '.join(COLUMNS[EDITS])} FROM {EDITS} WHERE test_id=? ORDER BY edited_at, rowid", (test_id,)
+        )
+
+    def get_requirement(self, req_id: str) -> Optional[dict]:
+        rows = self._select("SELECT req_id, title, text FROM requirements WHERE req_id=? LIMIT 1", (req_id,))
+        return rows[0] if rows else None
+
+    def requirements_without_testcases(self, limit: int) -> List[dict]:
+        return self._select(
+            """
+            SELECT r.req_id, r.title, r.text FROM requirements r
+            WHERE NOT EXISTS (SELECT 1 FROM testcases g WHERE g.req_id = r.req_id)
+            ORDER BY r.req_id LIMIT ?
+            """,
+            (limit,),
+        )
+
+    def testcases_by(self, field: str, value: str, columns: Sequence[str]) -> List[dict]:
+        self._check_fields(field, columns)
+        return self._select(
+            f"SELECT {', '.join(columns)} FROM testcases WHERE {field}=? ORDER BY created_at DESC", (value,)
+        )
+
+    def recent_testcases(self, limit: int, columns: Sequence[str]) -> List[dict]:
+        self._check_fields("test_id", columns)
+        return self._select(f"SELECT {', '.join(columns)} FROM testcases ORDER BY created_at DESC LIMIT ?", (limit,))
+
+    def project_testcases(self, project_id: str) -> List[dict]:
+        return self._select(
+            f"""
+            SELECT
+                tc.test_id, tc.req_id, tc.title, tc.severity, tc.expected_result, tc.steps,
+                tc.created_at, tc.project_id, tc.source_excerpt,
+                tr.external_system, tr.external_key, tr.external_url AS trace_link,
+                tr.created_at AS trace_created_at,
+                (tr.external_url IS NOT NULL AND tr.external_url != '') AS is_pushed,
+                (ob.test_id IS NOT NULL) AS obsolete
+            FROM testcases AS tc
+            LEFT JOIN trace_links AS tr
+            ON tc.project_id = tr.project_id AND tc.test_id = tr.test_id
+            LEFT JOIN ({_sqlite_obsolete("project_id")}) AS ob ON tc.test_id = ob.test_id
+            WHERE tc.project_id = :pid
+            ORDER BY tc.created_at DESC
+            """,
+            {"pid": project_id},
+        )
+
+    def traceability(self, req_id: str) -> Optional[dict]:
+        with self._lock:
+            req = self._conn.execute("SELECT req_id, title, text FROM requirements WHERE req_id=?", (req_id,)).fetchone()
+            if req is None:
+                return None
+            tests = self._conn.execute(
+                f"SELECT test_id, title, severity, created_at, test_id IN ({_sqlite_obsolete('req_id')}) AS obsolete "
+                "FROM testcases WHERE req_id=:rid ORDER BY created_at DESC",
+                {"rid": req_id},
+            ).fetchall()
+            links = self._conn.execute(
+                """
+                SELECT tr.test_id, tr.external_system, tr.external_key, tr.external_url FROM trace_links tr
+                WHERE tr.test_id IN (SELECT test_id FROM testcases WHERE req_id=?)
+                ORDER BY tr.created_at DESC
+                """,
+                (req_id,),
+            ).fetchall()
+        by_test: Dict[str, List[dict]] = {}
+        for link in links:
+            link = dict(link)
+            by_test.setdefault(link.pop("test_id"), []).append(link)
+        out = dict(req)
+        out["tests"] = [{**dict(t), "trace_links": by_test.get(t["test_id"], [])} for t in tests]
+        return out
+
+    def iter_project_testcases(self, project_id: str, columns: Sequence[str],
+                               after: Optional[Tuple[str, str]] = None, limit: int = 100) -> Iterator[dict]:
+        sql = _page_sql("testcases", "trace_links", _sqlite_obsolete("project_id"), columns, bool(after), False, p=":")
+        params = {"pid": project_id, "lim": limit}
+        if after:
+            params.update(after_ts=after[0], after_id=after[1])
+        # Own connection so the cursor can stay open between fetches without holding the write lock
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(PAGE_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _decode(row)
+        finally:
+            conn.close()
+
+    def latest_sections(self, req_id: str) -> List[dict]:
+        return self._select(
+            """
+            SELECT revision, section_key, test_ids FROM sections
+            WHERE req_id=? AND status='active'
+              AND revision = (SELECT MAX(revision) FROM sections WHERE req_id=?)
+            """,
+            (req_id, req_id),
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+
+    def metrics(self) -> dict:
+        return {"backend": self.name, "path": self.path, **self.stats}
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+def get_storage() -> Storage:
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            # Read on first use rather than at import, so values from .env apply
+            backend = os.getenv("STORAGE_BACKEND", "bigquery").strip().lower()
+            if backend == "sqlite":
+                _storage = SQLiteStorage(os.getenv("STORAGE_SQLITE_PATH", DEFAULT_SQLITE_PATH))
+            elif backend == "bigquery":
+                _storage = BigQueryStorage(os.getenv("PROJECT_ID", "orbit-ai-472708"), os.getenv("DATASET", "orbit_ai_poc"))
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected bigquery or sqlite)")
+            log.debug(f"storage backend: {_storage.name}")
+        return _storage
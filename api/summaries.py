@@ -0,0 +1,205 @@
+# api/summaries.py
+"""
+Per-project test case summaries for the dashboard: totals by severity,
+pushed / unpushed and per-requirement counts.
+
+A project's aggregates are seeded once from a narrow listing query (req_id,
+severity, is_pushed per test case) and then kept current by the write paths:
+record_testcases() on inserts, record_push() on trace links, record_edit() on
+edits. Reading a summary is then a dictionary copy, not a join over the
+project. Writes made by other instances show up after PROJECT_SUMMARY_TTL,
+when the project is seeded again; rebuild() drops and re-seeds on demand.
+"""
+import os, time, logging, threading
+from datetime import datetime, timezone
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+log = logging.getLogger("orbit-trace")
+
+PROJECT_SUMMARY_ENABLED = os.getenv("PROJECT_SUMMARY_ENABLED", "1") not in ("0", "false", "False", "")
+PROJECT_SUMMARY_TTL = int(os.getenv("PROJECT_SUMMARY_TTL", "300"))
+PROJECT_SUMMARY_MAX_PROJECTS = int(os.getenv("PROJECT_SUMMARY_MAX_PROJECTS", "256"))
+PROJECT_SUMMARY_SEED_LIMIT = int(os.getenv("PROJECT_SUMMARY_SEED_LIMIT", "1000000"))
+
+SUMMARY_COLUMNS = ("req_id", "severity", "is_pushed")
+UNSPECIFIED = "Unspecified"
+
+
+class _Project:
+    """Aggregates for one project plus the per-test state needed to apply changes exactly."""
+
+    def __init__(self):
+        self.tests: Dict[str, list] = {}          # test_id -> [req_id, severity, pushed]
+        self.by_severity: Counter = Counter()
+        self.by_req: Dict[str, List[int]] = {}     # req_id -> [total, pushed]
+        self.pushed = 0
+        self.loaded_at = time.time()
+
+    def _count(self, state: list, sign: int):
+        req_id, severity, pushed = state
+        self.by_severity[severity] += sign
+        if not self.by_severity[severity]:
+            del self.by_severity[severity]
+        counts = self.by_req.setdefault(req_id, [0, 0])
+        counts[0] += sign
+        if pushed:
+            counts[1] += sign
+            self.pushed += sign
+        if not counts[0]:
+            del self.by_req[req_id]
+
+    def put(self, test_id: str, req_id: Optional[str], severity: Optional[str], pushed: bool):
+        old = self.tests.get(test_id)
+        if old is not None:
+            self._count(old, -1)
+            pushed = pushed or old[2]
+        state = [req_id or "", severity or UNSPECIFIED, pushed]
+        self.tests[test_id] = state
+        self._count(state, 1)
+
+    def set_pushed(self, test_id: str):
+        state = self.tests.get(test_id)
+        if state is not None and not state[2]:
+            self.put(test_id, state[0], state[1], True)
+
+    def set_severity(self, test_id: str, severity: Optional[str]):
+        state = self.tests.get(test_id)
+        if state is not None:
+            self._count(state, -1)
+            state[1] = severity or UNSPECIFIED
+            self._count(state, 1)
+
+    def snapshot(self, project_id: str) -> dict:
+        total = len(self.tests)
+        return {
+            "project_id": project_id,
+            "total": total,
+            "pushed": self.pushed,
+            "unpushed": total - self.pushed,
+            "by_severity": dict(sorted(self.by_severity.items())),
+            "by_requirement": [
+                {"req_id": rid, "total": t, "pushed": p, "unpushed": t - p}
+                for rid, (t, p) in sorted(self.by_req.items())
+            ],
+            "seeded_at": datetime.fromtimestamp(self.loaded_at, timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+
+
+class ProjectSummaries:
+    """
+    loader(project_id) yields {test_id, req_id, severity, is_pushed} rows.
+    Changes recorded while a project is being seeded are replayed onto the
+    seeded aggregates (they are idempotent per test_id).
+    """
+
+    def __init__(self, loader: Callable[[str], Iterable[dict]], max_projects: int = PROJECT_SUMMARY_MAX_PROJECTS,
+                 ttl: int = PROJECT_SUMMARY_TTL):
+        self.loader = loader
+        self.max_projects = max_projects
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._projects: "OrderedDict[str, _Project]" = OrderedDict()
+        self._loading: Dict[str, int] = {}
+        self._pending: Dict[str, List[Callable[[_Project], None]]] = {}
+        self._stats = {"hits": 0, "seeds": 0, "updates": 0}
+
+    def get(self, project_id: str) -> dict:
+        with self._lock:
+            p = self._projects.get(project_id)
+            if p is not None and (not self.ttl or time.time() - p.loaded_at < self.ttl):
+                self._projects.move_to_end(project_id)
+                self._stats["hits"] += 1
+                return p.snapshot(project_id)
+            self._loading[project_id] = self._loading.get(project_id, 0) + 1
+            self._pending.setdefault(project_id, [])
+        try:
+            p = _Project()
+            for row in self.loader(project_id):
+                p.put(row["test_id"], row.get("req_id"), row.get("severity"), bool(row.get("is_pushed")))
+        except BaseException:
+            with self._lock:
+                self._done_loading(project_id)
+            raise
+        with self._lock:
+            for op in self._pending.get(project_id, []):
+                op(p)
+            self._done_loading(project_id)
+            self._projects[project_id] = p
+            self._projects.move_to_end(project_id)
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+            self._stats["seeds"] += 1
+            return p.snapshot(project_id)
+
+    def _done_loading(self, project_id: str):
+        self._loading[project_id] -= 1
+        if not self._loading[project_id]:
+            del self._loading[project_id]
+            self._pending.pop(project_id, None)
+
+    def _apply(self, project_id: Optional[str], op: Callable[[_Project], None]):
+        """Apply op to a loaded project and queue it for loads in progress. Called with the lock held."""
+        if project_id in self._projects:
+            op(self._projects[project_id])
+            self._stats["updates"] += 1
+        if project_id in self._pending:
+            self._pending[project_id].append(op)
+
+    def record_testcases(self, rows: Iterable[dict]):
+        with self._lock:
+            for r in rows:
+                if r.get("project_id") and r.get("test_id"):
+                    self._apply(
+                        r["project_id"], lambda p, r=r: p.put(r["test_id"], r.get("req_id"), r.get("severity"), False)
+                    )
+
+    def record_push(self, project_id: Optional[str], test_id: str):
+        with self._lock:
+            self._apply(project_id, lambda p: p.set_pushed(test_id))
+
+    def record_edit(self, test_id: str, fields: dict, project_id: Optional[str] = None):
+        if "severity" not in fields:
+            return
+        severity = fields["severity"]
+        with self._lock:
+            # Edits may not name their project; every cached project that holds the test gets it
+            scopes = [project_id] if project_id else list({*self._projects, *self._pending})
+            for pid in scopes:
+                self._apply(pid, lambda p: p.set_severity(test_id, severity))
+
+    def rebuild(self, project_id: Optional[str] = None) -> Optional[dict]:
+        """Drop one project's aggregates (re-seeded now) or all of them (re-seeded on next read)."""
+        with self._lock:
+            if project_id is None:
+                self._projects.clear()
+            else:
+                self._projects.pop(project_id, None)
+        return self.get(project_id) if project_id is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["projects"] = len(self._projects)
+            s["tests"] = sum(len(p.tests) for p in self._projects.values())
+        return s
+
+
+def load_summary_rows(project_id: str) -> Iterable[dict]:
+    """Seed rows for a project from the storage listing, projected to SUMMARY_COLUMNS."""
+    from storage import get_storage
+    return get_storage().iter_project_testcases(project_id, SUMMARY_COLUMNS, limit=PROJECT_SUMMARY_SEED_LIMIT)
+
+
+_summaries: Optional[ProjectSummaries] = None
+_summaries_lock = threading.Lock()
+
+def get_project_summaries() -> Optional[ProjectSummaries]:
+    """Process-wide project summaries, or None when disabled via PROJECT_SUMMARY_ENABLED=0."""
+    global _summaries
+    if not PROJECT_SUMMARY_ENABLED:
+        return None
+    with _summaries_lock:
+        if _summaries is None:
+            _summaries = ProjectSummaries(load_summary_rows)
+        return _summaries
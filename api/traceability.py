@@ -1,49 +1,57 @@
 # api/traceability.py
 from fastapi import APIRouter, HTTPException
-from google.cloud import bigquery
+from fastapi.encoders import jsonable_encoder
 from datetime import datetime, timezone
-import os
 
-PROJECT_ID = os.getenv("PROJECT_ID", "orbit-ai-472708")
-DATASET = os.getenv("DATASET", "orbit_ai_poc")
-TABLE_REQ = f"{PROJECT_ID}.{DATASET}.requirements"
-TABLE_TC  = f"{PROJECT_ID}.{DATASET}.generated_testcases"
+from cache import get_traceability_cache
+from storage import get_storage
 
 router = APIRouter(prefix="/api/traceability", tags=["traceability"])
 
-bq = bigquery.Client(project=PROJECT_ID)
-
 def now():
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
+def load_traceability(req_id: str) -> dict:
+    """Requirement + test cases + trace links in one storage round trip; {} if the requirement doesn't exist."""
+    record = get_storage().traceability(req_id)
+    if not record:
+        return {}
+    return jsonable_encoder({
+        "req_id": req_id,
+        "title": record["title"],
+        "text": record["text"],
+        "related_tests": [
+            {
+                "id": t["test_id"],
+                "title": t["title"],
+                "severity": t["severity"],
+                "obsolete": bool(t.get("obsolete")),
+                "trace_links": [
+                    {"system": link["external_system"], "key": link["external_key"], "url": link["external_url"]}
+                    for link in t["trace_links"]
+                ],
+            }
+            for t in record["tests"]
+        ],
+    })
+
 @router.get("/{req_id}")
-def get_traceability(req_id: str):
-    # --- fetch requirement text/title ---
-    q1 = f"SELECT title, text FROM `{TABLE_REQ}` WHERE req_id=@rid LIMIT 1"
-    job1 = bq.query(
-        q1,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ScalarQueryParameter("rid", "STRING", req_id)]
-        ),
-    )
-    row = next(iter(job1.result()), None)
-    if not row:
+def get_traceability(req_id: str, trim: bool = False):
+    """
+    Requirement, related tests and their trace links. Cached per req_id until a
+    write touches the requirement or one of its tests; trim=true leaves out the
+    requirement text.
+    """
+    cache = get_traceability_cache()
+    if cache is None:
+        view = load_traceability(req_id)
+    else:
+        _, view, _ = cache.load(
+            req_id, lambda: load_traceability(req_id),
+            members=lambda v: (t["id"] for t in v.get("related_tests", [])),
+        )
+    if not view:
+        # Not-found results stay cached too; upsert_requirement invalidates the req_id
         raise HTTPException(404, f"Requirement {req_id} not found")
-
-    # --- fetch related testcases ---
-    q2 = f"SELECT test_id, title, severity FROM `{TABLE_TC}` WHERE req_id=@rid ORDER BY created_at DESC"
-    job2 = bq.query(
-        q2,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ScalarQueryParameter("rid", "STRING", req_id)]
-        ),
-    )
-    tests = [{"id": r["test_id"], "title": r["title"], "severity": r["severity"]} for r in job2.result()]
-
-    return {
-        "req_id": req_id,
-        "title": row["title"],
-        "text": row["text"],
-        "related_tests": tests,
-        "fetched_at": now(),
-    }
+    # Stamped per response, not stored with the cached view
+    return {**{k: v for k, v in view.items() if not (trim and k == "text")}, "fetched_at": now()}
@@ -0,0 +1,144 @@
+# api/uploads.py
+"""
+Memory-bounded upload handling.
+
+Uploaded files are copied chunk by chunk from the multipart spool into named
+temp files (hashing as they go) instead of being read into memory, so parsers
+can memory-map them and worker processes can open them by path. Per-file
+(UPLOAD_MAX_FILE_BYTES) and per-request (UPLOAD_MAX_REQUEST_BYTES) ceilings
+answer 413; the per-request one is enforced on the raw body by
+UploadLimitMiddleware before multipart parsing even starts. Temp files are
+removed when the request finishes, fails or is cancelled.
+"""
+import os, asyncio, hashlib, logging, tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import HTTPException, UploadFile
+
+log = logging.getLogger("orbit-trace")
+
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", os.getenv("EXTRACT_MAX_BYTES", str(50 * 1024 * 1024))))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None  # None = system temp dir
+
+
+@dataclass
+class SpooledUpload:
+    filename: str
+    path: str
+    size: int
+    sha256: str
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _write_chunk(f, chunk: bytes):
+    f.write(chunk)
+
+async def spool_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_FILE_BYTES,
+                       budget: Optional[list] = None) -> SpooledUpload:
+    """
+    Copy an upload to a temp file in UPLOAD_CHUNK_BYTES pieces. budget is a
+    one-element list of bytes still allowed for the whole request.
+    """
+    name = os.path.basename(file.filename or "upload")
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix="-" + name, dir=UPLOAD_TMP_DIR)
+    digest, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(413, f"{name} exceeds the {max_bytes}-byte per-file limit")
+                if budget is not None:
+                    budget[0] -= len(chunk)
+                    if budget[0] < 0:
+                        raise HTTPException(413, "Upload exceeds the per-request size limit")
+                digest.update(chunk)
+                await asyncio.to_thread(_write_chunk, f, chunk)
+    except BaseException:
+        _unlink(path)  # includes CancelledError when the client goes away
+        raise
+    return SpooledUpload(file.filename or name, path, size, digest.hexdigest())
+
+
+@asynccontextmanager
+async def spooled_uploads(files: Optional[List[UploadFile]], max_file_bytes: int = UPLOAD_MAX_FILE_BYTES,
+                          max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+    """Spool every file (one at a time, so only one chunk is in memory); temp files are removed on exit."""
+    spooled: List[SpooledUpload] = []
+    budget = [max_request_bytes]
+    try:
+        for file in files or []:
+            spooled.append(await spool_upload(file, max_file_bytes, budget))
+        yield spooled
+    finally:
+        for up in spooled:
+            _unlink(up.path)
+
+
+class UploadLimitMiddleware:
+    """
+    Pure ASGI middleware rejecting multipart bodies over max_bytes with 413,
+    either up front from Content-Length or as soon as the streamed body
+    crosses the limit (chunked uploads), before it is spooled anywhere.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body exceeds the upload size limit"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        declared = headers.get(b"content-length")
+        if declared and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(send)
+
+        received, exceeded = 0, False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Stop reading; the app sees a disconnect and its error response is replaced below
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            log.warning(f"Rejected upload to {scope.get('path')}: body over {self.max_bytes} bytes")
+            await self._reject(send)
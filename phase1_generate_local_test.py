@@ -1,6 +1,6 @@
 import json
 import csv
-from phase1_generate_with_gemini import process_requirement, validate_and_normalize_payload, load_prompt_template
+from phase1_generate_with_gemini import process_requirement, validate_and_normalize_payload, load_prompt_template, fill_prompt
 
 # Local mock data source
 CSV_PATH = "data/requirements.csv"
@@ -28,7 +28,7 @@ def main():
     for r in reqs[-3:]:  # only last 3 for test
         print(f"Generating locally for {r['req_id']} — {r['title']}")
         try:
-            prompt = tmpl.replace("{{req_id}}", r["req_id"]).replace("{{requirement_text}}", r["text"])
+            prompt = fill_prompt(tmpl, r["req_id"], r["text"])
             # Instead of calling Gemini, simulate an output
             dummy_out = {
                 "req_id": r["req_id"],
@@ -3,13 +3,24 @@ import json
 import os
 import re
 import sys
+import time
 import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 
-from google.cloud import bigquery
 import vertexai
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 
+# Shared helpers live next to the API
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+from cache import get_llm_cache, llm_cache_key
+from model_scheduler import get_scheduler, estimate_tokens, PRIORITY_BATCH
+from model_router import get_router, gen_config
+from prompt_registry import get_prompt_registry
+from json_stream import parse_test_cases
+from storage import get_storage, TESTCASES
+
 # --------- Config helpers ----------
 def getenv(key, default=None, required=False):
     val = os.environ.get(key, default)
@@ -31,11 +42,6 @@ MODEL_NAME = getenv("MODEL_NAME", "gemini-2.0-flash-001")
 PROMPT_PATH = getenv("PROMPT_PATH", "prompts/prompt_poc_v1.txt")
 PROMPT_VERSION = getenv("PROMPT_VERSION", "poc-v1")
 CREATED_BY = getenv("CREATED_BY", "demo@orbit-ai")
-DATASET = getenv("DATASET", "orbit_ai_poc")
-
-TABLE_REQ = f"{PROJECT_ID}.{DATASET}.requirements"
-TABLE_TC = f"{PROJECT_ID}.{DATASET}.generated_testcases"
-TABLE_TR = f"{PROJECT_ID}.{DATASET}.trace_links"
 
 SEVERITY_ALLOWED = {"Critical", "High", "Medium", "Low"}
 
@@ -46,27 +52,15 @@ def now_ts():
 def make_test_id():
     return "TEST-" + uuid.uuid4().hex[:8].upper()
 
-def load_prompt_template():
-    with open(PROMPT_PATH, "r", encoding="utf-8") as f:
-        return f.read()
-
-def fill_prompt(tmpl: str, req_id: str, text: str) -> str:
-    return tmpl.replace("{{req_id}}", req_id).replace("{{requirement_text}}", text)
+def load_prompt_template(version: str = None):
+    """Compiled template from the shared prompt registry (PROMPT_VERSION by default)."""
+    return get_prompt_registry(PROMPT_PATH, PROMPT_VERSION).get(version)
 
-def extract_json(text: str) -> str:
-    """
-    Try to extract a JSON object from model output (handles accidental text around it).
-    """
-    # Remove code fences if present
-    text = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE)
-    # Find first { ... } block
-    m = re.search(r"\{.*\}", text, flags=re.DOTALL)
-    if m:
-        return m.group(0)
-    return text  # hope it's already clean JSON
+def fill_prompt(tmpl, req_id: str, text: str) -> str:
+    return tmpl.render(req_id=req_id, requirement_text=text)
 
-def validate_and_normalize_payload(req_id: str, raw_json: str):
-    data = json.loads(raw_json)
+def validate_and_normalize_payload(req_id: str, raw_json):
+    data = json.loads(raw_json) if isinstance(raw_json, str) else dict(raw_json)
 
     # Minimal schema checks
     if "req_id" not in data:
@@ -120,77 +114,115 @@ def validate_and_normalize_payload(req_id: str, raw_json: str):
         })
     return rows
 
-# --------- BigQuery ----------
-bq_client = bigquery.Client(project=PROJECT_ID)
-
+# --------- Storage (BigQuery or SQLite, per STORAGE_BACKEND) ----------
 def fetch_requirements(limit: int = 3, req_id: str = None):
+    storage = get_storage()
     if req_id:
-        query = f"""
-        SELECT req_id, title, text
-        FROM `{TABLE_REQ}`
-        WHERE req_id = @req_id
-        """
-        job = bq_client.query(query, job_config=bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ScalarQueryParameter("req_id", "STRING", req_id)]
-        ))
-    else:
-        # fetch those without any testcases yet (left anti join)
-        query = f"""
-        SELECT r.req_id, r.title, r.text
-        FROM `{TABLE_REQ}` r
-        LEFT JOIN `{TABLE_TC}` g ON r.req_id = g.req_id
-        WHERE g.req_id IS NULL
-        ORDER BY r.req_id
-        LIMIT @lim
-        """
-        job = bq_client.query(query, job_config=bigquery.QueryJobConfig(
-            query_parameters=[bigquery.ScalarQueryParameter("lim", "INT64", limit)]
-        ))
-    return list(job.result())
+        row = storage.get_requirement(req_id)
+        return [row] if row else []
+    # fetch those without any testcases yet (left anti join)
+    return storage.requirements_without_testcases(limit)
 
 def insert_testcases(rows):
-    errors = bq_client.insert_rows_json(TABLE_TC, rows)
+    errors = get_storage().write(TESTCASES, rows)
     if errors:
-        raise RuntimeError(f"BigQuery insert errors: {errors}")
+        raise RuntimeError(f"Insert errors: {errors}")
 
 # --------- Vertex AI ----------
 def init_vertex():
     vertexai.init(project=PROJECT_ID, location=LOCATION)
 
-# Before:
-# def call_gemini(prompt_text: str, temperature: float = 0.2, max_tokens: int = 2048) -> str:
-#     model = GenerativeModel(MODEL_NAME)
+def call_gemini(model_name: str, prompt_text: str, use_cache: bool = True,
+                prompt_version: str = PROMPT_VERSION) -> str:
+    # Same per-tier config as the API, so both share cache entries and the large tier's output budget
+    gen_cfg = gen_config(model_name)
+    cache = get_llm_cache() if use_cache else None
+    key = llm_cache_key(model_name, prompt_version, gen_cfg, prompt_text)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
 
-def call_gemini(model_name: str, prompt_text: str, temperature: float = 0.2, max_tokens: int = 2048) -> str:
     model = GenerativeModel(model_name)
-    cfg = GenerationConfig(temperature=temperature, max_output_tokens=max_tokens)
-    resp = model.generate_content(prompt_text, generation_config=cfg)
+    cfg = GenerationConfig(**gen_cfg)
+    # Shared rate limits + 429/5xx backoff; batch lane yields to interactive callers
+    resp = get_scheduler().run(
+        model_name,
+        get_router().timed(model_name, lambda: model.generate_content(prompt_text, generation_config=cfg)),
+        tokens=estimate_tokens(prompt_text, gen_cfg["max_output_tokens"]),
+        priority=PRIORITY_BATCH,
+    )
     if hasattr(resp, "text") and resp.text:
-        return resp.text
-    try:
-        parts = resp.candidates[0].content.parts
-        return "".join(getattr(p, "text", "") for p in parts)
-    except Exception:
-        return str(resp)
+        out = resp.text
+    else:
+        try:
+            parts = resp.candidates[0].content.parts
+            out = "".join(getattr(p, "text", "") for p in parts)
+        except Exception:
+            return str(resp)
+
+    if cache is not None and out.strip():
+        cache.set(key, out)
+    return out
+
+
+# --------- Run stats ----------
+class RunStats:
+    """Thread-safe counters for a batch run: model latencies, successes, failures."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.ok = 0
+        self.failed = 0
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def record_latency(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        with self.lock:
+            data = sorted(self.latencies)
+        if not data:
+            return 0.0
+        return data[min(len(data) - 1, int(round(p / 100.0 * (len(data) - 1))))]
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        done = self.ok + self.failed
+        rate = done / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{done} requirement(s) in {elapsed:.1f}s ({rate:.2f} req/s) | "
+            f"ok={self.ok} failed={self.failed} rows={self.rows} | "
+            f"model latency p50={self.percentile(50):.2f}s p95={self.percentile(95):.2f}s "
+            f"over {len(self.latencies)} call(s)"
+        )
 
 
 # --------- Main flow ----------
-# Before:
-# def process_requirement(req_id: str, text: str, retries: int = 2):
-
-def process_requirement(model_name: str, req_id: str, text: str, retries: int = 2):
-    tmpl = load_prompt_template()
+def process_requirement(model_name: str, req_id: str, text: str, retries: int = 2, use_cache: bool = True,
+                        tmpl=None, stats: RunStats = None):
+    tmpl = tmpl or load_prompt_template()
     prompt = fill_prompt(tmpl, req_id=req_id, text=text)
+    if model_name == "auto":
+        model_name = get_router().route(text, tmpl.requested_cases).model
 
     last_err = None
     for attempt in range(retries + 1):
-        out = call_gemini(model_name, prompt)
+        t0 = time.perf_counter()
+        out = call_gemini(model_name, prompt, use_cache=use_cache, prompt_version=tmpl.version)
+        if stats is not None:
+            stats.record_latency(time.perf_counter() - t0)
         try:
-            json_str = extract_json(out)
-            rows = validate_and_normalize_payload(req_id, json_str)
+            # Salvages complete test cases from chatty/truncated output; only an
+            # output with nothing usable costs another model call
+            rows = validate_and_normalize_payload(req_id, parse_test_cases(out).payload)
             # ensure we stamp the chosen model name on each row
             for r in rows:
                 r["model_version"] = model_name
+                r["prompt_version"] = tmpl.version
             return rows
         except Exception as e:
             last_err = e
@@ -198,35 +230,121 @@ def process_requirement(model_name: str, req_id: str, text: str, retries: int =
     raise RuntimeError(f"Failed to parse/validate Gemini output after retries: {last_err}")
 
 
+# --------- Checkpointing ----------
+def load_checkpoint(path: str, prompt_version: str, model: str) -> set:
+    """
+    req_ids whose rows a previous (possibly crashed) run already inserted with
+    the same prompt version and model.
+    """
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry.get("prompt_version") == prompt_version and entry.get("model") == model:
+                done.add(entry["req_id"])
+    return done
+
+def append_checkpoint(path: str, req_ids, prompt_version: str, model: str):
+    if not path:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for rid in req_ids:
+            entry = {"req_id": rid, "prompt_version": prompt_version, "model": model, "at": now_ts()}
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--req-id", help="Single requirement ID to process (e.g., REQ-0001)")
     parser.add_argument("--limit", type=int, default=3, help="How many requirements to process if --req-id not set")
     parser.add_argument("--model", default=getenv("MODEL_NAME", "gemini-2.0-flash-001"),
-                        help="Model name, e.g., gemini-2.0-flash-001 or gemini-2.0-pro-001")
+                        help="Model name, e.g., gemini-2.0-flash-001 or gemini-2.0-pro-001, "
+                             "or 'auto' to route each requirement between MODEL_FAST and MODEL_LARGE")
+    parser.add_argument("--prompt-version", default=PROMPT_VERSION,
+                        help="Registered prompt template version (prompts/prompt_<version>.txt)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the LLM response cache and always call Vertex")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Max model calls in flight (worker threads)")
+    parser.add_argument("--batch-size", type=int, default=200,
+                        help="Buffer this many test case rows across requirements before each insert")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Resume file (e.g. phase1_checkpoint.jsonl) recording finished req_ids per prompt "
+                             "version and model; finished ones are skipped on rerun. Ignored with --req-id")
     args = parser.parse_args()
 
     model_name = args.model
-    print(f"Using model: {model_name}")
+    print(f"Using model: {model_name} (concurrency={args.concurrency}, batch_size={args.batch_size})")
 
     init_vertex()
 
     reqs = fetch_requirements(limit=args.limit, req_id=args.req_id)
+    # An explicit --req-id is a deliberate regeneration, never a resume
+    checkpoint = None if args.req_id else args.checkpoint
+    done = load_checkpoint(checkpoint, args.prompt_version, model_name)
+    if done:
+        before = len(reqs)
+        reqs = [r for r in reqs if r["req_id"] not in done]
+        print(f"Resuming from {checkpoint}: skipping {before - len(reqs)} finished requirement(s).")
     if not reqs:
         print("No matching requirements found (or all already have test cases).")
         return
 
-    total_rows = 0
-    for r in reqs:
-        rid = r["req_id"]
-        text = r["text"]
-        print(f"Generating for {rid}...")
-        rows = process_requirement(model_name, rid, text)
+    tmpl = load_prompt_template(args.prompt_version)
+    stats = RunStats()
+    buffer, buffered_ids = [], []
+
+    def flush():
+        if not buffer:
+            return
+        # Taken out of the buffer first: a failed insert must not be retried by the final flush
+        rows, ids = list(buffer), list(buffered_ids)
+        buffer.clear()
+        buffered_ids.clear()
         insert_testcases(rows)
-        print(f"Inserted {len(rows)} test case(s) for {rid}.")
-        total_rows += len(rows)
-
-    print(f"Done. Inserted {total_rows} test case(s).")
+        append_checkpoint(checkpoint, ids, args.prompt_version, model_name)
+        print(f"Inserted {len(rows)} test case(s) for {len(ids)} requirement(s).")
+        stats.rows += len(rows)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = {
+            pool.submit(process_requirement, model_name, r["req_id"], r["text"],
+                        use_cache=not args.no_cache, tmpl=tmpl, stats=stats): r["req_id"]
+            for r in reqs
+        }
+        try:
+            for fut in as_completed(futures):
+                rid = futures[fut]
+                try:
+                    rows = fut.result()
+                except Exception as e:
+                    stats.failed += 1
+                    print(f"Failed {rid}: {e}", file=sys.stderr)
+                    continue
+                stats.ok += 1
+                print(f"Generated {len(rows)} test case(s) for {rid}.")
+                buffer.extend(rows)
+                buffered_ids.append(rid)
+                if len(buffer) >= args.batch_size:
+                    flush()
+        finally:
+            # Persist whatever finished before an interrupt so a rerun resumes from here
+            flush()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    print(f"Done. {stats.summary()}")
+    print(f"Scheduler: {get_scheduler().metrics()}")
+    print(f"Router: {json.dumps(get_router().metrics()['models'], default=str)}")
+    cache = get_llm_cache()
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
 
 if __name__ == "__main__":
     main()
@@ -1,24 +1,18 @@
+import os
+import sys
 import uuid
 from datetime import datetime, timezone
-from google.cloud import bigquery
 
-PROJECT_ID = "orbit-ai-472708"
-DATASET = "orbit_ai_poc"
-TABLE_TC = f"{PROJECT_ID}.{DATASET}.generated_testcases"
-TABLE_TR = f"{PROJECT_ID}.{DATASET}.trace_links"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+from storage import get_storage, TRACE_LINKS
 
 def now():
-    return datetime.now(timezone.utc)
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 
-bq = bigquery.Client(project=PROJECT_ID)
+storage = get_storage()
 
 # pick a small sample of recent testcases to link
-rows = list(bq.query(f"""
-  SELECT req_id, test_id
-  FROM `{TABLE_TC}`
-  ORDER BY created_at DESC
-  LIMIT 12
-""").result())
+rows = storage.recent_testcases(12, ("req_id", "test_id"))
 
 out = []
 for i, r in enumerate(rows, start=1):
@@ -43,7 +37,7 @@ for i, r in enumerate(rows, start=1):
         "created_by": "demo@orbit-ai"
     })
 
-errors = bq.insert_rows_json(TABLE_TR, out)
+errors = storage.write(TRACE_LINKS, out)
 if errors:
     raise RuntimeError(errors)
 print(f"Inserted {len(out)} mock trace links.")
\ No newline at end of file
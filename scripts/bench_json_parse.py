@@ -0,0 +1,100 @@
+"""
+Benchmark: old greedy-regex JSON extraction vs json_stream.parse_test_cases.
+
+Builds a synthetic corpus of model outputs (clean, fenced, chatty, trailing
+commas, truncated at random points) and reports parse time and the "re-call
+rate" - the share of outputs that yield no test cases and so would need a
+fresh model call.
+
+    python scripts/bench_json_parse.py [--n 2000] [--cases 8] [--seed 7]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from json_stream import parse_test_cases
+
+
+def old_extract(text: str):
+    """The previous main.py / phase1 behaviour."""
+    cleaned = re.sub(r"^```(?:json)?|```$", "", text.strip(), flags=re.MULTILINE)
+    m = re.search(r"\{.*\}", cleaned, flags=re.DOTALL)
+    payload = json.loads(m.group(0) if m else cleaned)
+    tcs = payload.get("test_cases", [])
+    if not isinstance(tcs, list) or not tcs:
+        raise ValueError("no test_cases")
+    return tcs
+
+
+def make_case(i: int) -> dict:
+    return {
+        "test_id": None,
+        "title": f"Verify audit log entry {i} is written when a clinician edits a record",
+        "steps": [f"Log in as clinician {i}", "Open a patient record", "Edit the allergy list", "Save"],
+        "expected_result": "An audit entry with user, timestamp and field diff is stored.",
+        "preconditions": "Clinician account exists; audit logging enabled.",
+        "severity": random.choice(["Critical", "High", "Medium", "Low"]),
+        "compliance_tags": ["IEC62304:SW_VER", "ISO27001:AccessCtrl"],
+        "trace_link": None,
+    }
+
+
+def make_output(kind: str, cases: int) -> str:
+    body = json.dumps({"req_id": "REQ-BENCH", "test_cases": [make_case(i) for i in range(cases)]}, indent=2)
+    if kind == "clean":
+        return body
+    if kind == "fenced":
+        return "```json\n" + body + "\n```"
+    if kind == "chatty":
+        return "Sure! Here are the test cases:\n" + body + "\nLet me know if you need more {details}."
+    if kind == "trailing_comma":
+        return body.replace('"trace_link": null\n', '"trace_link": null,\n')
+    if kind == "truncated":
+        return body[: random.randint(len(body) // 4, len(body) - 5)]
+    raise ValueError(kind)
+
+
+KINDS = ["clean", "fenced", "chatty", "trailing_comma", "truncated"]
+
+
+def bench(fn, corpus):
+    failures = 0
+    salvaged = 0
+    t0 = time.perf_counter()
+    for text in corpus:
+        try:
+            tcs = fn(text)
+        except Exception:
+            tcs = []
+        if tcs:
+            salvaged += len(tcs)
+        else:
+            failures += 1
+    elapsed = time.perf_counter() - t0
+    return elapsed, failures, salvaged
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000, help="outputs per kind")
+    ap.add_argument("--cases", type=int, default=8, help="test cases per output")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    print(f"{'kind':<16}{'parser':<8}{'us/parse':>10}{'re-call %':>11}{'cases kept':>12}")
+    for kind in KINDS:
+        corpus = [make_output(kind, args.cases) for _ in range(args.n)]
+        for name, fn in (("old", old_extract), ("new", lambda t: parse_test_cases(t).test_cases)):
+            elapsed, failures, kept = bench(fn, corpus)
+            print(f"{kind:<16}{name:<8}{elapsed / len(corpus) * 1e6:>10.1f}"
+                  f"{failures / len(corpus) * 100:>10.1f}%{kept:>12}")
+
+
+if __name__ == "__main__":
+    main()
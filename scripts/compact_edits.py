@@ -0,0 +1,37 @@
+"""
+Fold the test case edit journal into generated_testcases.
+
+Runs one compaction (a single MERGE up to EDIT_COMPACT_MIN_AGE_S ago, then a
+watermark row) and exits. Schedule exactly one of these, e.g. a Cloud
+Scheduler-triggered Cloud Run job or a cron entry every 10 minutes, so API
+instances never run the MERGE against each other:
+
+    python scripts/compact_edits.py
+
+Uses the same STORAGE_BACKEND / PROJECT_ID / DATASET settings as the API.
+Exits non-zero when the compaction fails; the next run picks up the same edits.
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from storage import get_storage
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    storage = get_storage()
+    try:
+        updated = storage.compact_edits()
+    except Exception as e:
+        print(f"Edit compaction failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        storage.close()
+    print(f"Edit compaction: {updated} test case(s) updated.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import os, sys, tempfile
+
+# The API modules import each other as top-level modules (uvicorn runs from api/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+# Local backends only: no BigQuery, caches in a throwaway directory
+_tmp = tempfile.mkdtemp(prefix="orbit-tests-")
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("STORAGE_SQLITE_PATH", os.path.join(_tmp, "orbit.sqlite3"))
+os.environ.setdefault("CACHE_DIR", _tmp)
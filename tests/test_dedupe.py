@@ -0,0 +1,72 @@
+import pytest
+
+from dedupe import Deduper, LSHIndex, signature, similarity
+
+BASE = {"title": "Lock the account after five failed login attempts",
+        "steps": ["Open the login page", "Enter a wrong password five times"],
+        "expected_result": "The account is locked and the user sees a lockout message"}
+REWORDED = {**BASE, "title": "Lock account after five failed login attempts"}
+OTHER = {"title": "Export the audit log as CSV", "steps": ["Open audit log", "Click export"],
+         "expected_result": "A CSV file with every audit entry downloads"}
+
+
+def case(test_id, tc):
+    return {**tc, "test_id": test_id}
+
+
+def test_similarity_orders_cases():
+    base = signature(BASE)
+    assert similarity(base, signature(dict(BASE))) == 1.0
+    assert similarity(base, signature(REWORDED)) >= 0.8
+    assert similarity(base, signature(OTHER)) < 0.3
+
+
+def test_steps_as_string_or_list_sign_the_same():
+    assert signature({**BASE, "steps": "Open the login page"}) == signature({**BASE, "steps": ["Open the login page"]})
+
+
+def test_lsh_index_finds_and_forgets():
+    idx = LSHIndex()
+    idx.add("T1", signature(BASE))
+    idx.add("T2", signature(OTHER))
+    assert idx.best_match(signature(REWORDED))[0] == "T1"
+    idx.remove("T1")
+    assert idx.best_match(signature(REWORDED))[0] != "T1" and len(idx) == 1
+    assert not idx.buckets.get((0, signature(BASE)[:4]))
+
+
+def test_filter_skips_stored_and_in_batch_duplicates():
+    stored = {("req_id", "R1"): [case("T1", BASE)]}
+    d = Deduper(lambda field, value: stored.get((field, value), []))
+    kept, skipped = d.filter("R1", None, [case("N1", REWORDED), case("N2", OTHER), case("N3", OTHER)])
+    assert [tc["test_id"] for tc in kept] == ["N2"]
+    assert [(s["test_id"], s["duplicate_of"]) for s in skipped] == [("N1", "T1"), ("N3", "N2")]
+    assert all(s["similarity"] >= 0.8 for s in skipped)
+
+
+def test_project_scope_catches_duplicates_across_requirements():
+    stored = {("project_id", "P1"): [case("T1", BASE)]}
+    d = Deduper(lambda field, value: stored.get((field, value), []))
+    assert d.filter("R2", None, [case("N1", REWORDED)])[1] == []
+    assert d.filter("R3", "P1", [case("N2", REWORDED)])[1][0]["duplicate_of"] == "T1"
+
+
+@pytest.mark.parametrize("threshold, skipped", [(0.8, 1), (1.01, 0)])
+def test_threshold(threshold, skipped):
+    d = Deduper(lambda field, value: [case("T1", BASE)], threshold=threshold)
+    assert len(d.filter("R1", None, [case("N1", REWORDED)])[1]) == skipped
+
+
+def test_forget_lets_an_unsaved_case_through_again():
+    d = Deduper(lambda field, value: [])
+    d.filter("R1", "P1", [case("N1", BASE)])
+    d.forget("R1", "P1", ["N1"])
+    kept, skipped = d.filter("R1", "P1", [case("N2", BASE)])
+    assert [tc["test_id"] for tc in kept] == ["N2"] and not skipped
+
+
+def test_seed_failure_starts_an_empty_index():
+    def broken(field, value):
+        raise RuntimeError("storage down")
+    kept, _ = Deduper(broken).filter("R1", None, [case("N1", BASE)])
+    assert len(kept) == 1
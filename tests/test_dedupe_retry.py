@@ -0,0 +1,41 @@
+import pytest
+
+import main
+from fastapi import HTTPException
+
+TEXT = "The system shall lock an account after five failed login attempts and notify the user by email."
+
+
+def cases():
+    return [
+        {"title": "Lock account after five failed logins", "steps": ["Enter a wrong password five times"],
+         "expected_result": "The account is locked", "severity": "High"},
+        {"title": "Email the user when the account is locked", "steps": ["Trigger a lockout", "Open the inbox"],
+         "expected_result": "A lockout email arrives", "severity": "Medium"},
+    ]
+
+
+@pytest.mark.parametrize("failure", [
+    TimeoutError("BigQuery write buffer full"),
+    [{"index": 0, "errors": [{"reason": "invalid"}]}, {"index": 1, "errors": [{"reason": "invalid"}]}],
+])
+def test_failed_insert_does_not_block_retry(monkeypatch, failure):
+    storage = main.get_storage()
+    # Separate scopes per case: the first case's stored rows would be duplicates of the second's
+    scope = "ROWERR" if isinstance(failure, list) else "RAISE"
+    req_id, project_id = f"REQ-{scope}", f"P-{scope}"
+
+    def failing_write(kind, rows):
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    monkeypatch.setattr(storage, "write", failing_write)
+    with pytest.raises((TimeoutError, HTTPException)):
+        main.save_testcases(req_id, cases(), TEXT, project_id)
+    monkeypatch.undo()
+
+    saved, skipped = main.save_testcases(req_id, cases(), TEXT, project_id)
+    assert len(saved) == 2
+    assert skipped == []
+    assert len(storage.testcases_by("req_id", req_id, ("test_id",))) == 2
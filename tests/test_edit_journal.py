@@ -0,0 +1,46 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from storage import SQLiteStorage, TESTCASES
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = SQLiteStorage(str(tmp_path / "orbit.sqlite3"))
+    s.write(TESTCASES, [{"test_id": "T1", "req_id": "R1", "project_id": "P1", "title": "Old title",
+                         "steps": ["a"], "expected_result": "ok", "severity": "Low",
+                         "created_at": "2026-01-01T00:00:00"}])
+    return s
+
+
+def test_edits_are_visible_and_journaled(storage):
+    storage.update_testcase("T1", {"title": "New title"}, "alice")
+    storage.update_testcase("T1", {"severity": "High", "steps": "one step"}, "bob")
+
+    row = storage.testcases_by("test_id", "T1", ["test_id", "title", "severity", "steps", "expected_result"])[0]
+    assert row == {"test_id": "T1", "title": "New title", "severity": "High", "steps": ["one step"],
+                   "expected_result": "ok"}
+
+    history = storage.testcase_history("T1")
+    assert [(h["edited_by"], h["edited_fields"]) for h in history] == [
+        ("alice", ["title"]), ("bob", ["severity", "steps"]),
+    ]
+    assert history[0]["severity"] is None         # fields an edit doesn't set stay empty in its entry
+    assert storage.compact_edits() == 0            # SQLite applies edits in place; nothing to fold
+
+
+def test_unknown_field_is_rejected(storage):
+    with pytest.raises(ValueError):
+        storage.update_testcase("T1", {"req_id": "R2"})
+    assert storage.testcase_history("T1") == []
+
+
+def test_update_and_history_endpoints(storage, monkeypatch):
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    client = TestClient(main.app)
+    r = client.post("/manual/testcase/update", json={"test_id": "T1", "title": "Via API", "user_id": "carol"})
+    assert r.json() == {"ok": True, "test_id": "T1"}
+    assert client.get("/manual/testcase/T1/history").json()["edits"][0]["title"] == "Via API"
+    listed = storage.project_testcases("P1")
+    assert listed[0]["title"] == "Via API"
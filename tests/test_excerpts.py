@@ -0,0 +1,89 @@
+import excerpts
+from excerpts import ExcerptIndex, segment, tokenize
+
+TEXT = (
+    "Login requirements\n\n"
+    "The system shall lock the account after five failed login attempts. "
+    "A locked account must be unlocked by an administrator.\n\n"
+    "Passwords must be at least twelve characters long and include a digit.\n"
+    "- Short\n"
+    "- Session tokens expire after thirty minutes of inactivity."
+)
+
+
+def test_tokenize_drops_stopwords_and_single_characters():
+    assert tokenize("Verify the User can log in to the System, a 2FA step") == ["log", "2fa", "step"]
+
+
+def test_segment_trims_and_merges_short_segments_forward():
+    spans = segment(TEXT)
+    texts = [TEXT[s:e] for s, e in spans]
+    # The heading and the short bullet are merged into the segment that follows them
+    assert texts[0].startswith("Login requirements\n\nThe system shall lock")
+    assert texts[1] == "A locked account must be unlocked by an administrator."
+    assert texts[3] == "- Short\n- Session tokens expire after thirty minutes of inactivity."
+    assert all(t == t.strip() for t in texts)
+
+
+def test_segment_short_trailer_joins_last_segment():
+    text = "The account is locked after five failed attempts.\n\nEnd."
+    assert segment(text) == [(0, len(text))]
+
+
+def test_excerpt_picks_best_segment_with_offsets():
+    ix = ExcerptIndex(TEXT)
+    ex = ix.excerpt("password length of twelve characters")
+    assert ex.text == "Passwords must be at least twelve characters long and include a digit."
+    assert TEXT[ex.start:ex.end] == ex.text
+    assert ex.score > 0
+
+
+def test_excerpt_joins_matching_short_neighbour():
+    ix = ExcerptIndex(TEXT)
+    ex = ix.excerpt("locked account after failed attempts")
+    assert "five failed login attempts" in ex.text
+    assert ex.text.endswith("unlocked by an administrator.")
+    assert TEXT[ex.start:ex.end].strip() == ex.text
+
+
+def test_rank_orders_by_score():
+    ix = ExcerptIndex(TEXT)
+    ranked = ix.rank("locked account", top=3)
+    assert [i for i, _ in ranked] == [1, 0]
+    assert ranked[0][1] > ranked[1][1]
+
+
+def test_no_match_falls_back_to_first_paragraph():
+    ex = ExcerptIndex(TEXT).excerpt("zebra")
+    assert (ex.text, ex.start, ex.end, ex.score) == ("Login requirements", 0, 18, 0.0)
+    assert ExcerptIndex("").excerpt("anything").text == ""
+
+
+def test_excerpt_capped(monkeypatch):
+    monkeypatch.setattr(excerpts, "MAX_EXCERPT_CHARS", 40)
+    text = "The account lockout policy applies to every interactive login attempt made."
+    ex = ExcerptIndex(text).excerpt("account lockout")
+    assert ex.end - ex.start == 40
+    assert text.startswith(ex.text)
+
+
+def test_for_test_case_uses_title_and_expected_result():
+    ix = ExcerptIndex(TEXT)
+    ex = ix.for_test_case({"title": "Session timeout", "expected_result": "Token expires after inactivity"})
+    assert "Session tokens expire" in ex.text
+    assert ix.for_test_case({}).start == 0
+
+
+def test_attach_excerpts_sets_spans_with_offset():
+    import main
+
+    tcs = [
+        {"title": "Password complexity", "expected_result": "twelve characters with a digit"},
+        {"title": "Kept", "source_excerpt": "already set"},
+    ]
+    main.attach_excerpts(tcs, ExcerptIndex(TEXT), offset=1000, overwrite=False)
+    ex = tcs[0]["source_excerpt"]
+    assert ex.startswith("Passwords must be")
+    span = tcs[0]["source_span"]
+    assert TEXT[span["start"] - 1000:span["end"] - 1000] == ex
+    assert tcs[1] == {"title": "Kept", "source_excerpt": "already set"}
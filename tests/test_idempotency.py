@@ -0,0 +1,123 @@
+import asyncio, threading
+
+import pytest
+
+import idempotency
+from idempotency import IdempotencyStore, IdempotencyConflict, IdempotencyTimeout, request_fingerprint
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_S", 0.01)
+    return IdempotencyStore(str(tmp_path / "idem.sqlite3"), ttl=3600)
+
+
+def test_request_fingerprint_is_stable_and_order_sensitive():
+    assert request_fingerprint("gen", {"b": 1, "a": 2}) == request_fingerprint("gen", {"a": 2, "b": 1})
+    assert request_fingerprint("a", "b") != request_fingerprint("b", "a")
+
+
+def test_second_call_replays_stored_response(store):
+    calls = []
+
+    def work():
+        calls.append(1)
+        return {"test_cases": [{"test_id": "TC-1"}]}
+
+    first = store.run("key", "fp", work)
+    second = store.run("key", "fp", work)
+    assert first == ({"test_cases": [{"test_id": "TC-1"}]}, False)
+    assert second == (first[0], True)
+    assert len(calls) == 1
+    assert store.stats()["replays"] == 1
+
+
+def test_key_reused_with_other_request_conflicts(store):
+    store.run("key", "fp-1", lambda: {"ok": True})
+    with pytest.raises(IdempotencyConflict):
+        store.run("key", "fp-2", lambda: {"ok": True})
+    assert store.stats()["conflicts"] == 1
+
+
+def test_failure_releases_key(store):
+    def boom():
+        raise RuntimeError("model down")
+
+    with pytest.raises(RuntimeError):
+        store.run("key", "fp", boom)
+    assert store.run("key", "fp", lambda: {"ok": True}) == ({"ok": True}, False)
+    assert store.stats()["released"] == 1
+
+
+def test_expired_response_runs_again(tmp_path):
+    store = IdempotencyStore(str(tmp_path / "idem.sqlite3"), ttl=0)
+    store.run("key", "fp", lambda: {"n": 1})
+    assert store.run("key", "fp", lambda: {"n": 2}) == ({"n": 2}, False)
+
+
+def test_retry_waits_for_running_request(store):
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return {"n": 1}
+
+    t = threading.Thread(target=lambda: results.append(store.run("key", "fp", slow)))
+    t.start()
+    assert started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(store.run("key", "fp", lambda: {"n": 2})))
+    waiter.start()
+    while store.stats()["waits"] < 1:
+        threading.Event().wait(0.01)
+    release.set()
+    t.join(5)
+    waiter.join(5)
+    assert sorted(results, key=lambda r: r[1]) == [({"n": 1}, False), ({"n": 1}, True)]
+
+
+def test_wait_gives_up_after_timeout(store, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_S", 0)
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def slow():
+            await gate.wait()
+            return {"n": 1}
+
+        first = asyncio.ensure_future(store.run_async("key", "fp", slow))
+        while store.stats()["runs"] < 1:
+            await asyncio.sleep(0.01)
+        with pytest.raises(IdempotencyTimeout):
+            await store.run_async("key", "fp", slow)
+        gate.set()
+        return await first
+
+    assert asyncio.run(main()) == ({"n": 1}, False)
+
+
+def test_async_replay_and_cancel_releases(store):
+    async def main():
+        async def hang():
+            await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(store.run_async("key", "fp", hang))
+        while store.stats()["runs"] < 1:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def work():
+            return {"n": 1}
+
+        first = await store.run_async("key", "fp", work)
+        second = await store.run_async("key", "fp", work)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == ({"n": 1}, False)
+    assert second == ({"n": 1}, True)
+    assert store.stats()["released"] == 1
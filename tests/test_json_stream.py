@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import json_stream
+from json_stream import close_truncated, parse_test_cases
+
+CASES = [
+    {"title": "Lock after five failures", "steps": ["Fail five logins"], "expected_result": "Locked, {really}"},
+    {"title": "Unlock by email", "steps": ["Click link"], "expected_result": "Unlocked"},
+]
+CLEAN = json.dumps({"req_id": "REQ-1", "test_cases": CASES})
+
+
+def test_clean_json():
+    r = parse_test_cases(CLEAN)
+    assert r.test_cases == CASES and r.payload["req_id"] == "REQ-1"
+    assert r.complete and not r.repaired
+
+
+def test_fences_prose_and_trailing_commas():
+    text = "Here you go:\n```json\n" + CLEAN.replace("}]}", "},]}") + "\n```\nHope this helps, {not json}"
+    r = parse_test_cases(text)
+    assert r.test_cases == CASES
+    assert r.repaired and not r.complete
+
+
+def test_truncated_output_keeps_complete_cases_and_closes_the_tail():
+    cut = CLEAN[:CLEAN.index('"Unlocked"') + 4]      # mid-string in the second case
+    r = parse_test_cases(cut)
+    assert [tc["title"] for tc in r.test_cases] == ["Lock after five failures", "Unlock by email"]
+    assert r.payload["req_id"] == "REQ-1" and r.repaired
+
+
+def test_truncated_tail_without_title_is_dropped():
+    cut = CLEAN[:CLEAN.index('"Unlock by email"') - 3]
+    assert [tc["title"] for tc in parse_test_cases(cut).test_cases] == ["Lock after five failures"]
+
+
+def test_bare_array_and_garbage():
+    assert parse_test_cases(json.dumps(CASES)).test_cases == CASES
+    assert parse_test_cases("Sorry, I can't help with that.").test_cases == []
+
+
+@pytest.mark.parametrize("fragment, expected", [
+    ('{"title": "A", "steps": ["x", "y', {"title": "A", "steps": ["x", "y"]}),
+    ('{"title": "A", "severity":', {"title": "A"}),
+    ('{"title": "A",', {"title": "A"}),
+    ('{"title": "A, b", "steps": [', {"title": "A, b", "steps": []}),
+])
+def test_close_truncated(fragment, expected):
+    assert close_truncated(fragment) == expected
+
+
+def test_close_truncated_gives_up_on_non_objects():
+    assert close_truncated('["a", "b') is None
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, len(CLEAN)])
+def test_stream_yields_cases_as_they_close(size):
+    stream = json_stream.TestCaseStream()
+    out = []
+    for i in range(0, len(CLEAN), size):
+        out.extend(stream.feed(CLEAN[i:i + size]))
+    assert out == CASES and stream.done and stream.pending() == ""
+
+
+def test_stream_pending_holds_the_unfinished_case():
+    stream = json_stream.TestCaseStream()
+    cut = CLEAN[:CLEAN.index('"Unlock by email"') + 5]
+    assert stream.feed(cut) == CASES[:1]
+    assert not stream.done and stream.pending().startswith('{"title": "Unl')
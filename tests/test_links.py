@@ -0,0 +1,93 @@
+import asyncio, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cache import TwoTierCache
+from links import LinkFetcher, html_to_text
+
+PAGE = (
+    "<html><head><title>t</title><style>body { color: red }</style></head><body>"
+    "<nav>Home | Products | Contact</nav>"
+    "<script>var tracking = 1;</script>"
+    "<main><h1>Password policy</h1><p>Passwords must be at least twelve characters long.</p></main>"
+    "<footer>Copyright</footer></body></html>"
+)
+BIG = b"x" * 10000
+
+
+class Handler(BaseHTTPRequestHandler):
+    hits = {}
+
+    def do_GET(self):
+        Handler.hits[self.path] = Handler.hits.get(self.path, 0) + 1
+        if self.path == "/page":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                return
+            body, ctype = PAGE.encode(), "text/html; charset=utf-8"
+        elif self.path == "/big":
+            body, ctype = BIG, "text/plain"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def fetcher(**kw):
+    return LinkFetcher(cache=TwoTierCache("links-test", None), **kw)
+
+
+async def fetch_twice(f, url):
+    try:
+        return await f.fetch(url), await f.fetch(url)
+    finally:
+        await f.aclose()
+
+
+def test_not_modified_returns_cached_text(server):
+    f = fetcher()
+    first, second = asyncio.run(fetch_twice(f, server + "/page"))
+    assert "twelve characters" in first
+    assert second == first
+    assert Handler.hits["/page"] == 2
+    assert f.stats["fetched"] == 1 and f.stats["not_modified"] == 1
+
+
+def test_body_is_cut_off_at_max_bytes(server):
+    f = fetcher(max_bytes=1000)
+    first, second = asyncio.run(fetch_twice(f, server + "/big"))
+    assert len(first) == 1000
+    assert f.stats["truncated"] == 2          # truncated bodies are never cached
+    assert len(f.cache.mem) == 0
+
+
+def test_failed_link_is_empty(server):
+    f = fetcher()
+    assert asyncio.run(fetch_twice(f, server + "/missing")) == ("", "")
+    assert f.stats["failed"] == 2
+
+
+def test_html_to_text_drops_boilerplate():
+    text = html_to_text(PAGE)
+    assert "Passwords must be at least twelve characters long." in text
+    for junk in ("tracking", "color: red", "Products", "Copyright"):
+        assert junk not in text
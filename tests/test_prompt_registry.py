@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from prompt_registry import PromptRegistry, PromptTemplate, FALLBACK_PROMPT, version_from_filename
+
+
+def write(path, text, mtime=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_version_from_filename():
+    assert version_from_filename("prompt_poc_v1.txt") == "poc-v1"
+    assert version_from_filename("/some/dir/prompt_detailed.txt") == "detailed"
+    assert version_from_filename("notes.txt") is None
+    assert version_from_filename("prompt_v1.md") is None
+
+
+def test_render_fills_placeholders_and_keeps_unknown_ones():
+    tmpl = PromptTemplate("v", "ID: {{ req_id }}\nText: {{requirement_text}}\nLang: {{lang}}")
+    assert tmpl.placeholders == {"req_id", "requirement_text", "lang"}
+    out = tmpl.render(req_id="R-1", requirement_text="Login must lock")
+    assert out == "ID: R-1\nText: Login must lock\nLang: {{lang}}"
+
+
+def test_requested_cases_read_from_literal_text_only():
+    assert PromptTemplate("v", "Please generate 8 test cases for {{req_id}}").requested_cases == 8
+    assert PromptTemplate("v", "Write test cases for {{req_id}}").requested_cases == 0
+    # A placeholder value is not part of the template text
+    assert PromptTemplate("v", "{{generate}} 5").requested_cases == 0
+
+
+def test_discovers_versions_and_registers_default(tmp_path):
+    write(tmp_path / "prompt_poc_v1.txt", "one {{req_id}}")
+    write(tmp_path / "prompt_detailed.txt", "two {{req_id}}")
+    write(tmp_path / "readme.txt", "ignored")
+    reg = PromptRegistry(str(tmp_path), "poc-v1")
+
+    assert reg.versions() == ["detailed", "poc-v1"]
+    assert reg.get().render(req_id="R") == "one R"
+    assert reg.get("detailed").render(req_id="R") == "two R"
+    assert reg.get("poc-v1") is reg.get()  # compiled once
+
+
+def test_unknown_version_raises_and_late_files_are_discovered(tmp_path):
+    reg = PromptRegistry(str(tmp_path), "default")
+    with pytest.raises(KeyError):
+        reg.get("later")
+    write(tmp_path / "prompt_later.txt", "late {{req_id}}")
+    assert reg.get("later").render(req_id="R") == "late R"
+
+
+def test_missing_default_file_falls_back(tmp_path):
+    reg = PromptRegistry(str(tmp_path), "default", str(tmp_path / "prompt_missing.txt"))
+    tmpl = reg.get()
+    assert "".join(tmpl.segments) == "".join(PromptTemplate("x", FALLBACK_PROMPT).segments)
+    assert {"req_id", "requirement_text"} <= tmpl.placeholders
+
+
+def test_reload_on_mtime_change_after_interval(tmp_path):
+    path = tmp_path / "prompt_v.txt"
+    write(path, "old {{req_id}}", mtime=1_000_000)
+    reg = PromptRegistry(str(tmp_path), "v", reload_interval=0)
+    assert reg.get().render(req_id="R") == "old R"
+
+    write(path, "new {{req_id}}", mtime=2_000_000)
+    assert reg.get().render(req_id="R") == "new R"
+
+
+def test_no_reload_within_interval(tmp_path):
+    path = tmp_path / "prompt_v.txt"
+    write(path, "old", mtime=1_000_000)
+    reg = PromptRegistry(str(tmp_path), "v", reload_interval=3600)
+    first = reg.get()
+    write(path, "new", mtime=2_000_000)
+    assert reg.get() is first
+
+
+def test_deleted_file_keeps_last_good_copy(tmp_path):
+    path = tmp_path / "prompt_v.txt"
+    write(path, "kept {{req_id}}", mtime=1_000_000)
+    reg = PromptRegistry(str(tmp_path), "v", reload_interval=0)
+    reg.get()
+    os.remove(path)
+    assert reg.get().render(req_id="R") == "kept R"
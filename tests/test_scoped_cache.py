@@ -0,0 +1,61 @@
+import time
+
+from cache import ScopedCache
+
+
+def rows(*ids):
+    return [{"test_id": i} for i in ids]
+
+
+def load(cache, scope, ids):
+    return cache.load(scope, lambda: rows(*ids), members=lambda p: [r["test_id"] for r in p])
+
+
+def test_hit_and_member_invalidation():
+    cache = ScopedCache("t")
+    etag, _, hit = load(cache, "P1", ["T1", "T2"])
+    assert not hit
+    assert load(cache, "P1", ["T1", "T2"])[:3:2] == (etag, True)
+    cache.invalidate_members("T2")
+    assert not load(cache, "P1", ["T1", "T2"])[2]
+
+
+def test_invalidated_scope_leaves_no_members():
+    cache = ScopedCache("t")
+    load(cache, "P1", ["T1", "T2"])
+    load(cache, "P2", ["T2", "T3"])
+    cache.invalidate("P1")
+    assert cache.stats()["tracked_members"] == 2   # T2 and T3, still held by P2
+    cache.invalidate("P2")
+    assert cache.stats()["tracked_members"] == 0
+
+
+def test_evicted_scope_leaves_no_members():
+    cache = ScopedCache("t", max_items=2)
+    for n in range(10):
+        load(cache, f"P{n}", [f"T{n}a", f"T{n}b"])
+    s = cache.stats()
+    assert s["items"] == 2 and s["tracked_members"] == 4 and s["evictions"] == 8
+
+
+def test_expired_scope_leaves_no_members(monkeypatch):
+    cache = ScopedCache("t", ttl=10)
+    load(cache, "P1", ["T1"])
+    later = time.time() + 60
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert not load(cache, "P1", ["T9"])[2]
+    assert cache.stats()["tracked_members"] == 1
+    cache.invalidate_members("T1")                # no longer cached under P1
+    assert load(cache, "P1", ["T9"])[2]
+
+
+def test_result_computed_during_invalidation_is_not_stored():
+    cache = ScopedCache("t")
+
+    def compute():
+        cache.invalidate("P1")
+        return rows("T1")
+
+    cache.load("P1", compute)
+    assert not cache.load("P1", lambda: rows("T1"))[2]
+    assert cache.stats()["stale_fills"] == 1
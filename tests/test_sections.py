@@ -0,0 +1,56 @@
+from sections import DOC_KEY, plan_revision, section_at, stable_sections
+
+DOC = "\n\n".join([
+    "1. Login",
+    "Users sign in with an email address and a password of at least twelve characters.",
+    "2. Lockout",
+    "After five failed attempts the account is locked for fifteen minutes.",
+    "3. Recovery",
+    "A locked user can request an unlock link by email.",
+])
+
+
+def keys(text):
+    return [s.key for s in stable_sections(text, min_chars=10)]
+
+
+def test_headings_start_sections_and_offsets_cover_the_text():
+    sections = stable_sections(DOC, min_chars=10)
+    assert [s.heading for s in sections] == ["1. Login", "2. Lockout", "3. Recovery"]
+    for s in sections:
+        assert DOC[s.start:s.end] == s.text
+    assert section_at(sections, DOC.index("fifteen")).heading == "2. Lockout"
+    assert section_at(sections, len(DOC) + 5) is None
+
+
+def test_editing_one_section_changes_only_its_key():
+    before = keys(DOC)
+    after = keys(DOC.replace("fifteen minutes", "thirty minutes"))
+    assert [a == b for a, b in zip(before, after)] == [True, False, True]
+
+
+def test_whitespace_only_changes_keep_keys():
+    assert keys(DOC.replace("locked for", "locked   for")) == keys(DOC)
+
+
+def test_identical_sections_get_distinct_keys():
+    text = "Intro paragraph.\n\n# A\n\nSame body.\n\n# A\n\nSame body."
+    k = keys(text)
+    assert len(k) == len(set(k))
+
+
+def test_plan_revision_diffs_by_key():
+    old = stable_sections(DOC, min_chars=10)
+    new = stable_sections(DOC.replace("fifteen minutes", "thirty minutes") + "\n\n4. Audit\n\nLockouts are logged.",
+                          min_chars=10)
+    previous = {old[0].key: ["T1"], old[1].key: ["T2", "T3"], old[2].key: ["T4"], DOC_KEY: ["T9"]}
+    plan = plan_revision(new, previous)
+    assert [s.heading for s in plan.changed] == ["2. Lockout", "4. Audit"]
+    assert [s.heading for s in plan.unchanged] == ["1. Login", "3. Recovery"]
+    assert plan.deleted == {old[1].key: ["T2", "T3"]}
+    assert plan.kept == {old[0].key: ["T1"], old[2].key: ["T4"], DOC_KEY: ["T9"]}
+
+
+def test_first_revision_is_all_changed():
+    plan = plan_revision(stable_sections(DOC, min_chars=10), {})
+    assert len(plan.changed) == 3 and not plan.unchanged and not plan.deleted
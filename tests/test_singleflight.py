@@ -0,0 +1,146 @@
+import asyncio, threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_sync_followers_share_leader_result():
+    sf = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "done"
+
+    def caller():
+        results.append(sf.do("k", work))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=caller) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while sf.followers < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [("done", False)] + [("done", True)] * 3
+    assert sf.stats() == {"leaders": 1, "followers": 3, "in_flight": 0}
+
+
+def test_sync_error_is_shared_and_key_is_released():
+    sf = SingleFlight()
+
+    def boom():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        sf.do("k", boom)
+    assert sf.do("k", lambda: 1) == (1, False)
+    assert sf.stats()["in_flight"] == 0
+
+
+def test_async_concurrent_callers_run_once():
+    sf = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(sf.do_async("k", work) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results[0] == ("done", False)
+    assert results[1:] == [("done", True)] * 3
+    assert sf.stats()["in_flight"] == 0
+
+
+def test_async_different_keys_do_not_share():
+    sf = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(
+            sf.do_async("a", lambda: asyncio.sleep(0, "a")),
+            sf.do_async("b", lambda: asyncio.sleep(0, "b")),
+        )
+
+    assert asyncio.run(main()) == [("a", False), ("b", False)]
+
+
+def test_async_follower_survives_leader_cancel():
+    sf = SingleFlight()
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def work():
+            await gate.wait()
+            return "done"
+
+        leader = asyncio.ensure_future(sf.do_async("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(sf.do_async("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == ("done", True)
+
+
+def test_async_work_cancelled_when_every_caller_leaves():
+    sf = SingleFlight()
+    cancelled = []
+
+    async def main():
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        callers = [asyncio.ensure_future(sf.do_async("k", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for c in callers:
+            c.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert sf.stats()["in_flight"] == 0
+        # The key is free again for new work
+        return await sf.do_async("k", lambda: asyncio.sleep(0, "again"))
+
+    assert asyncio.run(main()) == ("again", False)
+    assert cancelled == [1]
+
+
+def test_async_error_is_shared():
+    sf = SingleFlight()
+
+    async def main():
+        async def boom():
+            await asyncio.sleep(0)
+            raise ValueError("bad")
+
+        return await asyncio.gather(
+            sf.do_async("k", boom), sf.do_async("k", boom), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert results[0] is results[1]
@@ -0,0 +1,109 @@
+import pytest
+
+from storage import SQLiteStorage, REQUIREMENTS, TESTCASES, TRACE_LINKS, SECTIONS
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage(str(tmp_path / "orbit.sqlite3"))
+
+
+def tc_row(test_id, req_id, project_id, created_at, **extra):
+    return {"test_id": test_id, "req_id": req_id, "project_id": project_id, "title": f"Case {test_id}",
+            "steps": ["step"], "severity": "Medium", "created_at": created_at, **extra}
+
+
+def section_row(req_id, revision, key, test_ids, status):
+    return {"req_id": req_id, "revision": revision, "section_key": key, "section_index": 0,
+            "test_ids": test_ids, "status": status}
+
+
+def test_obsolete_flag_in_every_read(storage):
+    storage.write(REQUIREMENTS, [{"req_id": "R1", "title": "Login", "text": "..."},
+                                 {"req_id": "R2", "title": "Other", "text": "..."}])
+    storage.write(TESTCASES, [tc_row("T1", "R1", "P1", "2026-01-01T00:00:01"),
+                              tc_row("T2", "R1", "P1", "2026-01-01T00:00:02"),
+                              tc_row("T3", "R2", "P2", "2026-01-01T00:00:03")])
+    storage.write(TRACE_LINKS, [{"req_id": "R1", "test_id": "T1", "project_id": "P1", "external_system": "Jira",
+                                 "external_key": "QA-1", "external_url": "https://jira/QA-1",
+                                 "created_at": "2026-01-02T00:00:00"}])
+    storage.write(SECTIONS, [section_row("R1", 2, "a", ["T1"], "active"), section_row("R1", 2, "b", ["T2"], "obsolete"),
+                             section_row("R2", 1, "a", ["T3"], "obsolete")])
+
+    listed = {r["test_id"]: r for r in storage.project_testcases("P1")}
+    assert {t: r["obsolete"] for t, r in listed.items()} == {"T1": False, "T2": True}
+    assert listed["T1"]["is_pushed"] is True and listed["T2"]["is_pushed"] is False
+
+    paged = list(storage.iter_project_testcases("P1", ["test_id", "obsolete", "is_pushed"]))
+    assert [(r["test_id"], r["obsolete"]) for r in paged] == [("T2", True), ("T1", False)]
+
+    trace = storage.traceability("R1")
+    assert {t["test_id"]: bool(t["obsolete"]) for t in trace["tests"]} == {"T1": False, "T2": True}
+    assert trace["tests"][-1]["trace_links"][0]["external_key"] == "QA-1"
+
+
+def seed_listing(storage):
+    # T2 and T3 share a timestamp, so the cursor has to fall back to test_id
+    storage.write(TESTCASES, [tc_row("T1", "R1", "P1", "2026-01-01T00:00:01"),
+                              tc_row("T2", "R1", "P1", "2026-01-01T00:00:02"),
+                              tc_row("T3", "R1", "P1", "2026-01-01T00:00:02"),
+                              tc_row("T4", "R1", "P1", "2026-01-01T00:00:04"),
+                              tc_row("X1", "R9", "P2", "2026-01-01T00:00:05")])
+    storage.write(TRACE_LINKS, [
+        {"req_id": "R1", "test_id": "T3", "project_id": "P1", "external_system": "Jira", "external_key": key,
+         "external_url": f"https://jira/{key}", "created_at": at}
+        for key, at in (("QA-1", "2026-01-02T00:00:00"), ("QA-2", "2026-01-03T00:00:00"))
+    ])
+
+
+def test_keyset_pages_cover_project_once_newest_first(storage):
+    seed_listing(storage)
+    seen, after = [], None
+    while True:
+        page = list(storage.iter_project_testcases("P1", ["test_id"], after, limit=2))
+        seen += [r["test_id"] for r in page]
+        if len(page) < 2:
+            break
+        after = (page[-1]["created_at"], page[-1]["test_id"])
+    assert seen == ["T4", "T3", "T2", "T1"]
+
+
+def test_keyset_projection_and_latest_trace_link(storage):
+    seed_listing(storage)
+    rows = list(storage.iter_project_testcases("P1", ["title", "external_key", "is_pushed"]))
+    # Cursor columns always come back, nothing else beyond what was asked for
+    assert set(rows[0]) == {"created_at", "test_id", "title", "external_key", "is_pushed"}
+    by_id = {r["test_id"]: r for r in rows}
+    assert len(rows) == 4
+    assert by_id["T3"]["external_key"] == "QA-2"
+    assert bool(by_id["T3"]["is_pushed"]) and not by_id["T1"]["is_pushed"]
+
+
+def test_keyset_unknown_column(storage):
+    with pytest.raises(ValueError):
+        list(storage.iter_project_testcases("P1", ["title", "password"]))
+
+
+def test_paged_endpoint_follows_next_cursor(storage, monkeypatch):
+    import main
+    from fastapi.testclient import TestClient
+
+    seed_listing(storage)
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    client = TestClient(main.app)
+
+    ids, cursor = [], None
+    for _ in range(5):
+        params = {"limit": 3, "fields": "test_id,is_pushed"}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/testcases/project/P1", params=params).json()
+        assert all(set(tc) == {"test_id", "is_pushed"} for tc in body["test_cases"])
+        ids += [tc["test_id"] for tc in body["test_cases"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == ["T4", "T3", "T2", "T1"]
+
+    assert client.get("/testcases/project/P1", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/testcases/project/P1", params={"fields": "password"}).status_code == 400
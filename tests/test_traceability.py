@@ -0,0 +1,31 @@
+import pytest
+from fastapi import HTTPException
+
+import traceability
+from storage import get_storage
+
+
+def test_fetched_at_is_per_response(monkeypatch):
+    calls = []
+
+    def fake(req_id):
+        calls.append(req_id)
+        return {"title": "Login", "text": "Users log in.", "tests": []}
+
+    monkeypatch.setattr(get_storage(), "traceability", fake)
+    stamps = iter(["2026-01-01T00:00:00Z", "2026-01-01T00:05:00Z"])
+    monkeypatch.setattr(traceability, "now", lambda: next(stamps))
+
+    first = traceability.get_traceability("REQ-TRACE")
+    second = traceability.get_traceability("REQ-TRACE", trim=True)
+    assert calls == ["REQ-TRACE"]                   # second read is a cache hit
+    assert first["fetched_at"] == "2026-01-01T00:00:00Z"
+    assert second["fetched_at"] == "2026-01-01T00:05:00Z"
+    assert "text" in first and "text" not in second
+
+
+def test_missing_requirement_is_404(monkeypatch):
+    monkeypatch.setattr(get_storage(), "traceability", lambda req_id: None)
+    with pytest.raises(HTTPException) as e:
+        traceability.get_traceability("REQ-NOPE")
+    assert e.value.status_code == 404
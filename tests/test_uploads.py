@@ -0,0 +1,94 @@
+import io, os, asyncio, hashlib
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.testclient import TestClient
+
+import uploads
+from uploads import spool_upload, spooled_uploads, UploadLimitMiddleware
+
+
+def upload(data: bytes, name: str = "req.txt") -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=name)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 4)
+    monkeypatch.setattr(uploads, "UPLOAD_TMP_DIR", str(tmp_path))
+
+
+def test_spool_copies_and_hashes(tmp_path):
+    data = b"The user shall be able to log in."
+    up = asyncio.run(spool_upload(upload(data, "dir/spec.txt"), max_bytes=1000))
+    assert up.filename == "dir/spec.txt"
+    assert up.size == len(data)
+    assert up.sha256 == hashlib.sha256(data).hexdigest()
+    assert os.path.dirname(up.path) == str(tmp_path)
+    assert up.path.endswith("-spec.txt")
+    with open(up.path, "rb") as f:
+        assert f.read() == data
+
+
+def test_per_file_limit_rejects_and_removes_temp_file(tmp_path):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(spool_upload(upload(b"x" * 11), max_bytes=10))
+    assert e.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_per_request_limit_counts_every_file(tmp_path):
+    async def main():
+        async with spooled_uploads([upload(b"a" * 8, "a.txt"), upload(b"b" * 8, "b.txt")],
+                                   max_file_bytes=10, max_request_bytes=12):
+            pass
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(main())
+    assert e.value.status_code == 413
+    assert "per-request" in e.value.detail
+    assert os.listdir(tmp_path) == []
+
+
+def test_spooled_uploads_removed_on_exit(tmp_path):
+    async def main():
+        async with spooled_uploads([upload(b"one", "a.txt"), upload(b"two", "b.txt")]) as spooled:
+            assert [u.size for u in spooled] == [3, 3]
+            assert all(os.path.exists(u.path) for u in spooled)
+            raise RuntimeError("handler failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+    assert os.listdir(tmp_path) == []
+
+
+def test_spooled_uploads_accepts_no_files():
+    async def main():
+        async with spooled_uploads(None) as spooled:
+            return spooled
+
+    assert asyncio.run(main()) == []
+
+
+def limited_client(max_bytes: int) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_bytes=max_bytes)
+
+    @app.post("/upload")
+    async def receive(request: Request):
+        return {"size": len(await request.body())}
+
+    return TestClient(app)
+
+
+def test_middleware_rejects_large_multipart_body():
+    client = limited_client(1000)
+    r = client.post("/upload", files={"file": ("a.txt", b"x" * 5000)})
+    assert r.status_code == 413
+    assert "upload size limit" in r.json()["detail"]
+
+
+def test_middleware_passes_small_and_non_multipart_bodies():
+    client = limited_client(1000)
+    assert client.post("/upload", files={"file": ("a.txt", b"x")}).status_code == 200
+    assert client.post("/upload", content=b"x" * 5000).json() == {"size": 5000}